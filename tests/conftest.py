@@ -0,0 +1,54 @@
+#=============================================================================================
+# Shared test setup
+#
+# Modules keep their state in module variables set from the configuration file, so each test
+# which needs them runs in its own folder with a fresh configuration file and empty tables.
+#=============================================================================================
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Mandatory entries of the configuration file; the optional ones take their defaults
+config_text = """UAID=test
+SECRET_KEY=test
+color_enabled=False
+logging=False
+log_unsupported_messages=False
+log_raw=False
+verbose=False
+mid_battery=2
+min_battery=1
+min_signal=-85
+max_age_minutes=60
+max_alerts=5
+send_status_emails=False
+email_addr_list=
+email_server=
+email_account_name=
+email_account_pw=
+"""
+
+@pytest.fixture
+def configured(tmp_path, monkeypatch):
+   from yl_health import config
+   from yl_health import store
+   from yl_health import stats
+   from yl_health import recent
+   from yl_health import topology
+   from yl_health import signal_stats
+
+   monkeypatch.chdir(tmp_path)
+   (tmp_path / config.config_file).write_text(config_text)
+   config.read_config_variables()
+   assert config.valid_config_file
+
+   store.dev_status_dictionary = {}
+   stats.device_stats = {}
+   recent.rings = {}
+   signal_stats.device_buckets = {}
+   signal_stats.device_hub = {}
+   topology.dark_since.clear()
+   return(config)
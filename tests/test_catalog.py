@@ -0,0 +1,63 @@
+from yl_health.catalog import Catalog, max_key_length
+
+def listed(*devices):
+   return([{'deviceId':device_id, 'name':name, 'type':device_type, 'token':'t'} for device_id, name, device_type in devices])
+
+def test_apply_adds_and_indexes():
+   catalog = Catalog()
+   added, removed, renamed = catalog.apply(listed(('d1', 'Front Door', 'DoorSensor'), ('h1', 'Hub', 'Hub')))
+   assert [d.id for d in added] == ['d1', 'h1']
+   assert removed == [] and renamed == []
+   assert catalog.get('d1').key == 'Front Door'
+   assert catalog.find('Front Door').id == 'd1'
+   assert [d.id for d in catalog.hubs()] == ['h1']
+
+def test_apply_again_changes_nothing():
+   catalog = Catalog()
+   catalog.apply(listed(('d1', 'Front Door', 'DoorSensor')))
+   assert catalog.apply(listed(('d1', 'Front Door', 'DoorSensor'))) == ([], [], [])
+
+def test_apply_removes_unlisted_devices():
+   catalog = Catalog()
+   catalog.apply(listed(('d1', 'Front Door', 'DoorSensor'), ('d2', 'Back Door', 'DoorSensor')))
+   added, removed, renamed = catalog.apply(listed(('d1', 'Front Door', 'DoorSensor')))
+   assert [d.id for d in removed] == ['d2']
+   assert catalog.get('d2') is None
+   assert catalog.find('Back Door') is None
+
+def test_rename_rekeys_device():
+   catalog = Catalog()
+   catalog.apply(listed(('d1', 'Front Door', 'DoorSensor')))
+   added, removed, renamed = catalog.apply(listed(('d1', 'Main Door', 'DoorSensor')))
+   assert added == [] and removed == []
+   assert [(d.id, old_key) for d, old_key in renamed] == [('d1', 'Front Door')]
+   assert catalog.get('d1').key == 'Main Door'
+   assert catalog.by_key.get('Front Door') is None
+
+def test_rename_while_stopped():
+   catalog = Catalog()
+   catalog.load_keys({'d1':{'name':'Front Door', 'type':'DoorSensor', 'key':'Front Door'}})
+   added, removed, renamed = catalog.apply(listed(('d1', 'Main Door', 'DoorSensor')))
+   assert [d.id for d in added] == ['d1']
+   assert [(d.key, old_key) for d, old_key in renamed] == [('Main Door', 'Front Door')]
+
+def test_saved_key_kept():
+   catalog = Catalog()
+   catalog.load_keys({'d2':{'name':'Door', 'type':'DoorSensor', 'key':'Door #0002'}})
+   catalog.apply(listed(('d1', 'Door', 'DoorSensor'), ('d2', 'Door', 'DoorSensor')))
+   assert catalog.get('d2').key == 'Door #0002'
+   assert catalog.get('d1').key == 'Door'
+
+def test_shared_names_get_unique_keys():
+   catalog = Catalog()
+   catalog.apply(listed(('d000000000000001', 'Door', 'DoorSensor'), ('d000000000000002', 'Door', 'DoorSensor')))
+   keys = [catalog.get(device_id).key for device_id in ('d000000000000001', 'd000000000000002')]
+   assert keys == ['Door', 'Door #0002']
+   assert len(catalog.by_name['Door']) == 2
+
+def test_long_names_fit_the_table():
+   catalog = Catalog()
+   catalog.apply(listed(('d1', 'x'*100, 'DoorSensor'), ('d2', 'x'*100, 'DoorSensor')))
+   keys = [d.key for d in catalog]
+   assert all(len(key) <= max_key_length for key in keys)
+   assert len(set(keys)) == 2
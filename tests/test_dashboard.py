@@ -0,0 +1,140 @@
+import json
+import time
+import socket
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from yl_health import api
+from yl_health import store
+from yl_health import dashboard
+from yl_health.catalog import Catalog
+from yl_health.common import unpack_unix_time
+
+@pytest.fixture
+def devices(configured, monkeypatch):
+   monkeypatch.setattr(dashboard, 'post', lambda message: None)
+   monkeypatch.setattr(dashboard, 'viewers', set())
+   monkeypatch.setattr(dashboard, 'snapshot_version', 0)
+   monkeypatch.setattr(dashboard, 'refresh_pending', False)
+   catalog = Catalog()
+   catalog.apply([{'deviceId':'d1', 'name':'Front Door', 'type':'DoorSensor'},
+                  {'deviceId':'d2', 'name':'Garage Door', 'type':'DoorSensor'}])
+   monkeypatch.setattr(api, 'catalog', catalog)
+
+   # Front Door reports well, Garage Door has a low battery and weak signal and went quiet
+   now = time.time()
+   for signal in (-60, -70, -50):
+      store.update_device_status('Front Door', '4', str(signal), unpack_unix_time(now*1000), 'd1', update_epoch=now)
+   old = now - 7200
+   store.update_device_status('Garage Door', '1', '-95', unpack_unix_time(old*1000), 'd2', update_epoch=old)
+   return(configured)
+
+@pytest.fixture
+def server(devices, monkeypatch):
+   monkeypatch.setattr(devices, 'dashboard_port', 0)
+   monkeypatch.setattr(devices, 'dashboard_address', '127.0.0.1')
+   monkeypatch.setattr(dashboard, 'coalesce_seconds', 0.05)
+   ports = []
+   report_addresses = dashboard.report_addresses
+   def record_port(server):
+      ports.append(server.sockets[0].getsockname()[1])
+      report_addresses(server)
+   monkeypatch.setattr(dashboard, 'report_addresses', record_port)
+
+   started = threading.Event()
+   thread = threading.Thread(target=dashboard.run_dashboard, args=(started,), daemon=True)
+   thread.start()
+   assert started.wait(5) and dashboard.dashboard_loop is not None
+   yield('http://127.0.0.1:%d' % ports[0])
+   dashboard.dashboard_loop.call_soon_threadsafe(dashboard.dashboard_loop.stop)
+   thread.join(5)
+
+def get(url, headers=None):
+   try:
+      with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=5) as response:
+         return(response.status, dict(response.headers), response.read())
+   except urllib.error.HTTPError as e:
+      return(e.code, dict(e.headers), e.read())
+
+# Function to read lines from a stream up to a blank line: the response headers, or one
+# server-sent event
+def read_event(stream):
+   lines = []
+   while True:
+      line = stream.readline()
+      if line in (b'\r\n', b'\n', b''):
+         return(lines)
+      lines.append(line.decode().rstrip('\r\n'))
+
+def test_snapshot_shows_alarms(devices):
+   snapshot = dashboard.build_snapshot()
+   front, garage = snapshot['devices']
+   assert (front['name'], front['signal'], front['min_signal'], front['alarms']) == ('Front Door', '-50', '-70', [])
+   assert len(front['signal_trend']) == 3
+   assert garage['alarms'] == ['battery', 'signal', 'stale']
+   assert garage['age_minutes'] == 120
+   assert snapshot['alarms'] == [{'name':'Garage Door', 'alarms':['battery', 'signal', 'stale'],
+                                  'battery':'1', 'signal':'-95', 'age_minutes':120}]
+
+def test_signal_trend():
+   assert dashboard.signal_trend(None) == ''
+   data = b''.join(dashboard.recent.sample.pack(0, signal, 4, 1) for signal in (-120, -80, -40, -10, -32768))
+   assert dashboard.signal_trend(data) == '▁▄██'
+
+def test_slow_viewer_gets_newest_snapshot(devices):
+   queue = asyncio.Queue(maxsize=1)
+   dashboard.viewers.add(queue)
+   dashboard.publish()
+   dashboard.publish()
+   assert queue.qsize() == 1
+   assert queue.get_nowait().startswith(b'id: 2\n')
+
+def test_api(server):
+   status, headers, body = get(server + '/api/state')
+   assert status == 200
+   state = json.loads(body)
+   assert [device['name'] for device in state['devices']] == ['Front Door', 'Garage Door']
+   assert get(server + '/api/state', {'If-None-Match':headers['ETag']})[0] == 304
+   assert [alarm['name'] for alarm in json.loads(get(server + '/api/alarms')[2])] == ['Garage Door']
+
+   status, headers, body = get(server + '/api/history?device=Front%20Door&since=1h')
+   assert status == 200
+   assert [record['signal'] for record in json.loads(body)['records']] == [-60, -70, -50]
+   assert get(server + '/api/history?device=Front%20Door&since=soon')[0] == 400
+   assert get(server + '/api/history?device=Nobody')[0] == 404
+
+   samples = json.loads(get(server + '/api/recent?device=Garage%20Door')[2])['samples']
+   assert [(sample['battery'], sample['signal'], sample['kind']) for sample in samples] == [(1, -95, 'report')]
+   assert get(server + '/api/recent?device=Nobody')[0] == 404
+
+   status, headers, body = get(server + '/')
+   assert status == 200 and b'EventSource' in body
+   assert get(server + '/nothing')[0] == 404
+
+def test_post_refused(server):
+   request = urllib.request.Request(server + '/api/state', data=b'{}', method='POST')
+   with pytest.raises(urllib.error.HTTPError) as refused:
+      urllib.request.urlopen(request, timeout=5)
+   assert refused.value.code == 405
+
+def test_events_follow_changes(server):
+   host, port = server[len('http://'):].split(':')
+   with socket.create_connection((host, int(port)), timeout=5) as connection:
+      connection.sendall(b'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+      stream = connection.makefile('rb')
+      headers = read_event(stream)
+      assert headers[0] == 'HTTP/1.1 200 OK'
+      assert 'Content-Type: text/event-stream' in headers
+      first = read_event(stream)
+      assert first[:2] == ['id: 1', 'event: snapshot']
+
+      store.update_device_status('Front Door', '3', '-65')
+      dashboard.notify()
+      second = read_event(stream)
+      assert second[:2] == ['id: 2', 'event: snapshot']
+      front = json.loads(second[2][len('data: '):])['devices'][0]
+      assert (front['battery'], front['signal']) == ('3', '-65')
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from yl_health import decoder
+
+report = {'event':'THSensor.Report', 'time':1700000000000, 'msgid':'m1', 'deviceId':'d1',
+          'data':{'state':'normal', 'battery':4, 'online':False,
+                  'loraInfo':{'signal':-71, 'gatewayId':'hub1'}}}
+
+def fields(message):
+   return([getattr(message, name) for name in decoder.Message.__slots__])
+
+def test_message_from_dict():
+   message = decoder.message_from_dict(report)
+   assert fields(message) == ['d1', 'THSensor.Report', 'm1', 1700000000000, 'normal', 4, False, -71, 'hub1']
+
+def test_message_from_dict_defaults():
+   message = decoder.message_from_dict({'deviceId':'d1'})
+   assert fields(message) == ['d1', '', None, None, '???', None, True, None, None]
+
+@pytest.mark.parametrize('data', [None, 'text', [1, 2], {'loraInfo':'text'}, {'loraInfo':None}])
+def test_message_from_dict_odd_data(data):
+   message = decoder.message_from_dict({'deviceId':'d1', 'data':data})
+   assert message.signal is None
+   assert message.hub is None
+
+@pytest.mark.parametrize('payload', [[1, 2], None, 'text', 5])
+def test_message_from_dict_not_an_object(payload):
+   with pytest.raises(ValueError):
+      decoder.message_from_dict(payload)
+
+payloads = [json.dumps(report).encode('utf-8'),
+            b'{"deviceId":"d2","event":"DoorSensor.Alert","data":{"state":"open"}}',
+            b'{"deviceId":"d3","data":"not an object"}',
+            b'{"deviceId":"d4","data":{"loraInfo":[1,2]}}']
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+def test_decoders_agree(name):
+   decoder.select('json')
+   expected = [fields(decoder.decode(p)) for p in payloads]
+   decoder.select(name)
+   assert [fields(decoder.decode(p)) for p in payloads] == expected
+
+@pytest.mark.parametrize('name', decoder.available_decoders())
+@pytest.mark.parametrize('payload', [b'[1,2]', b'null', b'"text"', b'{"deviceId":'])
+def test_decoders_reject(name, payload):
+   decoder.select(name)
+   with pytest.raises(ValueError):
+      decoder.decode(payload)
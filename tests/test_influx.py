@@ -0,0 +1,183 @@
+import os
+import time
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from yl_health import api
+from yl_health import store
+from yl_health import influx
+from yl_health import metrics
+from yl_health import history
+from yl_health.catalog import Catalog
+from yl_health.influx import escape_tag, point_line
+
+def test_point_line():
+   line = point_line('Front Door', 'd1', 'DoorSensor', '4', '-71', history.kind_report, 1700000000.5)
+   assert line == 'yolink_device,device=Front\\ Door,type=DoorSensor,id=d1,kind=report battery=4i,signal=-71i,online=true 1700000000500'
+
+def test_unknown_values_left_out():
+   line = point_line('Hub', 'h1', 'Hub', '-', '??', history.kind_contact, 1700000000)
+   assert line == 'yolink_device,device=Hub,type=Hub,id=h1,kind=contact online=true 1700000000000'
+
+def test_missing_type_and_id_left_out():
+   line = point_line('Door', None, '', 3, -60, history.kind_state, 1)
+   assert line == 'yolink_device,device=Door,kind=state battery=3i,signal=-60i,online=true 1000'
+
+def test_escape_tag():
+   assert escape_tag('a b,c=d') == 'a\\ b\\,c\\=d'
+   assert escape_tag('back\\slash') == 'back\\\\slash'
+   assert escape_tag('two\nlines') == 'two\\nlines'
+
+def test_escaped_name_keeps_line_structure():
+   line = point_line('Garage, Door=1 2', 'd1', 'DoorSensor', '4', '-71', history.kind_report, 1)
+   tags, fields, t = line.replace('\\ ', '_').split(' ')
+   assert tags == 'yolink_device,device=Garage\\,_Door\\=1_2,type=DoorSensor,id=d1,kind=report'
+   assert fields == 'battery=4i,signal=-71i,online=true'
+   assert t == '1000'
+
+#=============================================================================================
+# Sending and spooling, against a stand-in receiver
+#=============================================================================================
+class Receiver:
+   def __init__(self):
+      self.statuses = []
+      self.batches = []
+      self.clients = set()
+      receiver = self
+
+      class Handler(BaseHTTPRequestHandler):
+         protocol_version = 'HTTP/1.1'
+
+         def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            receiver.clients.add(self.client_address)
+            status = receiver.statuses.pop(0) if receiver.statuses else 204
+            if status < 300:
+               receiver.batches.append((self.path, self.headers.get('Authorization'), body.decode('utf-8').split('\n')))
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+         def log_message(self, format, *args):
+            return
+
+      self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+      self.server.daemon_threads = True
+      self.url = 'http://127.0.0.1:%d/write?db=yolink' % self.server.server_address[1]
+      threading.Thread(target=self.server.serve_forever, args=(0.1,), daemon=True).start()
+
+   def points(self):
+      return([line for path, token, lines in self.batches for line in lines])
+
+@pytest.fixture
+def receiver(configured, monkeypatch):
+   monkeypatch.setattr(influx, 'post', lambda message: None)
+   monkeypatch.setattr(metrics, 'counters', {})
+   monkeypatch.setattr(metrics, 'gauges', {})
+   receiver = Receiver()
+   yield(receiver)
+   receiver.server.shutdown()
+   receiver.server.server_close()
+
+def lines(first, count):
+   return(['p%d' % i for i in range(first, first+count)])
+
+def test_batches_sent_over_one_connection(receiver):
+   sink = influx.Sink(receiver.url, token='secret', batch_size=3)
+   for line in lines(0, 7):
+      sink.add(line)
+   assert sink.flush() == 7
+   sink.close()
+   assert [len(batch) for path, token, batch in receiver.batches] == [3, 3, 1]
+   assert receiver.points() == lines(0, 7)
+   assert receiver.batches[0][:2] == ('/write?db=yolink&precision=ms', 'Token secret')
+   assert len(receiver.clients) == 1
+   assert metrics.counters['yolink_influx_points_total'] == 7
+   assert metrics.counters['yolink_influx_batches_total'] == 3
+
+def test_spooled_while_unreachable_then_replayed(receiver):
+   sink = influx.Sink(receiver.url, batch_size=2)
+   receiver.statuses = [503]
+   for line in lines(0, 3):
+      sink.add(line)
+   assert sink.flush() == 0
+   assert sink.reachable == False
+   assert sink.spooled == 3 and influx.count_spooled() == 3
+   assert open(influx.spool_file).read() == 'p0\np1\np2\n'
+
+   # The next batch that gets through is followed by the spool, oldest first
+   sink.add('p3')
+   assert sink.flush() == 1
+   assert receiver.points() == ['p3', 'p0', 'p1', 'p2']
+   assert sink.reachable and sink.spooled == 0
+   assert os.path.exists(influx.spool_file) == False
+   assert metrics.counters['yolink_influx_failures_total'] == 1
+
+def test_spool_kept_by_next_sink(receiver):
+   sink = influx.Sink(receiver.url)
+   receiver.statuses = [429]
+   sink.add('p0')
+   sink.flush()
+   assert influx.Sink(receiver.url).spooled == 1
+   assert metrics.gauges['yolink_influx_spooled_points'] == 1
+
+def test_spooled_when_connection_refused(receiver):
+   unused = socket.socket()
+   unused.bind(('127.0.0.1', 0))
+   port = unused.getsockname()[1]
+   unused.close()
+   sink = influx.Sink('http://127.0.0.1:%d/write?db=yolink' % port, timeout=2)
+   sink.add('p0')
+   assert sink.flush() == 0
+   assert influx.count_spooled() == 1
+
+def test_rejected_batch_dropped(receiver):
+   sink = influx.Sink(receiver.url, batch_size=1)
+   receiver.statuses = [400]
+   sink.add('bad')
+   sink.add('p1')
+   assert sink.flush() == 1
+   assert receiver.points() == ['p1']
+   assert sink.spooled == 0
+   assert metrics.counters['yolink_influx_rejected_points_total'] == 1
+
+def test_full_spool_drops_oldest(receiver):
+   sink = influx.Sink(receiver.url, batch_size=10, spool_bytes=40)
+   receiver.statuses = [503]*5
+   for first in range(0, 20, 5):
+      for line in lines(first, 5):
+         sink.add(line)
+      sink.flush()
+   kept = open(influx.spool_file).read().split()
+   assert kept == lines(20-len(kept), len(kept))
+   assert len(''.join(line+'\n' for line in kept)) <= 40
+   assert metrics.counters['yolink_influx_dropped_points_total'] == 20 - len(kept)
+   assert sink.spooled == len(kept)
+
+def test_thread_sends_full_batches_and_rest_on_stop(receiver):
+   sink = influx.Sink(receiver.url, batch_size=5, flush_seconds=60)
+   sink.start()
+   for line in lines(0, 5):
+      sink.add(line)
+   for i in range(100):
+      if len(receiver.batches) > 0:
+         break
+      time.sleep(0.02)
+   assert receiver.points() == lines(0, 5)
+   sink.add('p5')
+   sink.stop()
+   assert receiver.points() == lines(0, 6)
+   assert sink.thread.is_alive() == False
+
+def test_store_updates_sent_with_device_type(receiver, monkeypatch):
+   catalog = Catalog()
+   catalog.apply([{'deviceId':'d1', 'name':'Front Door', 'type':'DoorSensor'}])
+   monkeypatch.setattr(api, 'catalog', catalog)
+   monkeypatch.setattr(influx, 'sink', influx.Sink(receiver.url))
+   monkeypatch.setattr(store, 'update_listeners', [influx.record_update])
+   store.update_device_status('Front Door', '4', '-71', '2023-11-14 10:13:20 PM', 'd1', update_epoch=1700000000)
+   influx.sink.flush()
+   assert receiver.points() == ['yolink_device,device=Front\\ Door,type=DoorSensor,id=d1,kind=report battery=4i,signal=-71i,online=true 1700000000000']
@@ -0,0 +1,149 @@
+import sys
+import json
+import time
+import types
+import datetime
+import threading
+from collections import OrderedDict
+
+import pytest
+
+from yl_health import api
+from yl_health import store
+from yl_health import stats
+from yl_health import metrics
+from yl_health import decoder
+from yl_health import mqtt_ingest
+from yl_health.catalog import Catalog
+
+class FakeClient:
+   def __init__(self):
+      self.connects = 0
+      self.username = None
+      self.connected = threading.Event()
+
+   def username_pw_set(self, username=None):
+      self.username = username
+
+   def connect(self, host=None, port=None, keepalive=None):
+      self.connects += 1
+      self.connected.set()
+
+   def loop(self, timeout=1.0):
+      time.sleep(0.01)
+      return(0)
+
+   def disconnect(self):
+      pass
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+   monkeypatch.setattr(mqtt_ingest, 'reconnect_min_delay', 0.01)
+   monkeypatch.setattr(mqtt_ingest, 'reconnect_max_delay', 0.02)
+   monkeypatch.setattr(mqtt_ingest, 'connect_failures', 0)
+   monkeypatch.setattr(mqtt_ingest, 'auth_failed', True)
+
+def test_token_refused_raises(configured, monkeypatch):
+   # Stand-in for the requests library, answering the token request with an error
+   requests = types.ModuleType('requests')
+   requests.post = lambda url, headers=None, data=None: types.SimpleNamespace(status_code=503)
+   structures = types.ModuleType('requests.structures')
+   structures.CaseInsensitiveDict = dict
+   monkeypatch.setitem(sys.modules, 'requests', requests)
+   monkeypatch.setitem(sys.modules, 'requests.structures', structures)
+
+   with pytest.raises(Exception, match='503'):
+      api.YL_refresh_credentials()
+   assert api.YL_token_valid == False
+
+def test_supervisor_retries_token_refresh(monkeypatch, fast_backoff):
+   attempts = []
+   def refresh():
+      attempts.append(time.monotonic())
+      if len(attempts) < 3:
+         raise Exception("Unable to obtain access token (HTTP status 503)")
+      api.YL_access_token = 'new token'
+   monkeypatch.setattr(api, 'YL_refresh_credentials', refresh)
+
+   client = FakeClient()
+   stop = threading.Event()
+   supervisor = threading.Thread(target=mqtt_ingest.YL_supervise_connection, args=(client, stop), daemon=True)
+   supervisor.start()
+   assert client.connected.wait(5)
+   stop.set()
+   supervisor.join(5)
+
+   assert len(attempts) == 3
+   assert client.connects == 1
+   assert client.username == 'new token'
+   assert mqtt_ingest.auth_failed == False
+   assert mqtt_ingest.connect_failures == 2
+
+#=============================================================================================
+# Duplicate and out-of-order messages
+#=============================================================================================
+@pytest.fixture
+def fresh_checks(monkeypatch):
+   monkeypatch.setattr(mqtt_ingest, 'seen_msgids', OrderedDict())
+   monkeypatch.setattr(mqtt_ingest, 'event_watermark', {})
+
+@pytest.fixture
+def receiving(configured, fresh_checks, monkeypatch):
+   monkeypatch.setattr(metrics, 'counters', {})
+   monkeypatch.setattr(mqtt_ingest, 'display_table', lambda: None)
+   monkeypatch.setattr(mqtt_ingest, 'message_router', None)
+   mqtt_ingest.build_event_table()
+   decoder.select('json')
+   catalog = Catalog()
+   catalog.apply([{'deviceId':'d1', 'name':'Front Door', 'type':'DoorSensor'}])
+   monkeypatch.setattr(api, 'catalog', catalog)
+
+def message(msgid, event_time, signal=-60):
+   return(types.SimpleNamespace(payload=json.dumps({'event':'DoorSensor.Report', 'time':event_time, 'msgid':msgid,
+                                                    'deviceId':'d1', 'data':{'state':'closed', 'battery':4,
+                                                    'loraInfo':{'signal':signal}}}).encode('utf-8')))
+
+def test_duplicate_message_ids(fresh_checks):
+   assert mqtt_ingest.duplicate_message(None) == False
+   assert mqtt_ingest.duplicate_message(None) == False
+   assert mqtt_ingest.duplicate_message('a') == False
+   assert mqtt_ingest.duplicate_message('b') == False
+   assert mqtt_ingest.duplicate_message('a') == True
+
+def test_message_ids_forgotten(fresh_checks, monkeypatch):
+   monkeypatch.setattr(mqtt_ingest, 'dedupe_size', 3)
+   for msgid in 'abcd':
+      mqtt_ingest.duplicate_message(msgid)
+   assert list(mqtt_ingest.seen_msgids) == ['b', 'c', 'd']
+
+   # Remembered for dedupe_seconds only
+   now = time.monotonic()
+   monkeypatch.setattr(time, 'monotonic', lambda: now + mqtt_ingest.dedupe_seconds + 1)
+   assert mqtt_ingest.duplicate_message('e') == False
+   assert list(mqtt_ingest.seen_msgids) == ['e']
+   assert mqtt_ingest.duplicate_message('b') == False
+
+def test_event_time_watermark(fresh_checks):
+   assert mqtt_ingest.check_event_time('d1', None) == (None, False)
+   assert mqtt_ingest.check_event_time('d1', '1000') == (None, False)
+   assert mqtt_ingest.check_event_time('d1', 2000) == (2000, False)
+   assert mqtt_ingest.check_event_time('d1', 2000) == (2000, False)
+   assert mqtt_ingest.check_event_time('d1', 1500) == (1500, True)
+   assert mqtt_ingest.check_event_time('d2', 1500) == (1500, False)
+
+def test_duplicate_and_late_messages_dropped(receiving):
+   now = int(time.time()*1000)
+   mqtt_ingest.handle_message(message('m1', now, -60))
+   mqtt_ingest.handle_message(message('m1', now, -70))
+   mqtt_ingest.handle_message(message('m0', now-1000, -80))
+   assert store.dev_status_dictionary['Front Door'][1] == '-60'
+   assert stats.get_stats('Front Door').count == 1
+   assert metrics.counters['yolink_messages_total'] == 3
+   assert metrics.counters['yolink_messages_duplicate_total'] == 1
+   assert metrics.counters['yolink_messages_reordered_total'] == 1
+
+def test_delayed_message_recorded_at_event_time(receiving):
+   sent = int(time.time() - 600)*1000
+   mqtt_ingest.handle_message(message('m1', sent))
+   assert store.dev_status_dictionary['Front Door'][3] == datetime.datetime.fromtimestamp(sent/1000).strftime('%Y-%m-%d %I:%M:%S %p')
+   assert stats.get_stats('Front Door').age_minutes() == 10
@@ -0,0 +1,208 @@
+import time
+import asyncio
+
+import pytest
+
+from yl_health import metrics
+from yl_health import notifiers
+
+# Backend names, with the push backend in both formats
+backends = ['email', 'webhook', 'ntfy', 'gotify', 'syslog', 'mqtt']
+
+# Backends whose server answers, so that a send can be refused or time out
+answering = ['email', 'webhook', 'ntfy', 'gotify', 'mqtt']
+
+# Backends which use the asyncio HTTP client or send directly in the asyncio runtime
+async_backends = ['email', 'webhook', 'ntfy', 'gotify', 'syslog']
+
+alerts = [("Yolink Device Alert 1", "Battery Level 1 on Device Front Door"),
+          ("Yolink Device Alert 2", "Signal Level -101 on Device Garage")]
+
+@pytest.fixture
+def counters(monkeypatch):
+   monkeypatch.setattr(metrics, 'counters', {})
+   monkeypatch.setattr(notifiers, 'min_retry_delay', 0.01)
+   return(metrics.counters)
+
+@pytest.fixture
+def receiver(configured, counters, monkeypatch):
+   started = []
+   def start(name, fail=0, delay=0, async_mode=False):
+      if name in ('webhook', 'ntfy', 'gotify') and async_mode == False:
+         pytest.importorskip('requests')
+      if name == 'mqtt':
+         pytest.importorskip('paho.mqtt.client')
+      backend = 'push' if name in ('ntfy', 'gotify') else name
+      server = notifiers.stand_in(backend, fail=fail, delay=delay)
+      started.append(server)
+      address = '127.0.0.1:%s' % server.server_address[1]
+      monkeypatch.setattr(configured, 'email_server', address)
+      monkeypatch.setattr(configured, 'email_ssl', False)
+      monkeypatch.setattr(configured, 'email_account_name', 'monitor@example.com')
+      monkeypatch.setattr(configured, 'email_addr_list', ['owner@example.com'])
+      monkeypatch.setattr(configured, 'webhook_url', 'http://%s/alert' % address)
+      monkeypatch.setattr(configured, 'push_url', 'http://%s/yolink' % address)
+      monkeypatch.setattr(configured, 'push_format', name)
+      monkeypatch.setattr(configured, 'syslog_address', address)
+      monkeypatch.setattr(configured, 'mqtt_notify_broker', address)
+      return(backend, server)
+   yield start
+   for server in started:
+      server.shutdown()
+      server.server_close()
+
+def notifier(backend, retries=0, timeout=2, per_minute=0):
+   return(notifiers.notifier_classes[backend]({'retries':retries, 'timeout':timeout, 'per_minute':per_minute}))
+
+# Function to start a notifier on a thread, waiting for the MQTT client to connect
+def started(backend, server, **settings):
+   n = notifier(backend, **settings)
+   n.start()
+   if backend == 'mqtt':
+      for i in range(200):
+         if n.client.is_connected():
+            break
+         time.sleep(0.01)
+   return(n)
+
+def stop(n):
+   n.queue.put(None)
+   n.thread.join(5)
+   if n.name == 'mqtt':
+      n.client.disconnect()
+      n.client.loop_stop()
+   return()
+
+# Function to wait until a stand-in has received a number of alerts (UDP sends don't wait)
+def wait_received(server, count):
+   for i in range(200):
+      if len(server.received) >= count:
+         break
+      time.sleep(0.01)
+   return(server.received)
+
+def label(backend):
+   return('{backend="%s"}' % backend)
+
+#=============================================================================================
+# Sending thread
+#=============================================================================================
+@pytest.mark.parametrize('name', backends)
+def test_alerts_delivered_in_order(receiver, counters, name):
+   backend, server = receiver(name)
+   n = started(backend, server)
+   for subject, message in alerts:
+      assert n.submit(subject, message)
+   n.queue.join()
+   stop(n)
+   assert wait_received(server, 2) == alerts
+   assert counters['yolink_alerts_sent_total' + label(backend)] == 2
+
+@pytest.mark.parametrize('name', answering)
+def test_refused_alert_retried(receiver, counters, name):
+   backend, server = receiver(name, fail=2)
+   n = started(backend, server, retries=3, timeout=0.5)
+   n.submit(*alerts[0])
+   n.queue.join()
+   stop(n)
+   assert server.attempts == 3
+   assert server.received == [alerts[0]]
+   assert counters['yolink_alerts_sent_total' + label(backend)] == 1
+
+@pytest.mark.parametrize('name', answering)
+def test_gives_up_after_retries(receiver, counters, name):
+   backend, server = receiver(name, fail=-1)
+   n = started(backend, server, retries=2, timeout=0.5)
+   n.submit(*alerts[0])
+   n.submit(*alerts[1])
+   n.queue.join()
+   stop(n)
+   assert server.attempts == 6
+   assert server.received == []
+   assert counters['yolink_alerts_failed_total' + label(backend)] == 2
+   assert 'yolink_alerts_sent_total' + label(backend) not in counters
+
+@pytest.mark.parametrize('name', answering)
+def test_slow_server_times_out(receiver, counters, name):
+   backend, server = receiver(name, delay=2)
+   n = started(backend, server, retries=1, timeout=0.3)
+   start = time.monotonic()
+   n.submit(*alerts[0])
+   n.queue.join()
+   elapsed = time.monotonic() - start
+   stop(n)
+   assert elapsed < 1.5
+   assert counters['yolink_alerts_failed_total' + label(backend)] == 1
+
+@pytest.mark.parametrize('name', backends)
+def test_rate_limited(receiver, counters, name):
+   backend, server = receiver(name)
+   n = started(backend, server, per_minute=600)
+   start = time.monotonic()
+   for i in range(4):
+      n.submit("Alert %s" % i, "Message %s" % i)
+   n.queue.join()
+   elapsed = time.monotonic() - start
+   stop(n)
+   # One alert at once, then one every 0.1 seconds
+   assert elapsed >= 0.28
+   assert len(wait_received(server, 4)) == 4
+
+@pytest.mark.parametrize('backend', sorted(notifiers.notifier_classes))
+def test_full_queue_drops_alerts(counters, monkeypatch, backend):
+   monkeypatch.setattr(notifiers, 'queue_size', 2)
+   n = notifier(backend)
+   assert [n.submit(*alerts[0]) for i in range(3)] == [True, True, False]
+   assert counters['yolink_alerts_dropped_total' + label(backend)] == 1
+
+def test_send_alert_queues_on_every_backend(counters, monkeypatch):
+   monkeypatch.setattr(notifiers, 'queue_size', 1)
+   active = [notifier('webhook'), notifier('syslog')]
+   monkeypatch.setattr(notifiers, 'active_notifiers', active)
+   assert notifiers.send_alert(*alerts[0]) == 2
+   assert notifiers.send_alert(*alerts[1]) == 0
+   assert [n.queue.get_nowait()[:2] for n in active] == [alerts[0], alerts[0]]
+
+#=============================================================================================
+# Asyncio runtime
+#=============================================================================================
+
+# Function to send alerts from sending tasks on an event loop, as aio.py does
+def send_async(n, sent):
+   async def run():
+      n.start_async()
+      for subject, message in sent:
+         n.submit(subject, message)
+      await n.queue.join()
+      n.task.cancel()
+   asyncio.run(run())
+   return()
+
+@pytest.mark.parametrize('name', async_backends)
+def test_alerts_delivered_async(receiver, counters, name):
+   backend, server = receiver(name, async_mode=True)
+   send_async(notifier(backend), alerts)
+   assert wait_received(server, 2) == alerts
+   assert counters['yolink_alerts_sent_total' + label(backend)] == 2
+
+@pytest.mark.parametrize('name', ['email', 'webhook', 'ntfy', 'gotify'])
+def test_refused_alert_retried_async(receiver, counters, name):
+   backend, server = receiver(name, fail=1, async_mode=True)
+   send_async(notifier(backend, retries=1, timeout=1), alerts[:1])
+   assert server.attempts == 2
+   assert server.received == alerts[:1]
+
+@pytest.mark.parametrize('name', ['email', 'webhook', 'ntfy', 'gotify'])
+def test_slow_server_times_out_async(receiver, counters, name):
+   backend, server = receiver(name, delay=2, async_mode=True)
+   start = time.monotonic()
+   send_async(notifier(backend, timeout=0.3), alerts[:1])
+   assert time.monotonic() - start < 1.5
+   assert counters['yolink_alerts_failed_total' + label(backend)] == 1
+
+def test_rate_limited_async(receiver, counters):
+   backend, server = receiver('syslog', async_mode=True)
+   start = time.monotonic()
+   send_async(notifier(backend, per_minute=600), [("Alert %s" % i, "Message") for i in range(4)])
+   assert time.monotonic() - start >= 0.28
+   assert len(wait_received(server, 4)) == 4
@@ -0,0 +1,77 @@
+import time
+import types
+import datetime
+
+import pytest
+
+from yl_health import store
+from yl_health import stats
+from yl_health import prober
+from yl_health.common import timestamp
+
+device = types.SimpleNamespace(key='Front Door', id='d1', type='DoorSensor')
+success = {'status':'Success', 'online':True}
+
+@pytest.fixture
+def reported(configured, monkeypatch):
+   monkeypatch.setattr(prober, 'probe_results', {})
+   # Last report two hours ago
+   last = time.time() - 7200
+   update_time = datetime.datetime.fromtimestamp(last).strftime('%Y-%m-%d %I:%M:%S %p')
+   store.update_device_status(device.key, '4', '-70', update_time, device.id, update_epoch=last)
+   return(last)
+
+def response(report_at=None, battery=3, signal=-60, online=True):
+   data = {'online':online, 'state':{'battery':battery}, 'loraInfo':{'signal':signal}}
+   if report_at is not None:
+      data['reportAt'] = datetime.datetime.fromtimestamp(report_at, datetime.timezone.utc).isoformat().replace('+00:00','Z')
+   return({'desc':'Success', 'data':data})
+
+def test_online_without_report_time_leaves_device_to_age(reported):
+   record = list(store.dev_status_dictionary[device.key])
+   count = stats.get_stats(device.key).count
+
+   assert prober.record_probe(device, success, response()) == 'online'
+   assert store.dev_status_dictionary[device.key] == record
+   assert stats.get_stats(device.key).count == count
+   assert stats.get_stats(device.key).age_minutes() >= 119
+   assert 'on line when checked' in prober.probe_note(device.key)
+
+def test_online_with_known_report_leaves_device_to_age(reported):
+   record = list(store.dev_status_dictionary[device.key])
+   assert prober.record_probe(device, success, response(int(reported))) == 'online'
+   assert store.dev_status_dictionary[device.key] == record
+   assert stats.get_stats(device.key).count == 1
+
+def test_quiet_device_still_goes_stale(reported, monkeypatch):
+   monkeypatch.setattr(stats.DeviceStats, 'stale_minutes', lambda self: 60)
+   for i in range(3):
+      prober.record_probe(device, success, response())
+   device_stats = stats.get_stats(device.key)
+   assert device_stats.age_minutes() > device_stats.stale_minutes()
+
+def test_missed_report_recorded_at_its_time(reported):
+   missed = int(time.time() - 600)
+   assert prober.record_probe(device, success, response(missed)) == 'online'
+   record = store.dev_status_dictionary[device.key]
+   assert record[:2] == ['3', '-60']
+   assert record[3] == datetime.datetime.fromtimestamp(missed).strftime('%Y-%m-%d %I:%M:%S %p')
+   assert stats.get_stats(device.key).last_time == missed
+   assert stats.get_stats(device.key).age_minutes() == 10
+
+def test_missed_report_keeps_missing_fields(reported):
+   data = response(time.time() - 60)
+   del data['data']['state'], data['data']['loraInfo']
+   prober.record_probe(device, success, data)
+   assert store.dev_status_dictionary[device.key][:2] == ['4', '-70']
+
+def test_offline(reported):
+   record = list(store.dev_status_dictionary[device.key])
+   assert prober.record_probe(device, {'status':'Success', 'online':False}, response(time.time(), online=False)) == 'offline'
+   assert store.dev_status_dictionary[device.key] == record
+   assert 'off line when checked' in prober.probe_note(device.key)
+
+def test_failed_request(reported):
+   assert prober.record_probe(device, {'status':'Failed', 'online':False}, []) == 'unknown'
+   assert prober.probe_note(device.key) == ''
+   assert device.key not in prober.in_flight
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from yl_health.ratelimit import RateLimiter
+
+def test_burst_then_wait():
+   limiter = RateLimiter(60, burst=3)
+   assert [limiter.take() for i in range(3)] == [0, 0, 0]
+   assert limiter.take() == pytest.approx(1.0, abs=0.05)
+
+def test_throttled_halves_rate_and_recovers():
+   limiter = RateLimiter(120)
+   limiter.throttled()
+   assert limiter.rate == pytest.approx(1.0)
+   assert limiter.tokens == 0
+   for i in range(100):
+      limiter.succeeded()
+   assert limiter.rate == pytest.approx(limiter.max_rate)
+
+def test_rate_never_below_minimum():
+   limiter = RateLimiter(60)
+   for i in range(20):
+      limiter.throttled()
+   assert limiter.rate == pytest.approx(limiter.max_rate/16)
+   assert limiter.throttle_count == 20
+
+@pytest.mark.parametrize('per_minute', [0, -5])
+def test_zero_or_negative_rate_is_unlimited(per_minute):
+   limiter = RateLimiter(per_minute)
+   assert [limiter.take() for i in range(1000)] == [0]*1000
+   limiter.succeeded()
+   assert limiter.take() == 0
+   assert limiter.unlimited
+
+def test_unlimited_rate_adapts_once_throttled():
+   limiter = RateLimiter(0)
+   for i in range(120):
+      limiter.take()
+   limiter.throttled()
+   assert limiter.unlimited == False
+   assert limiter.max_rate == pytest.approx(2.0)
+   assert limiter.rate == pytest.approx(1.0)
+   assert limiter.take() > 0
+   for i in range(100):
+      limiter.succeeded()
+   assert limiter.rate == pytest.approx(2.0)
+   limiter.throttled()
+   assert limiter.rate == pytest.approx(1.0)
+   assert limiter.throttle_count == 2
+
+def test_unlimited_rate_counts_only_the_last_minute(monkeypatch):
+   now = [1000.0]
+   monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+   limiter = RateLimiter(0)
+   for i in range(100):
+      limiter.take()
+   now[0] += 61
+   for i in range(30):
+      limiter.take()
+   assert len(limiter.recent) == 30
+   limiter.throttled()
+   assert limiter.max_rate*60 == pytest.approx(30)
+
+def test_throttled_before_any_request():
+   limiter = RateLimiter(0)
+   limiter.throttled()
+   assert limiter.max_rate*60 == pytest.approx(1)
+
+def test_concurrent_requests_capped():
+   limiter = RateLimiter(0, max_concurrent=2)
+   limiter.acquire()
+   limiter.acquire()
+   assert limiter.slots.acquire(blocking=False) == False
+   limiter.release()
+   assert limiter.slots.acquire(blocking=False) == True
@@ -0,0 +1,159 @@
+import time
+import queue
+import datetime
+from collections import OrderedDict
+
+import pytest
+
+from yl_health import store
+from yl_health import stats
+from yl_health import recent
+from yl_health import history
+from yl_health import metrics
+from yl_health import decoder
+from yl_health import mqtt_ingest
+from yl_health import signal_stats
+from yl_health import shared_ingest
+from yl_health.catalog import Catalog
+
+devices = [{'deviceId':'d%015d' % i, 'name':'Sensor %d' % i, 'type':'THSensor'} for i in range(3)]
+
+@pytest.fixture
+def ingest(configured, monkeypatch):
+   table = shared_ingest.DeviceTable(bytearray(shared_ingest.table_size(4, 1)), 4)
+   monkeypatch.setattr(shared_ingest, 'table', table)
+   monkeypatch.setattr(shared_ingest, 'queues', [queue.Queue()])
+   monkeypatch.setattr(shared_ingest, 'slot_of', {})
+   monkeypatch.setattr(shared_ingest, 'slot_by_name', {})
+   monkeypatch.setattr(shared_ingest, 'slot_devices', [])
+   monkeypatch.setattr(shared_ingest, 'last_records', [])
+   monkeypatch.setattr(shared_ingest, 'counted', [0]*len(shared_ingest.counter_names))
+   monkeypatch.setattr(metrics, 'counters', {})
+   monkeypatch.setattr(store, 'live_source', None)
+   catalog = Catalog()
+   catalog.apply(devices)
+   shared_ingest.update_catalog(catalog)
+   return(table)
+
+# Function to write updates to a record as a worker does.  Each is (kind, time, battery,
+# signal); returns the header.
+def write_updates(table, slot, updates, header=None):
+   header = header or [0, 0, 0.0]
+   for kind, t, battery, signal in updates:
+      header[0] += 1
+      table.write(slot, *header, (kind, t, battery, signal, b'hub1'))
+   return(header)
+
+def table_time(t):
+   return(datetime.datetime.fromtimestamp(int(t)).strftime('%Y-%m-%d %I:%M:%S %p'))
+
+def test_read_unpacks_updates_after_first():
+   table = shared_ingest.DeviceTable(bytearray(shared_ingest.table_size(2, 1)), 2)
+   assert table.read(0) == (0, 0, 0, 0.0, [])
+   assert table.latest(0) == (0.0, None)
+   write_updates(table, 1, [(shared_ingest.kind_report, 100.0+n, 4, -60-n) for n in range(3)])
+
+   seq, updates, touches, touch_time, entries = table.read(1, 1)
+   assert (seq, updates, touches) == (6, 3, 0)
+   assert [(t, n, battery, signal) for t, n, kind, battery, signal, hub in entries] == [(101.0, 1, 4, -61), (102.0, 2, 4, -62)]
+   assert table.latest(1)[1][:3] == (102.0, 4, -62)
+   assert table.read(0) == (0, 0, 0, 0.0, [])
+
+def test_read_keeps_only_last_queue():
+   table = shared_ingest.DeviceTable(bytearray(shared_ingest.table_size(1, 1)), 1)
+   count = shared_ingest.queue_depth + 3
+   write_updates(table, 0, [(shared_ingest.kind_report, float(n), 4, -60) for n in range(count)])
+   entries = table.read(0)[4]
+   assert [n for t, n, kind, battery, signal, hub in entries] == list(range(3, count))
+
+def test_read_retries_while_written():
+   table = shared_ingest.DeviceTable(bytearray(shared_ingest.table_size(1, 1)), 1)
+   table.buffer[0] = 1
+   assert table.read(0) is None
+   assert table.latest(0) is None
+
+def test_worker_writes_reports(configured, monkeypatch):
+   monkeypatch.setattr(mqtt_ingest, 'seen_msgids', OrderedDict())
+   monkeypatch.setattr(mqtt_ingest, 'event_watermark', {})
+   mqtt_ingest.build_event_table()
+   decoder.select('json')
+   table = shared_ingest.DeviceTable(bytearray(shared_ingest.table_size(2, 1)), 2)
+   worker = shared_ingest.Worker(0, table, {'d%015d' % 0:0, 'd%015d' % 1:1})
+
+   payloads = shared_ingest.generate_payloads(20, 2)
+   worker.handle_item(payloads)
+   assert table.read_counters(0)[:2] == (20, 1)
+   seq, updates, touches, touch_time, entries = table.read(0)
+   assert updates == 10
+   t, n, kind, battery, signal, hub = entries[-1]
+   assert (kind, battery, signal, hub.rstrip(b'\0')) == (shared_ingest.kind_report, 4, -60, b'hub0000000000000')
+
+def test_sync_applies_updates_in_one_batch(ingest, monkeypatch):
+   batches = []
+   apply_updates = store.apply_updates
+   monkeypatch.setattr(store, 'apply_updates', lambda updates: batches.append(list(updates)) or apply_updates(updates))
+   start = time.time() - 300
+   write_updates(ingest, 0, [(shared_ingest.kind_report, start, 4, -70), (shared_ingest.kind_report, start+60, 3, -80)])
+   write_updates(ingest, 1, [(shared_ingest.kind_contact, start+30, history.battery_unknown, history.signal_unknown)])
+
+   assert shared_ingest.sync() == 2
+   assert len(batches) == 1 and len(batches[0]) == 3
+   assert store.dev_status_dictionary['Sensor 0'][:4] == ['3', '-80', '-80', table_time(start+60)]
+   assert store.dev_status_dictionary['Sensor 1'][:2] == ['-', '??']
+   assert stats.get_stats('Sensor 0').count == 2
+   assert len(recent.samples('Sensor 0')) == 2
+   assert signal_stats.device_hub['Sensor 0'] == 'hub1'
+
+   # Nothing new
+   assert shared_ingest.sync() == 0
+   assert len(batches) == 1
+
+def test_sync_applies_touches_and_counts_overruns(ingest):
+   start = time.time() - 600
+   header = write_updates(ingest, 0, [(shared_ingest.kind_report, start+n, 4, -60) for n in range(shared_ingest.queue_depth+2)])
+   assert shared_ingest.sync() == shared_ingest.queue_depth
+   assert metrics.counters['yolink_messages_overrun_total'] == 2
+
+   header[1] += 1
+   header[2] = start + 120
+   ingest.write(0, *header)
+   assert shared_ingest.sync() == 0
+   assert store.dev_status_dictionary['Sensor 0'][3] == table_time(start+120)
+   assert stats.get_stats('Sensor 0').last_time == start + 120
+
+def test_current_status_reads_table_ahead_of_sync(ingest, monkeypatch):
+   monkeypatch.setattr(store, 'live_source', shared_ingest.live_status)
+   start = time.time() - 3600
+   header = write_updates(ingest, 0, [(shared_ingest.kind_report, start, 4, -70)])
+   shared_ingest.sync()
+
+   # A newer report not yet applied
+   write_updates(ingest, 0, [(shared_ingest.kind_report, start+1800, 2, -90)], header)
+   status = dict((name, (record, last_time)) for name, record, last_time in store.current_status())
+   record, last_time = status['Sensor 0']
+   assert record[:4] == ['2', '-90', '-90', table_time(start+1800)]
+   assert last_time == start + 1800
+   assert stats.minutes_since(last_time) == 30
+   assert store.dev_status_dictionary['Sensor 0'][:2] == ['4', '-70']
+
+def test_live_status_of_unknown_device(ingest):
+   assert shared_ingest.live_status('Nobody') is None
+   assert shared_ingest.live_status('Sensor 2') == (None, None, None, 0.0)
+
+def test_apply_updates_matches_update_device_status(configured):
+   start = time.time() - 3600
+   reports = [('4', '-70', start), ('4', '-82', start+600), ('3', '??', start+1200), ('3', '-75', start+1800)]
+   for battery, signal, t in reports:
+      store.update_device_status('One', battery, signal, table_time(t), 'd1', update_epoch=t)
+   assert store.apply_updates([('Two', 'd2', history.kind_report, battery, signal, t) for battery, signal, t in reports]) == 4
+
+   assert store.dev_status_dictionary['One'] == store.dev_status_dictionary['Two']
+   one, two = stats.get_stats('One'), stats.get_stats('Two')
+   assert (one.count, one.mean, one.max_gap) == (two.count, two.mean, two.max_gap)
+   assert recent.samples('One') == recent.samples('Two')
+
+def test_apply_updates_drops_older_reports(configured):
+   now = time.time()
+   store.update_device_status('One', '4', '-70', table_time(now), 'd1', update_epoch=now)
+   assert store.apply_updates([('One', 'd1', history.kind_report, '2', '-90', now-60)]) == 0
+   assert store.dev_status_dictionary['One'][:2] == ['4', '-70']
@@ -0,0 +1,59 @@
+import json
+
+from yl_health import store
+from yl_health import stats
+from yl_health import history
+from yl_health import standby
+from yl_health import topology
+
+def entry(name, signal, kind, t, battery='4', device_id=None):
+   return(json.dumps([name, device_id, battery, signal, kind, t]))
+
+def test_reports_applied_in_order(configured):
+   assert standby.apply_entry(entry('Door', '-60', history.kind_report, 1700000000.2))
+   assert standby.apply_entry(entry('Door', '-65', history.kind_report, 1700000060.7))
+   assert store.dev_status_dictionary['Door'][1] == '-65'
+   assert stats.get_stats('Door').last_time == 1700000060.7
+
+def test_reports_in_the_same_second(configured):
+   standby.apply_entry(entry('Door', '-60', history.kind_report, 1700000000.2))
+   standby.apply_entry(entry('Door', '-61', history.kind_report, 1700000000.6))
+   assert store.dev_status_dictionary['Door'][1] == '-61'
+   assert stats.get_stats('Door').gaps() == 1
+
+def test_older_report_not_applied(configured):
+   standby.apply_entry(entry('Door', '-65', history.kind_report, 1700000060))
+   standby.apply_entry(entry('Door', '-60', history.kind_report, 1700000000))
+   assert store.dev_status_dictionary['Door'][1] == '-65'
+   assert stats.get_stats('Door').gaps() == 0
+
+def test_contact_after_report(configured):
+   standby.apply_entry(entry('Hub', '-50', history.kind_report, 1700000000))
+   standby.apply_entry(entry('Hub', '??', history.kind_contact, 1700000100.9, battery='-'))
+   record = store.dev_status_dictionary['Hub']
+   assert record[0:3] == ['-', '??', '-50']
+   assert stats.get_stats('Hub').last_time == 1700000100.9
+
+def test_older_contact_skipped(configured):
+   standby.apply_entry(entry('Hub', '-50', history.kind_report, 1700000100))
+   assert standby.apply_entry(entry('Hub', '??', history.kind_contact, 1700000000, battery='-'))
+   assert store.dev_status_dictionary['Hub'][1] == '-50'
+
+def test_replay_is_idempotent(configured):
+   lines = [entry('Door', str(-60-i), history.kind_report, 1700000000+60*i) for i in range(5)]
+   for line in lines + lines:
+      standby.apply_entry(line)
+   assert store.dev_status_dictionary['Door'][1] == '-64'
+   assert stats.get_stats('Door').gaps() == 4
+
+def test_hub_transitions(configured):
+   assert standby.apply_entry(json.dumps({'hub':'h1', 'dark_since':1700000000.0}))
+   assert topology.dark_since == {'h1':1700000000.0}
+   assert standby.apply_entry(json.dumps({'hub':'h1', 'dark_since':None}))
+   assert topology.dark_since == {}
+
+def test_unreadable_lines(configured):
+   assert standby.apply_entry(b'{"partial') == False
+   assert standby.apply_entry(b'[1, 2]') == False
+   assert standby.apply_entry(b'{"no hub": 1}') == False
+   assert store.dev_status_dictionary == {}
@@ -0,0 +1,67 @@
+import statistics
+
+import pytest
+
+from yl_health import stats
+
+def observed(gaps, start=1000.0):
+   s = stats.DeviceStats()
+   t = start
+   s.observe(t)
+   for gap in gaps:
+      t += gap
+      s.observe(t)
+   return(s)
+
+def test_first_report_has_no_gap():
+   s = stats.DeviceStats()
+   assert s.observe(1000.0) is None
+   assert s.gaps() == 0
+   assert s.variance() == 0.0
+
+def test_welford_matches_statistics():
+   gaps = [60, 300, 120, 900, 30, 600, 240]
+   s = observed(gaps)
+   assert s.gaps() == len(gaps)
+   assert s.mean == pytest.approx(statistics.mean(gaps))
+   assert s.variance() == pytest.approx(statistics.variance(gaps))
+   assert s.max_gap == 900
+
+def test_ewma():
+   gaps = [100, 200, 100, 400]
+   s = observed(gaps)
+   ewma = gaps[0]
+   var = 0.0
+   for gap in gaps[1:]:
+      diff = gap - ewma
+      ewma += stats.ewma_alpha*diff
+      var = (1-stats.ewma_alpha)*(var + stats.ewma_alpha*diff*diff)
+   assert s.ewma == pytest.approx(ewma)
+   assert s.ewma_var == pytest.approx(var)
+
+def test_older_report_ignored():
+   s = observed([60, 60])
+   assert s.observe(500.0) is None
+   assert s.last_time == 1120.0
+   assert s.gaps() == 2
+
+def test_recent_gaps_wrap():
+   gaps = list(range(1, stats.recent_size + 11))
+   s = observed(gaps)
+   assert [int(g) for g in s.recent_order()] == gaps[-stats.recent_size:]
+   assert s.percentile(100) == gaps[-1]
+   assert s.percentile(0) == gaps[-stats.recent_size]
+
+def test_saved_and_loaded():
+   s = observed([60, 120, 180])
+   loaded = stats.DeviceStats.from_dict(s.to_dict())
+   assert loaded.to_dict() == s.to_dict()
+
+def test_stale_minutes(configured):
+   configured.learned_staleness = True
+   configured.staleness_factor = 3
+   configured.staleness_min_minutes = 5
+   s = observed([600]*(stats.min_samples-1))
+   assert s.stale_minutes() == configured.max_age_minutes
+   s.observe(s.last_time + 600)
+   assert s.stale_minutes() == 30
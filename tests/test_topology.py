@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from yl_health import api
+from yl_health import store
+from yl_health import alerts
+from yl_health import prober
+from yl_health import topology
+from yl_health import signal_stats
+from yl_health.catalog import Catalog
+from yl_health.common import unpack_unix_time
+
+hubs = [{'deviceId':'h1', 'name':'Garage Hub', 'type':'Hub'}, {'deviceId':'h2', 'name':'House Hub', 'type':'Hub'}]
+garage = ['Garage Door', 'Garage Leak', 'Garage Motion']
+house = ['Front Door', 'Back Door']
+
+@pytest.fixture
+def tracked(configured, monkeypatch):
+   monkeypatch.setattr(topology, 'hub_of', {})
+   monkeypatch.setattr(topology, 'hub_devices', {})
+   monkeypatch.setattr(topology, 'stale_devices', {})
+   monkeypatch.setattr(topology, 'deadlines', [])
+   monkeypatch.setattr(topology, 'scheduled', set())
+   monkeypatch.setattr(topology, 'started', None)
+   monkeypatch.setattr(topology, 'hub_listeners', [])
+   monkeypatch.setattr(topology, 'post', lambda message: None)
+   monkeypatch.setattr(prober, 'probe_results', {})
+   sent = []
+   monkeypatch.setattr(alerts, 'send_status_email', lambda subject, message: sent.append((subject, message)))
+
+   catalog = Catalog()
+   catalog.apply(hubs + [{'deviceId':'d%s' % i, 'name':name, 'type':'DoorSensor'} for i, name in enumerate(garage+house)])
+   monkeypatch.setattr(api, 'catalog', catalog)
+
+   # Garage devices last reported two hours ago, house devices just now
+   for i, name in enumerate(garage+house):
+      signal_stats.set_hub(name, 'h1' if name in garage else 'h2')
+      t = time.time() - (7200 if name in garage else 0)
+      store.update_device_status(name, '4', '-60', unpack_unix_time(t*1000), 'd%s' % i, update_epoch=t)
+   return(sent)
+
+# Function to report a device, as a message would, now or the given minutes from now
+def report(name, minutes=0):
+   t = time.time() + minutes*60
+   store.update_device_status(name, '4', '-60', unpack_unix_time(t*1000), update_epoch=t)
+
+def test_hub_goes_dark_once(tracked):
+   topology.start()
+   assert tracked == []
+   for name in house:
+      report(name, 30)
+   later = time.time() + 3601
+   topology.check_deadlines(later)
+   topology.check_deadlines(later + 60)
+
+   assert len(tracked) == 1
+   subject, message = tracked[0]
+   assert subject == "Yolink Hub Outage"
+   assert "Hub Garage Hub and its 3 devices are dark (3 of 3 devices not reporting)" in message
+   assert topology.in_dark_hub('Garage Door')
+   assert topology.in_dark_hub('Front Door') == False
+
+def test_reports_move_deadlines(tracked):
+   topology.start()
+   for name in garage+house:
+      report(name, 30)
+   topology.check_deadlines(time.time() + 3601)
+   assert tracked == []
+   assert topology.stale_devices['h1'] == set()
+
+   # Deadlines follow the last report
+   topology.check_deadlines(time.time() + 5401)
+   assert topology.stale_devices['h1'] == set(garage)
+
+def test_hub_back_when_devices_report(tracked):
+   topology.start()
+   topology.check_deadlines(time.time() + 3601)
+   del tracked[:]
+
+   # 2 of 3 still stale is below hub_outage_percent (80)
+   report('Garage Door')
+   assert len(tracked) == 1
+   assert tracked[0][0] == "Yolink Hub Restored"
+   assert "(2 of 3 devices not reporting)" in tracked[0][1]
+   assert 'h1' not in topology.dark_since
+
+def test_hub_needs_min_devices(tracked, configured, monkeypatch):
+   monkeypatch.setattr(configured, 'hub_outage_min_devices', 4)
+   topology.start()
+   topology.check_deadlines(time.time() + 3601)
+   assert tracked == []
+   assert topology.stale_devices['h1'] == set(garage)
+
+def test_daily_check_lists_dark_hub_first(tracked):
+   topology.start()
+   topology.check_deadlines(time.time() + 3601)
+   del tracked[:]
+
+   alerts.check_status()
+   messages = [message for subject, message in tracked]
+   assert "Hub Garage Hub and its 3 devices dark for" in messages[0]
+   assert not any("Not Updated" in message for message in messages)
+
+def test_dark_hub_carried_over_without_alert(tracked):
+   since = time.time() - 3600
+   topology.restore_dark('h1', since)
+   topology.start()
+   assert tracked == []
+   assert topology.dark_since['h1'] == since
+   assert topology.stale_devices['h1'] == set(garage)
+
+def test_carried_over_hub_reported_back(tracked):
+   topology.restore_dark('h2', time.time() - 3600)
+   topology.start()
+   assert len(tracked) == 1
+   assert tracked[0][0] == "Yolink Hub Restored"
+   assert 'h2' not in topology.dark_since
+
+def test_renamed_device_keeps_hub(tracked):
+   topology.start()
+   store.rename_device('Garage Door', 'Side Door')
+   assert topology.hub_of['Side Door'] == 'h1'
+   assert 'Garage Door' not in topology.hub_devices['h1']
+   topology.check_deadlines(time.time() + 3601)
+   assert topology.stale_devices['h1'] == set(['Side Door', 'Garage Leak', 'Garage Motion'])
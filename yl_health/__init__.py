@@ -0,0 +1,93 @@
+# Package containing the modules used by "yolink_health.py"
+#
+# The program was originally a single script.  It is now split into modules so that
+# individual parts can be imported (for testing or by other tools) without starting
+# the main loop, and so that heavy libraries are only loaded when they are needed:
+#
+#    config        - configuration file variables
+#    common        - time stamps, activity log and console helpers
+#    api           - YoLink cloud API client (access token, home ID, device list, device status)
+#    catalog       - device catalog: devices by ID, type and name, state keys
+#    ratelimit     - rate limiter for YoLink API requests
+#    startup       - session startup pipeline and initial fetch of device states
+#    prober        - getState probes of devices which have stopped reporting
+#    topology      - devices by hub, hub outages
+#    mqtt_ingest   - MQTT connection and message handling
+#    decoder       - MQTT message decoding (msgspec, orjson or json)
+#    shared_ingest - message handling by worker processes, shared memory device table
+#    store         - device status dictionary and "yolink_health_table.txt"
+#    stats         - per-device report timing statistics and staleness thresholds
+#    history       - per-device history files
+#    recent        - recent samples of each device in fixed-size rings
+#    signal_stats  - rolling signal strength statistics
+#    dashboard     - web dashboard and JSON API
+#    forecast      - battery depletion forecast (numpy, run in a worker process)
+#    metrics       - metrics file in Prometheus text format
+#    alerts        - daily status check and alerts
+#    notifiers     - alert backends (email, webhook, push, syslog, MQTT)
+#    influx        - device updates sent to InfluxDB (line protocol)
+#    display       - ANSI color helpers and table display
+#    main          - main program loop
+#    aio           - optional asyncio runtime (runtime=asyncio), several homes
+#    ahttp         - minimal HTTP client for asyncio
+#    query         - query commands reading the saved data
+#    export        - history export as CSV, Parquet or Arrow
+#    benchmark     - component benchmarks with saved baselines
+#    standby       - hot standby: lease and journal shared by two copies
+#
+# Keep this file free of imports.  It is loaded by every entry point.
+
+Filename= "yolink_health.py"
+Version = "1.91"
+
+# Version 1.25: Converted CURL to in-line commands
+# Version 1.28: Add logging
+# Version 1.43: Add support for relay
+# Version 1.44: Reload data dictionary if new device appears
+# Version 1.45: Fix issues with new device detection and relay battery status
+# Version 1.46: Fix on_message bug, fix rc references which should be YL_rc
+# Version 1.47: Add display of device and state when event occurs, add Manipulator.StatusChange
+# Version 1.48: Add colors to table display
+# Version 1.49: Add support for plug devices
+# Version 1.50: Create empty Health_Table.txt file if one does not already exist
+# Version 1.51: Move authentication information into external file
+# Version 1.52: Add excluded_events list
+# Version 1.54: Fix int conversion bug when signal strength is ??
+# Version 1.55: Add THSensor.data.Report to exclusion list, fix min signal strength when previous was ??
+# Version 1.56: Add polling for hubs
+# Version 1.57: Update contact time when excluded event records are received
+# Version 1.58: Add max time since last update
+# Version 1.59: Fix display bug
+# Version 1.60: Add 'file_dirty' flag to control writing table to disk
+# Version 1.61: Pad the displayed update values to maintain alignment for up to 999 hours
+# Version 1.62: Clean up startup displays
+# Version 1.63: Add 'mid_battery' level to cause display to show in yellow, no alert
+# Version 1.64: Add test for existence of configuration file at program startup
+# Version 1.65: Add display of invalid entry in configuration file
+# Version 1.66: Remove 'YL_on_disconnect' and 'YL_on_connectionlost' callbacks
+# Version 1.67: Add 'log_unsupported_messages' flag
+# Version 1.68: Add error trapping in get_device_status()
+# Version 1.69: Split program into the "yl_health" package, load smtplib/paho/requests only when used
+# Version 1.70: Connect to MQTT broker while loading device list, fetch current state of all devices at startup
+# Version 1.71: Probe overdue devices, slow API requests down when YoLink reports request limit reached
+# Version 1.72: Keep per-device report timing statistics, learn staleness threshold for each device
+# Version 1.73: Add device history files, daily battery depletion forecast, metrics file
+# Version 1.74: Rolling signal statistics, Min Signal is now the weakest signal of the last seven days
+# Version 1.75: Web dashboard with live updates and JSON API
+# Version 1.76: status, history and worst-signal query commands
+# Version 1.77: Event dispatch table configured from the configuration file, heartbeat events replace
+#               the special case for one device
+# Version 1.78: Sample frequent events per device, Outlet.powerReport now sampled instead of excluded
+# Version 1.79: Drop duplicate and out of order messages, record late messages at their event time
+# Version 1.80: MQTT connection supervisor with backoff, no more 60 second sleep in on_connect
+# Version 1.81: Alerts sent in the background by email, webhook, push, syslog or MQTT notifiers
+# Version 1.82: Optional asyncio runtime for all network I/O, monitoring of several homes
+# Version 1.83: Optional multi-process message handling with a shared memory device table
+# Version 1.84: Indexed device catalog, device list reloads applied as changes, renamed devices keep their state
+# Version 1.85: MQTT messages decoded straight into the fields used, with msgspec or orjson when installed
+# Version 1.86: export command writing device history as CSV, Parquet or Arrow
+# Version 1.87: Devices grouped by hub, one alert for a hub whose devices have all stopped reporting
+# Version 1.88: Component benchmarks for fleets of 10 to 50,000 devices with saved baselines
+# Version 1.89: Device updates sent to InfluxDB in batches, spooled while it can't be reached
+# Version 1.90: Recent samples of each device kept in memory, signal trend on the dashboard, recent command
+# Version 1.91: Hot standby: a second copy replicates the status table and takes over when the lease expires
@@ -0,0 +1,137 @@
+#=============================================================================================
+# Minimal HTTP/1.1 client for asyncio
+#
+# Used by the asyncio runtime (see aio.py) for YoLink API requests and by the webhook and
+# push notifiers, so that waiting for a response never holds up a thread.  Connections are
+# kept open and reused for later requests to the same host.
+#
+# Only what those requests need is supported: a request with a body, and a response whose
+# length is given by Content-Length, by chunked encoding or by the server closing the
+# connection.  Redirects are not followed.
+#=============================================================================================
+import json
+from urllib.parse import urlsplit
+
+# Idle connections by (host, port, secure), and the most kept open for each host
+idle_connections = {}
+max_idle = 8
+
+class Response:
+   def __init__(self, url, status, headers, body):
+      self.url = url
+      self.status_code = status
+      self.headers = headers
+      self.body = body
+
+   def json(self):
+      return(json.loads(self.body))
+
+   def raise_for_status(self):
+      if self.status_code >= 400:
+         raise Exception("HTTP status %s from %s" % (self.status_code, self.url))
+      return()
+
+#=============================================================================================
+# Read one response.  Returns (status, headers, body, keep_alive).
+#=============================================================================================
+async def read_response(reader):
+   status_line = await reader.readline()
+   if len(status_line) == 0:
+      raise ConnectionError("Connection closed by server")
+   version, status = status_line.decode('latin-1').split(None, 2)[:2]
+   status = int(status)
+
+   headers = {}
+   while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+         break
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+
+   keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+   if headers.get('transfer-encoding', '').lower() == 'chunked':
+      chunks = []
+      while True:
+         size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+         if size == 0:
+            # Skip any trailer lines
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+               pass
+            break
+         chunks.append(await reader.readexactly(size))
+         await reader.readexactly(2)
+      body = b''.join(chunks)
+   elif 'content-length' in headers:
+      body = await reader.readexactly(int(headers['content-length']))
+   elif status in (204, 304) or status < 200:
+      body = b''
+   else:
+      body = await reader.read()
+      keep_alive = False
+   return(status, headers, body, keep_alive)
+
+#=============================================================================================
+# Send a request and return a Response.  A request on a reused connection which the server
+# has already closed is sent again on a new connection.
+#=============================================================================================
+async def request(method, url, body=b'', headers=None, timeout=30):
+   import asyncio
+
+   parts = urlsplit(url)
+   secure = parts.scheme == 'https'
+   port = parts.port or (443 if secure else 80)
+   path = parts.path or '/'
+   if parts.query:
+      path += '?' + parts.query
+   if isinstance(body, str):
+      body = body.encode('utf-8')
+
+   head = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % parts.netloc, 'Content-Length: %d' % len(body)]
+   head = [line.encode('latin-1') for line in head]
+   for name, value in (headers or {}).items():
+      if isinstance(value, bytes) == False:
+         value = str(value).encode('utf-8')
+      head.append(name.encode('latin-1') + b': ' + value)
+   data = b'\r\n'.join(head) + b'\r\n\r\n' + body
+
+   key = (parts.hostname, port, secure)
+   for attempt in range(2):
+      pool = idle_connections.get(key)
+      reused = bool(pool) and attempt == 0
+      if reused:
+         reader, writer = pool.pop()
+      else:
+         reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=True if secure else None), timeout)
+      try:
+         writer.write(data)
+         await writer.drain()
+         status, response_headers, response_body, keep_alive = await asyncio.wait_for(read_response(reader), timeout)
+      except (ConnectionError, EOFError):
+         writer.close()
+         if reused:
+            continue
+         raise
+      except:
+         writer.close()
+         raise
+
+      if keep_alive and len(idle_connections.setdefault(key, [])) < max_idle:
+         idle_connections[key].append((reader, writer))
+      else:
+         writer.close()
+      return(Response(url, status, response_headers, response_body))
+
+# Function to POST a JSON document
+async def post_json(url, document, headers=None, timeout=30):
+   all_headers = {'Content-Type':'application/json'}
+   all_headers.update(headers or {})
+   return(await request('POST', url, json.dumps(document), all_headers, timeout))
+
+# Function to close all idle connections
+def close_connections():
+   for pool in idle_connections.values():
+      for reader, writer in pool:
+         writer.close()
+   idle_connections.clear()
+   return()
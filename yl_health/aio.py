@@ -0,0 +1,528 @@
+#=============================================================================================
+# asyncio runtime (runtime=asyncio in the configuration file)
+#
+# Runs all network I/O on one event loop, in place of the thread pools, MQTT supervisor
+# thread and one second polling loop used by main.py:
+#
+#    - YoLink API requests (access token, home ID, device list, getState) use the asyncio
+#      HTTP client in ahttp.py, paced by the shared API rate limiter
+#    - each home's MQTT connection is driven by the loop through the paho socket callbacks:
+#      loop_read/loop_write when the socket is ready and loop_misc once a second
+#    - received messages are queued to a single state task which handles them in order with
+#      the same code as the threaded runtime (mqtt_ingest.YL_on_message)
+#    - probes, hub polls, the startup fetch of device states, the dashboard and the alert
+#      notifiers are tasks on the same loop
+#    - with ingest_workers > 0 the state task passes the messages to the worker processes
+#      of shared_ingest.py, and the changes they make are applied by a task on the loop
+#
+# Device state is therefore only ever changed on the event loop thread.  The battery
+# forecast still runs in its worker process, and email alerts run on a thread.
+#
+# Nothing on the loop waits for the disk, which may be a slow SD card or a network folder:
+# history records are written by the writer thread of history.py, the status table, metrics
+# and standby lease are written with asyncio.to_thread(), and the hot standby journal and
+# InfluxDB spool are written by their own threads.  The MQTT TCP connection is opened on the
+# loop and handed to paho, so its connect() doesn't block either.
+#
+# Besides the home of UAID/SECRET_KEY, further homes can be monitored by listing their
+# credentials in "extra_homes" (UAID:SECRET,...).  Each home has its own access token,
+# device list and MQTT connection.  Their devices share the status table.
+#=============================================================================================
+import os
+import time
+import socket
+import threading
+
+from yl_health import config
+from yl_health import common
+from yl_health import api
+from yl_health import store
+from yl_health import history
+from yl_health import mqtt_ingest
+from yl_health import startup
+from yl_health import prober
+from yl_health import topology
+from yl_health import forecast
+from yl_health import metrics
+from yl_health import dashboard
+from yl_health import notifiers
+from yl_health import influx
+from yl_health import standby
+from yl_health import shared_ingest
+from yl_health.common import post, timestamp, print_bs, print_nl, unix_timestamp, get_decade, get_minute, get_hour, get_dow
+from yl_health.display import display_table
+from yl_health.alerts import check_status
+
+# Homes being monitored, queue of received MQTT messages for the state task, and semaphore
+# limiting getState requests in progress
+homes = []
+inbox = None
+api_slots = None
+
+# Tasks started in the background.  The loop only keeps weak references to tasks.
+background_tasks = set()
+
+# Seconds before an access token expires when it is renewed, and shortest time between
+# device list reloads caused by messages from unknown devices
+token_margin = 300
+reload_interval = 60
+last_reload = -1e9
+
+# Seconds allowed to open the MQTT TCP connection, and the paho client class (see
+# loop_client_class)
+connect_timeout = 30
+LoopClient = None
+
+#=============================================================================================
+# One YoLink home: credentials, device list and MQTT connection
+#=============================================================================================
+class Home:
+   def __init__(self, uaid, secret):
+      self.uaid = uaid
+      self.secret = secret
+      self.token = ''
+      self.token_expires = 0
+      self.home_id = ''
+      self.client = None
+      self.topic = ''
+      # Connection state, as in mqtt_ingest
+      self.link_up = False
+      self.connected = False
+      self.connected_since = 0
+      self.disconnected_since = time.monotonic()
+      self.connect_failures = 0
+      self.auth_failed = False
+      self.sessions = 0
+
+   # Metric label for the home
+   def label(self):
+      return('{home="%s"}' % metrics.label(self.home_id or self.uaid))
+
+   #==========================================================================================
+   # API requests
+   #==========================================================================================
+   async def get_token(self):
+      from yl_health import ahttp
+      data = "grant_type=client_credentials&client_id="+self.uaid+"&client_secret="+self.secret
+      response = await ahttp.request('POST', api.YL_token_url, data, {'Content-Type':'application/x-www-form-urlencoded'})
+      result = response.json()
+      self.token = result['access_token']
+      self.token_expires = time.monotonic() + int(result['expires_in'])
+      if self.client is not None:
+         self.client.username_pw_set(username=self.token)
+      return()
+
+   # Function to send an API request and return the decoded response
+   async def call(self, data):
+      from yl_health import ahttp
+      headers = {'Content-Type':'application/json', 'Authorization':'Bearer '+self.token}
+      response = await ahttp.request('POST', api.YL_api_url, data, headers)
+      if response.status_code == 429:
+         return({'code':api.YL_rate_limit_code, 'desc':'Too Many Requests'})
+      response.raise_for_status()
+      return(response.json())
+
+   async def get_home_id(self):
+      result = await self.call('{"method":"Home.getGeneralInfo","time":"' + unix_timestamp() + '"}')
+      self.home_id = result['data']['id']
+      self.topic = 'yl-home/' + self.home_id + '/+/report'
+      return()
+
+   async def load_devices(self):
+      result = await self.call('{"method":"Home.getDeviceList","time":"' + unix_timestamp() + '"}')
+      api.apply_device_list(result['data']['devices'], self.home_id)
+      return()
+
+   #==========================================================================================
+   # MQTT connection
+   #==========================================================================================
+   def create_client(self, loop):
+      client = loop_client_class()()
+      client.username_pw_set(username=self.token)
+      client.on_connect = self.on_connect
+      client.on_disconnect = self.on_disconnect
+      client.on_message = lambda c, userdata, message: inbox.put_nowait(message)
+
+      # Let the event loop tell paho when the socket can be read or written
+      client.on_socket_open = lambda c, userdata, sock: loop.add_reader(sock, c.loop_read)
+      client.on_socket_close = lambda c, userdata, sock: loop.remove_reader(sock)
+      client.on_socket_register_write = lambda c, userdata, sock: loop.add_writer(sock, c.loop_write)
+      client.on_socket_unregister_write = lambda c, userdata, sock: loop.remove_writer(sock)
+      self.client = client
+      return()
+
+   # Connect, keep the connection alive and reconnect with backoff after failures.  The broker
+   # name is resolved and the TCP connection opened on the loop; paho's connect() then only
+   # sends the MQTT CONNECT packet.
+   async def supervise(self):
+      import asyncio
+      loop = asyncio.get_running_loop()
+      while True:
+         if self.link_up == False:
+            if self.auth_failed:
+               try:
+                  await self.get_token()
+                  self.auth_failed = False
+               except Exception as e:
+                  print_nl("%s Unable to refresh access token: %s" % (timestamp(),e))
+            try:
+               address = await loop.getaddrinfo(mqtt_ingest.YL_mqttBroker, mqtt_ingest.YL_port, type=socket.SOCK_STREAM)
+               family, kind, proto, name, sockaddr = address[0]
+               sock = socket.socket(family, kind, proto)
+               sock.setblocking(False)
+               try:
+                  await asyncio.wait_for(loop.sock_connect(sock, sockaddr), connect_timeout)
+               except:
+                  sock.close()
+                  raise
+               self.client.connected_socket = sock
+               self.client.connect(host=sockaddr[0], port=mqtt_ingest.YL_port, keepalive=60)
+               self.link_up = True
+            except Exception as e:
+               self.connect_failures += 1
+               metrics.inc('yolink_mqtt_connect_failures_total' + self.label())
+               delay = mqtt_ingest.backoff_delay(self.connect_failures)
+               print_nl("%s Unable to connect to YoLink MQTT Broker (%s).  Retrying in %.0f seconds" % (timestamp(),e,delay))
+               post("MQTT connect failed: %s" % e)
+               await asyncio.sleep(delay)
+               continue
+
+         await asyncio.sleep(1)
+         # Keep-alive pings.  Returns non-zero once the connection has been lost or refused.
+         if self.client.loop_misc() != 0:
+            self.link_up = False
+            self.on_disconnect(self.client, None, -1)
+            delay = mqtt_ingest.backoff_delay(self.connect_failures)
+            if config.verbose: print_nl("%s MQTT connection lost.  Reconnecting in %.0f seconds" % (timestamp(),delay))
+            await asyncio.sleep(delay)
+
+   def on_connect(self, client, userdata, flags, rc):
+      if rc == 0:
+         if config.verbose: print_nl("%s Connected to YoLink MQTT Broker for home %s" % (timestamp(),self.home_id))
+         now = time.monotonic()
+         if self.sessions > 0:
+            metrics.inc('yolink_mqtt_reconnects_total' + self.label())
+            metrics.inc('yolink_mqtt_disconnected_seconds_total' + self.label(), round(now-self.disconnected_since,1))
+         self.sessions += 1
+         self.connected = True
+         self.connected_since = now
+         self.connect_failures = 0
+         client.subscribe(self.topic)
+         return()
+
+      print_nl("\n%s Connection to YoLink MQTT Broker refused, result code %s" % (timestamp(),rc))
+      self.connect_failures += 1
+      metrics.inc('yolink_mqtt_connect_failures_total' + self.label())
+      if rc in (4, 5):
+         self.auth_failed = True
+      client.disconnect()
+      return()
+
+   def on_disconnect(self, client, userdata, rc):
+      if self.connected:
+         self.connected = False
+         self.disconnected_since = time.monotonic()
+         if rc != 0:
+            print_nl("%s Disconnected from YoLink MQTT Broker, result code %s" % (timestamp(),rc))
+            post("Disconnected from MQTT broker, result code %s" % rc)
+      return()
+
+   # Renew the access token before it expires, reload the device list and reconnect with the
+   # new token
+   async def keep_token(self):
+      import asyncio
+      while True:
+         await asyncio.sleep(max(60, self.token_expires - token_margin - time.monotonic()))
+         try:
+            await self.get_token()
+            await self.load_devices()
+            device_lists_loaded()
+            if self.link_up:
+               self.client.disconnect()
+            post("Access token renewed for home %s" % self.home_id)
+         except Exception as e:
+            print_nl("%s Unable to renew access token: %s" % (timestamp(),e))
+
+# Function to return a paho client class which uses a TCP connection opened on the loop.  paho
+# (1.6 and 2.x) opens its connection in _create_socket_connection().
+def loop_client_class():
+   global LoopClient
+   import paho.mqtt.client as mqtt
+
+   if LoopClient is None:
+      class LoopClient(mqtt.Client):
+         connected_socket = None
+
+         def _create_socket_connection(self):
+            sock = self.connected_socket
+            self.connected_socket = None
+            if sock is None:
+               return(super()._create_socket_connection())
+            return(sock)
+   return(LoopClient)
+
+# Function to read the homes from the configuration file
+def configured_homes():
+   found = [Home(config.UAID, config.SECRET_KEY)]
+   for entry in config.extra_homes:
+      uaid, _, secret = entry.strip().partition(':')
+      if len(uaid) > 0 and len(secret) > 0:
+         found.append(Home(uaid, secret))
+      elif len(entry.strip()) > 0:
+         print_nl('Invalid extra_homes entry "%s" ignored (use UAID:SECRET)' % entry.strip())
+   return(found)
+
+# Function to return the home a device belongs to
+def home_of(device):
+   for home in homes:
+      if home.home_id == device.home:
+         return(home)
+   return(homes[0])
+
+# Function called when the device lists of all homes have been (re)loaded into the catalog
+def device_lists_loaded():
+   api.YL_dictionary_loaded = True
+   api.dictionary_reload_required = False
+   shared_ingest.update_catalog(api.catalog)
+   return()
+
+# Function to add the connection state of each home to the metrics file
+def connection_metrics():
+   now = time.monotonic()
+   for home in homes:
+      metrics.set_gauge('yolink_mqtt_connected' + home.label(), 1 if home.connected else 0)
+      metrics.set_gauge('yolink_mqtt_connection_uptime_seconds' + home.label(), round(now-home.connected_since) if home.connected else 0)
+      metrics.set_gauge('yolink_mqtt_disconnected_seconds' + home.label(), 0 if home.connected else round(now-home.disconnected_since))
+   return()
+
+#=============================================================================================
+# Tasks
+#=============================================================================================
+
+# Function to start a task in the background and keep a reference to it until it is done
+def spawn(coroutine):
+   import asyncio
+   task = asyncio.get_running_loop().create_task(coroutine)
+   background_tasks.add(task)
+   task.add_done_callback(background_tasks.discard)
+   return(task)
+
+# Function to request the state of a device, paced by the shared API rate limiter.  Returns
+# the response, or an empty list if the request fails.
+async def get_device_state(device):
+   import asyncio
+   limiter = api.get_api_limiter()
+   async with api_slots:
+      wait = limiter.take()
+      while wait > 0:
+         await asyncio.sleep(wait)
+         wait = limiter.take()
+      try:
+         result = await home_of(device).call(api.device_state_request(device))
+      except:
+         result = []
+   api.adjust_api_rate(limiter, result)
+   return(result)
+
+# State task: handle each MQTT message in the order received
+async def handle_messages():
+   while True:
+      message = await inbox.get()
+      try:
+         mqtt_ingest.YL_on_message(None, None, message)
+      except Exception as e:
+         print_nl("%s Unable to handle message: %s" % (timestamp(),e))
+      check_reload()
+
+# Function to reload the device lists after a message from a device not in any of them
+def check_reload():
+   global last_reload
+   if api.dictionary_reload_required and time.monotonic() - last_reload > reload_interval:
+      last_reload = time.monotonic()
+      spawn(reload_catalogs())
+   return()
+
+# Task applying the changes made by the ingest worker processes
+async def update_ingest_table():
+   import asyncio
+   while True:
+      await asyncio.sleep(shared_ingest.sync_interval)
+      try:
+         shared_ingest.update()
+      except Exception as e:
+         print_nl("%s Ingest table update failed: %s" % (timestamp(),e))
+      check_reload()
+
+async def reload_catalogs():
+   print_nl("%s Reloading device lists" % timestamp())
+   for home in homes:
+      try:
+         await home.load_devices()
+      except Exception as e:
+         print_nl("%s Unable to reload device list of home %s: %s" % (timestamp(),home.home_id,e))
+   device_lists_loaded()
+   return()
+
+async def probe_device(device):
+   response = await get_device_state(device)
+   prober.record_probe(device, api.decode_device_status(device, response), response)
+   return()
+
+async def poll_hubs():
+   for d in api.catalog.hubs():
+      response = await get_device_state(d)
+      if api.decode_device_status(d, response)['status'] == 'Success':
+         store.record_contact(d.key,d.id)
+   return()
+
+async def backfill_device_states():
+   import asyncio
+   post("Fetching current state of all devices")
+   start = time.monotonic()
+
+   types = startup.supported_device_types()
+   devices = [d for d in api.catalog if d.type in types]
+   responses = await asyncio.gather(*[get_device_state(d) for d in devices])
+
+   updated = 0
+   for d, response in zip(devices, responses):
+      if startup.apply_device_state(d, response):
+         updated += 1
+
+   print_nl("%s Current state loaded for %s of %s devices in %.1f seconds" % (timestamp(),updated,len(devices),time.monotonic()-start))
+   post("Current state loaded for %s of %s devices" % (updated,len(devices)))
+   return()
+
+async def run_dashboard():
+   try:
+      await dashboard.serve(threading.Event())
+   except Exception as e:
+      print_nl("%s Dashboard stopped: %s" % (timestamp(),e))
+      post("Dashboard stopped: %s" % e)
+   finally:
+      dashboard.dashboard_loop = None
+   return()
+
+# Start one home: token and home ID, then the MQTT connection and device list together
+async def start_home(home, loop):
+   await home.get_token()
+   await home.get_home_id()
+   home.create_client(loop)
+   spawn(home.supervise())
+   await home.load_devices()
+   spawn(home.keep_token())
+   return()
+
+#=============================================================================================
+# Timed work, as in the main loop of main.py
+#=============================================================================================
+async def scheduler():
+   import asyncio
+   current_decade = get_decade()
+   current_hour = 99
+   current_minute = 99
+   current_dow = 9
+   daily_check_due = False
+
+   while True:
+      # Write the status table and metrics once every ten minutes
+      if current_decade != get_decade():
+         if store.file_dirty:
+            if config.verbose: print_nl("New Decade - Writing Table")
+            await asyncio.to_thread(store.write_table)
+         await asyncio.to_thread(metrics.write_metrics)
+         current_decade = get_decade()
+
+      # Check for overdue devices once a minute
+      if current_minute != get_minute():
+         devices = prober.select_overdue_devices()
+         for device in devices:
+            spawn(probe_device(device))
+         if config.verbose and len(devices) > 0: print_nl("%s Probing %s overdue devices" % (timestamp(),len(devices)))
+         topology.check_deadlines()
+         current_minute = get_minute()
+
+      # Poll hubs once an hour since they don't send reports
+      if current_hour != get_hour():
+         spawn(poll_hubs())
+         current_hour = get_hour()
+
+      # Daily battery forecast, status check and alerts
+      if current_dow != get_dow():
+         forecast.start_forecast()
+         daily_check_due = True
+         current_dow = get_dow()
+
+      forecast_complete = forecast.poll_forecast()
+      if daily_check_due and (forecast_complete or forecast.forecast_running_seconds() > 120):
+         display_table()
+         if await asyncio.to_thread(standby.claim_daily_check):
+            check_status()
+         daily_check_due = False
+
+      standby.heartbeat()
+      print_bs(timestamp())
+      await asyncio.sleep(1)
+
+#=============================================================================================
+# Start the runtime
+#=============================================================================================
+async def serve():
+   global homes, inbox, api_slots
+   import asyncio
+   from yl_health.display import pcolor, LIGHT_RED, NEGATIVE
+
+   loop = asyncio.get_running_loop()
+   inbox = asyncio.Queue()
+   api_slots = asyncio.Semaphore(max(1,config.api_workers))
+
+   # The connection state of each home replaces that of the threaded runtime
+   if mqtt_ingest.connection_metrics in metrics.collectors:
+      metrics.collectors.remove(mqtt_ingest.connection_metrics)
+   metrics.collectors.append(connection_metrics)
+
+   post("Starting asyncio runtime")
+   history.start_writer()
+   # The InfluxDB sink sends from its own thread (see influx.py)
+   await asyncio.to_thread(influx.start_sink)
+   candidates = configured_homes()
+   results = await asyncio.gather(*[start_home(home, loop) for home in candidates], return_exceptions=True)
+   homes = []
+   for home, result in zip(candidates, results):
+      if isinstance(result, Exception):
+         print_nl("%s Unable to start home %s: %s" % (timestamp(),home.home_id or home.uaid,result))
+         post("Unable to start home %s: %s" % (home.home_id or home.uaid,result))
+      else:
+         homes.append(home)
+   if len(homes) == 0:
+      pcolor(LIGHT_RED+NEGATIVE,'\nUnable to obtain Access Token.  Check the credentials in the configuration file "%s".' % config.config_file)
+      print("\nProgram stopped.\n")
+      os._exit(5)
+
+   # Messages received while the device lists were loading wait in the inbox
+   if config.ingest_workers > 0:
+      shared_ingest.start(config.ingest_workers, config.ingest_max_devices, start_thread=False)
+      spawn(update_ingest_table())
+   device_lists_loaded()
+   topology.start()
+   mqtt_ingest.catalog_ready.set()
+   spawn(handle_messages())
+   post("Monitoring %s homes, %s devices" % (len(homes),len(api.catalog)))
+
+   if config.startup_backfill:
+      await backfill_device_states()
+
+   if config.dashboard_port > 0:
+      store.change_listeners.append(dashboard.notify)
+      spawn(run_dashboard())
+   notifiers.start_notifiers(async_mode=True)
+
+   post("Starting Loop\n")
+   display_table()
+   common.first_time = False
+   await scheduler()
+
+def run():
+   import asyncio
+   asyncio.run(serve())
+   return()
@@ -0,0 +1,82 @@
+#=============================================================================================
+# Daily status check and alerts
+#
+# Alerts are queued on the notifier backends (email, webhook, push, syslog, MQTT), which
+# send them in the background.  See notifiers.py.
+#=============================================================================================
+from yl_health import config
+from yl_health import store
+from yl_health import stats
+from yl_health import forecast
+from yl_health import topology
+from yl_health import notifiers
+from yl_health.common import timestamp, print_nl
+from yl_health.prober import probe_note
+
+def check_status():
+   if config.verbose: print_nl("Checking status of all devices")
+   alerts_count=0
+
+   # Dark hubs first, so that max_alerts doesn't leave them out
+   for message in topology.dark_hub_alerts():
+      if alerts_count < config.max_alerts:
+         send_status_email("Yolink Device Alert " + str(alerts_count+1), message)
+         alerts_count +=1
+
+   for d, status, last_time in store.current_status():
+      key=d+":"
+      if status[0] == '-':
+         battery_status = ' -'
+      else:
+         battery_status=str(status[0]).rjust(2,' ')
+      current_signal_status=str(status[1]).rjust(4,' ')
+      minimum_signal_status=str(status[2]).rjust(4,' ')
+      update_time=status[3]
+      longest_update=status[4]
+
+      if battery_status.lstrip() != '-' and int(battery_status) <= config.min_battery and alerts_count < config.max_alerts:
+         send_status_email("Yolink Device Alert " + str(alerts_count+1), "%s Battery Level %s on Device %s" % (timestamp(),battery_status,d))
+         alerts_count +=1
+
+      if current_signal_status.lstrip() != '??' and int(current_signal_status) < config.min_signal and alerts_count < config.max_alerts:
+         send_status_email("Yolink Device Alert " + str(alerts_count+1), "%s Signal Level %s on Device %s" % (timestamp(),current_signal_status,d))
+         alerts_count +=1
+
+      device_stats = stats.get_stats(d)
+      et_minutes = stats.minutes_since(last_time)
+      # Devices of a dark hub are reported once for the hub below
+      if et_minutes > device_stats.stale_minutes() and topology.in_dark_hub(d) == False and alerts_count < config.max_alerts:
+         send_status_email("Yolink Device Alert " + str(alerts_count+1), "%s Device %s Not Updated for %s hours%s" % (timestamp(), d, round(et_minutes/60,1), probe_note(d)))
+         alerts_count +=1
+
+      if config.verbose: print_nl("Device %s Update Time: %s  Elapsed Minutes: %s" % (d,update_time,et_minutes))
+
+
+   if alerts_count == 0:
+      send_status_email("Yolink Devices AOK",timestamp()+" All Yolink devices are operating within normal parameters")
+
+   # Battery forecast.  Sent as one message whether or not there were alerts.
+   due = forecast.devices_due()
+   if len(due) > 0:
+      message = "%s Devices predicted to reach battery level %s within %s days:\n" % (timestamp(),config.min_battery,config.battery_forecast_days)
+      for days, d in due:
+         message += "\n   %s  %s days" % (d.ljust(store.key_size), round(days,1))
+      send_status_email("Yolink Battery Forecast", message)
+
+   if alerts_count >= config.max_alerts:
+      send_status_email("Excessive Yolink Alerts", "Excessive Yolink alerts.  See application for display of all alerts")
+
+   return()
+
+
+# Function to send an alert through the enabled notifiers (see notifiers.py).  The alert is
+# queued and sent in the background.
+def send_status_email(status_subject, status_message):
+    if len(notifiers.active_notifiers) > 0:
+        print_nl("Sending Alert %s - %s" % (status_subject, status_message))
+        notifiers.send_alert(status_subject, status_message)
+        status = 'Queued'
+    else:
+        status = 'Disabled'
+        print_nl("Status alert skipped because no notifiers are enabled")
+    return status
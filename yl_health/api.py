@@ -0,0 +1,527 @@
+#=============================================================================================
+# YoLink cloud API client: access token, home ID, device list and device status
+#
+# The "requests" library is imported inside each function so that it is only loaded
+# when the API is actually used.
+#=============================================================================================
+import datetime
+
+from yl_health import config
+from yl_health import common
+from yl_health.common import post, timestamp, print_nl, unix_timestamp, unpack_unix_time
+from yl_health.ratelimit import RateLimiter
+from yl_health.catalog import Catalog
+
+# URLs of the YoLink v2 API and of the access token request
+YL_api_url = "https://api.yosmart.com/open/yolink/v2/api"
+YL_token_url = "http://api.yosmart.com/open/yolink/token"
+
+# Response code returned by YoLink when the request limit has been reached
+YL_rate_limit_code = "010301"
+
+# Access Token time variables
+# The access_token_timestamp value is set to a default value in the past here.  It will be
+# updated with the current value each time a new access token is obtained.
+# The YL_token_valid_minutes is the number of minutes that a newly issued access token is valid.
+# It is set to 120 minutes here but will be updated each time an access token is obtained.
+YL_access_token_timestamp=datetime.datetime.now()-datetime.timedelta(days=7)
+YL_token_valid_minutes = 120
+YL_access_token = ''
+
+# Flags to determine whether information from MQTT broker is current
+YL_token_valid = False
+YL_home_ID_valid = False
+YL_dictionary_loaded = False
+
+# Catalog of the devices in the device list (see catalog.py), and flag set when a message
+# arrives from a device that is not in the device list
+catalog = Catalog()
+dictionary_reload_required = False
+
+# Rate limiter for getState requests, created on first use by get_api_limiter()
+api_limiter = None
+
+#=============================================================================================
+# Get YoLink Access Token
+#
+# Raises an exception if no token was issued, so that a caller which can retry later (the MQTT
+# supervisor, the standby) keeps running.  YL_start_session() stops the program instead.
+#=============================================================================================
+def YL_get_access_token():
+   global YL_access_token_timestamp
+   global YL_access_token, YL_token_valid, YL_token_valid_minutes
+   import requests
+   from requests.structures import CaseInsensitiveDict
+
+   if common.first_time: post("Getting Access Token")
+
+   url = YL_token_url
+
+   headers = CaseInsensitiveDict()
+   headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+   data = "grant_type=client_credentials&client_id="+config.UAID+"&client_secret="+config.SECRET_KEY
+
+   resp = requests.post(url, headers=headers, data=data)
+
+   if resp.status_code == 200:
+
+      # Response of 200 means valid POST
+      # Proceed to request the record
+      try:
+         result = resp.json()
+
+         YL_access_token = result['access_token']
+         YL_token_type = result['token_type']
+         YL_expires_in = result['expires_in']
+         YL_refresh_token = result['refresh_token']
+         YL_scope = result['scope']
+
+         YL_access_token_timestamp = datetime.datetime.now()
+         YL_token_valid_minutes = int(YL_expires_in/60)
+         YL_token_valid = True
+
+         if config.verbose:
+            print("\nAccess Token Fields:")
+            print("token: %s" % YL_access_token)
+            print("type: %s" % YL_token_type)
+            print("expires_in: %s - %s" % (YL_expires_in,YL_token_valid_minutes))
+            print("refresh_token: %s" % YL_refresh_token)
+            print("scope: %s" % YL_scope)
+      except:
+         YL_token_valid = False
+
+   else:
+      YL_token_valid = False
+
+   if YL_token_valid == False:
+      raise Exception("Unable to obtain access token (HTTP status %s)" % resp.status_code)
+   return()
+
+#=============================================================================================
+# Refresh access token and, if not already known, the home ID
+#=============================================================================================
+def YL_refresh_credentials():
+   global YL_access_token_timestamp
+
+   # Reset token timestamp and then get access token - this assures a current token
+   YL_access_token_timestamp=datetime.datetime.now()-datetime.timedelta(days=7)
+   YL_get_access_token()
+
+   if YL_home_ID_valid == False:
+      YL_get_home_ID()
+   return()
+
+#=============================================================================================
+# Apply a device list from YoLink to the catalog
+#
+# Devices renamed in the YoLink app, since the last reload or since the last run, have their
+# status and statistics moved to their new key.  The device index in the history folder is
+# saved with the keys so that they are kept on the next run.
+#=============================================================================================
+def apply_device_list(device_list, home=''):
+   from yl_health import store
+   from yl_health import history
+
+   if len(catalog) == 0 and len(catalog.saved_keys) == 0:
+      catalog.load_keys(history.load_device_index())
+   added, removed, renamed = catalog.apply(device_list, home)
+
+   if config.verbose: print("\nYolink Devices Registered to this Account:")
+
+   if config.logging and common.first_time:
+      log_fid=open(common.log_file,'a')
+      log_fid.write("\n")
+
+   for d in added:
+      if config.verbose: print("Device: %s" % d.name)
+      if config.logging and common.first_time: log_fid.write("Device: %s\n" % d.name)
+
+   if config.logging and common.first_time:
+      log_fid.write("\n")
+      log_fid.close()
+
+   for device, old_key in renamed:
+      store.rename_device(old_key, device.key)
+      print_nl("%s Device %s renamed to %s" % (timestamp(),old_key,device.key))
+   if common.first_time == False:
+      for d in added:
+         print_nl("%s Device %s added" % (timestamp(),d.key))
+      for d in removed:
+         print_nl("%s Device %s removed from the device list" % (timestamp(),d.key))
+
+   if len(added) > 0 or len(removed) > 0 or len(renamed) > 0:
+      history.save_device_index(catalog)
+   return()
+
+#=============================================================================================
+# Get Device State
+#
+# Sends a "getState" request for one device and returns the response as a dictionary, or
+# an empty list if the request fails.  Requests are paced by the shared rate limiter so
+# that concurrent callers (startup, hub polls, overdue device probes) stay within the
+# YoLink API limits.
+#=============================================================================================
+
+# Function to return the rate limiter shared by all getState requests
+def get_api_limiter():
+   global api_limiter
+   if api_limiter is None:
+      api_limiter = RateLimiter(config.api_requests_per_minute, config.api_workers)
+   return(api_limiter)
+
+# Function to return the body of a getState request for a device
+def device_state_request(device):
+   device_id = device.id
+   device_token = device.token
+   device_type = device.type
+   return('{"method":"' + device_type + '.getState","targetDevice":"' + device_id + '","token":"' + device_token + '"}')
+
+def YL_get_device_state(device):
+   import requests
+   from requests.structures import CaseInsensitiveDict
+
+   url = YL_api_url
+
+   headers = CaseInsensitiveDict()
+   headers["Content-Type"] = "application/json"
+   headers["Authorization"] = "Bearer "+ YL_access_token
+
+   data = device_state_request(device)
+
+   limiter = get_api_limiter()
+   limiter.acquire()
+   try:
+      resp = requests.post(url, headers=headers, data=data, timeout=30)
+      if resp.status_code == 429:
+         result = {'code':YL_rate_limit_code, 'desc':'Too Many Requests'}
+      else:
+         result = resp.json()
+   except:
+      result = []
+   finally:
+      limiter.release()
+
+   adjust_api_rate(limiter, result)
+   return(result)
+
+# Function to slow down when YoLink reports that the request limit has been reached, and
+# speed up again after successful requests
+def adjust_api_rate(limiter, result):
+   try:
+      throttled = result['code'] == YL_rate_limit_code
+   except:
+      throttled = False
+   if throttled:
+      limiter.throttled()
+      if config.verbose: print_nl("%s API request limit reached, reducing rate to %.1f per minute" % (timestamp(),limiter.rate*60))
+   else:
+      limiter.succeeded()
+   return()
+
+#=============================================================================================
+# Get Device Status
+#
+# The getState response has a different layout for each device type.  Each handler below
+# reads one layout and returns a dictionary with the fields:
+#    status   - 'desc' field of the response ('Success' if the request worked)
+#    online   - True/False as reported by YoLink, or None if the device type doesn't report it
+#    state    - device state, e.g. 'open' or 'closed'
+#    battery  - battery level
+# Handlers are registered in device_status_handlers by device type.  Types without an
+# entry are handled by sensor_status().
+#=============================================================================================
+
+def hub_status(device_name, device_type, device_data):
+   try:
+      device_status = device_data['desc']
+   except:
+      device_status = 'Unknown (H1)'
+
+   try:
+      wifi = device_data['data']['wifi']['enable']
+      if wifi:
+         wifi_enabled = 'Yes'
+      else:
+         wifi_enabled = 'No'
+   except:
+      wifi_enabled = 'Unknown (H2)'
+
+   try:
+      ssid = device_data['data']['wifi']['ssid']
+   except:
+      ssid = 'Unknown (H3)'
+
+   try:
+      ethernet = device_data['data']['eth']['enable']
+      if ethernet:
+         ethernet_enabled = 'Yes'
+      else:
+         ethernet_enabled = 'No'
+
+   except:
+      ethernet_enabled = 'Unknown (H4)'
+
+   if config.verbose: print("%s %s %s %s %s %s" % (device_name.ljust(30), device_type.ljust(25), device_status.ljust(10), wifi_enabled.ljust(10), ssid.ljust(20), ethernet_enabled))
+
+   return({'status':device_status, 'online':None, 'state':'', 'battery':''})
+
+def manipulator_status(device_name, device_type, device_data):
+   try:
+      device_status = device_data['desc']
+   except:
+      device_status = 'Unknown (M1)'
+
+
+   # Unsupported value
+   device_online = ''
+
+   try:
+      device_state = device_data['data']['state']
+   except:
+      device_state = 'Unknown (M2)'
+
+   try:
+      device_battery = device_data['data']['battery']
+   except:
+      device_battery = 'Unknown (M3)'
+
+   if config.verbose: print("%s %s %s %s %s %s" % (device_name.ljust(30), device_type.ljust(25), device_status.ljust(10), device_state.ljust(15), device_online.ljust(15), device_battery))
+
+   return({'status':device_status, 'online':None, 'state':device_state, 'battery':device_battery})
+
+def switch_status(device_name, device_type, device_data):
+   try:
+      device_status = device_data['desc']
+   except:
+      device_status = 'Unknown (S1)'
+
+
+   # Unsupported value
+   device_online = ''
+
+   try:
+      device_state = device_data['data']['state']
+   except:
+      device_state = 'Unknown (S2)'
+
+
+   # Unsupported value
+   device_battery = ''
+
+   if config.verbose: print("%s %s %s %s %s %s" % (device_name.ljust(30), device_type.ljust(25), device_status.ljust(10), device_state.ljust(15), device_online.ljust(15), device_battery))
+
+   return({'status':device_status, 'online':None, 'state':device_state, 'battery':device_battery})
+
+def outlet_status(device_name, device_type, device_data):
+   try:
+      device_status = device_data['desc']
+   except:
+      device_status = 'Unknown (O1)'
+
+
+   # Unsupported value
+   device_online = ''
+
+   try:
+      device_state = device_data['data']['state']
+   except:
+      device_state = 'Unknown (O2)'
+
+   # Unsupported value
+   device_battery = ''
+
+   if config.verbose: print("%s %s %s %s %s %s" % (device_name.ljust(30), device_type.ljust(25), device_status.ljust(10), device_state.ljust(15), device_online.ljust(15), device_battery))
+
+   return({'status':device_status, 'online':None, 'state':device_state, 'battery':device_battery})
+
+def sensor_status(device_name, device_type, device_data):
+   online = None
+
+   try:
+      device_status = device_data['desc']
+   except:
+      device_status = 'Unknown (1)'
+
+   try:
+      dev_online = device_data['data']['online']
+      online = bool(dev_online)
+      if dev_online:
+         device_online='True'
+      else:
+         device_online='False'
+   except:
+      device_online = 'Unknown (2)'
+
+   try:
+      device_state = device_data['data']['state']['state']
+   except:
+      device_state = 'Unknown (3)'
+
+   try:
+      device_battery = device_data['data']['state']['battery']
+   except:
+      device_battery = 'Unknown (4)'
+
+   if config.verbose: print("%s %s %s %s %s %s" % (device_name.ljust(30), device_type.ljust(25), device_status.ljust(10), device_state.ljust(15), device_online.ljust(15), device_battery))
+
+   return({'status':device_status, 'online':online, 'state':device_state, 'battery':device_battery})
+
+# Function to extract battery level and signal strength from a getState response.  Battery
+# and signal are reported either at the top of the data or within its "state".  Returns
+# battery as a string ('-' if not reported) and signal as a string ('??' if not reported).
+def state_battery_signal(response):
+   try:
+      data = response['data']
+      state = data.get('state')
+   except:
+      return('-','??')
+   if isinstance(state, dict) == False:
+      state = {}
+
+   battery = data.get('battery', state.get('battery'))
+   if battery is None:
+      battery = '-'
+   else:
+      battery = str(battery)
+
+   lora_info = data.get('loraInfo', state.get('loraInfo'))
+   try:
+      signal = str(lora_info['signal'])
+   except:
+      signal = '??'
+
+   return(battery, signal)
+
+device_status_handlers = {
+   'Hub': hub_status,
+   'Manipulator': manipulator_status,
+   'Switch': switch_status,
+   'Outlet': outlet_status,
+}
+
+# Function to decode a getState response with the handler for the device type
+def decode_device_status(device, response):
+   device_type = device.type
+   handler = device_status_handlers.get(device_type, sensor_status)
+   return(handler(device.key, device_type, response))
+
+# Function to request the state of a device and decode it
+def get_device_status_fields(device):
+   response = YL_get_device_state(device)
+   return(decode_device_status(device, response), response)
+
+def get_device_status(device):
+   fields, response = get_device_status_fields(device)
+
+   if fields['status'] == 'Success':
+      device_online = True
+   else:
+      device_online = False
+
+   return(device_online)
+
+#=============================================================================================
+# Get Home ID
+#=============================================================================================
+def YL_get_home_ID():
+   global YL_home_ID, YL_home_ID_valid
+   import requests
+   from requests.structures import CaseInsensitiveDict
+
+   if common.first_time: post("Getting Home ID")
+
+   url = YL_api_url
+
+   headers = CaseInsensitiveDict()
+   headers["Content-Type"] = "application/json"
+   headers["Authorization"] = "Bearer "+ YL_access_token
+
+   data = '{"method":"Home.getGeneralInfo","time":"' + unix_timestamp() + '"}'
+
+   resp = requests.post(url, headers=headers, data=data)
+
+   if resp.status_code == 200:
+
+      # Response of 200 means valid POST
+      # Proceed to request the record
+      result = resp.json()
+
+      YL_code = result['code']
+      YL_time = result['time']
+      YL_msgid = result['msgid']
+      YL_method = result['method']
+      YL_desc = result['desc']
+      YL_home_ID = result["data"]["id"]
+
+      if config.verbose:
+         print("\nHome ID Data Fields:")
+         print("code: %s" % YL_code)
+         print("time: %s = %s" % (YL_time,unpack_unix_time(YL_time)))
+         print("msgid: %s" % YL_msgid)
+         print("method: %s" % YL_method)
+         print("desc: %s" % YL_desc)
+         print("id: %s" % YL_home_ID)
+
+      YL_home_ID_valid = True
+
+   else:
+      YL_home_ID_valid = False
+
+   return()
+
+#=============================================================================================
+# Get Device List
+#=============================================================================================
+def YL_get_device_list():
+   global YL_dictionary_loaded
+   global dictionary_reload_required
+   import requests
+   from requests.structures import CaseInsensitiveDict
+
+   if common.first_time: post("Getting Device List")
+
+   url = YL_api_url
+
+   headers = CaseInsensitiveDict()
+   headers["Content-Type"] = "application/json"
+   headers["Authorization"] = "Bearer "+ YL_access_token
+
+   data = '{"method":"Home.getDeviceList","time":"' + unix_timestamp() + '"}'
+
+   resp = requests.post(url, headers=headers, data=data)
+
+   if resp.status_code == 200:
+
+      # Response of 200 means valid POST
+      # Proceed to request the record
+      result = resp.json()
+
+      if config.verbose: print(result)
+
+      YL_code = result['code']
+      YL_time = result['time']
+      YL_msgid = result['msgid']
+      YL_method = result['method']
+      YL_desc = result['desc']
+
+      if config.verbose:
+         print("\nDevice List Fields")
+         print("code: %s" % YL_code)
+         print("time: %s = %s" % (YL_time,unpack_unix_time(YL_time)))
+         print("msgid: %s" % YL_msgid)
+         print("method: %s" % YL_method)
+         print("desc: %s" % YL_desc)
+
+
+      # Extract sub-dictionary containing the device information
+      device_list = result["data"]["devices"]
+      if config.verbose: print("Dictionary:\n%s\n" % device_list)
+      apply_device_list(device_list)
+      YL_dictionary_loaded = True
+      dictionary_reload_required = False
+
+   else:
+      YL_dictionary_loaded = False
+
+   return()
@@ -0,0 +1,296 @@
+#=============================================================================================
+# Component benchmarks
+#
+# Times the parts of the program whose cost grows with the number of devices, for fleets of
+# generated devices:
+#
+#    config        read_config_variables()
+#    load_table    store.load_table() with the saved statistics
+#    write_table   store.write_table() with the saved statistics
+#    display_table display.display_table() (output discarded)
+#    check_status  alerts.check_status() (no notifiers, output discarded)
+#    classify      mqtt_ingest.classify() for a mix of events
+#    on_message    mqtt_ingest.YL_on_message() for report messages: decoding, duplicate and
+#                  late checks, classification and the status, statistics and history update.
+#                  The table redraw after each report is left out (see display_table).
+#
+# Usage:  python -m yl_health.benchmark [--devices 10,1000,50000] [--repeat 5]
+#                                       [--save FILE] [--compare FILE] [--tolerance 25]
+#
+# Each benchmark runs in a temporary folder, so the files of a running monitor are not
+# touched.  --save writes the results as a JSON baseline; --compare runs the benchmarks again
+# and flags every one slower than the baseline by more than --tolerance percent (and by more
+# than min_difference seconds, so that timer noise on very short runs is ignored).  The exit
+# code is 1 when there is a slowdown, so the comparison can be run before and after a change
+# on the Raspberry Pi:
+#
+#    python -m yl_health.benchmark --save baseline.json
+#    python -m yl_health.benchmark --compare baseline.json
+#=============================================================================================
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import contextlib
+
+from yl_health import Version
+from yl_health import config
+from yl_health import store
+
+# Default fleet sizes, repeats and tolerance in percent
+fleet_sizes = [10, 1000, 50000]
+repeat_count = 5
+tolerance_percent = 25
+
+# Differences smaller than this (seconds) are never flagged
+min_difference = 0.0005
+
+# Report messages handled by each run of the on_message benchmark, and events classified by
+# each run of the classify benchmark
+message_count = 2000
+classify_count = 100000
+
+# Configuration file used by the benchmarks
+config_text = """UAID=benchmark
+SECRET_KEY=benchmark
+color_enabled=True
+logging=False
+log_unsupported_messages=False
+log_raw=False
+verbose=False
+mid_battery=2
+min_battery=1
+min_signal=-85
+max_age_minutes=300
+max_alerts=5
+send_status_emails=False
+email_addr_list=
+email_server=
+email_account_name=
+email_account_pw=
+notifiers=
+dashboard_port=0
+json_decoder=auto
+"""
+
+device_types = ['DoorSensor', 'THSensor', 'MotionSensor', 'LeakSensor', 'Outlet']
+
+#=============================================================================================
+# Generated fleet
+#=============================================================================================
+
+# Function to return the device list of a generated fleet, as returned by the YoLink API
+def fleet_devices(size):
+   return([{'deviceId':'d%015d' % i, 'name':'Device %05d' % i, 'type':device_types[i % len(device_types)], 'token':'t'}
+           for i in range(size)])
+
+# Function to fill the status table with a generated fleet and save it with its statistics
+def make_fleet(size):
+   from yl_health import stats
+
+   rng = random.Random(size)
+   now = time.time()
+   store.dev_status_dictionary = {}
+   stats.device_stats = {}
+   for device in fleet_devices(size):
+      name = device['name']
+      signal = rng.randint(-110, -40)
+      last = now - rng.randint(0, 600)*60
+      store.dev_status_dictionary[name] = [rng.randint(0, 4), signal, signal - rng.randint(0, 10),
+                                           time.strftime('%Y-%m-%d %I:%M:%S %p', time.localtime(last)), str(rng.randint(0, 900))]
+      gaps = [rng.randint(600, 3600) for i in range(20)]
+      t = last - sum(gaps)
+      device_stats = stats.get_stats(name)
+      for gap in gaps:
+         device_stats.observe(t)
+         t += gap
+      device_stats.observe(last)
+   store.write_table()
+   return()
+
+# Function to return report message payloads for a generated fleet
+def fleet_payloads(size, count):
+   devices = fleet_devices(size)
+   now = int(time.time()*1000)
+   payloads = []
+   for i in range(count):
+      device = devices[i % size]
+      payloads.append(json.dumps({'event':device['type']+'.Report', 'time':now+i, 'msgid':'m%d' % i,
+                                  'deviceId':device['deviceId'],
+                                  'data':{'state':'normal', 'battery':4, 'online':True,
+                                          'loraInfo':{'signal':-60 - i % 40, 'gatewayId':'hub%013d' % (i % 4)}}}).encode('utf-8'))
+   return(payloads)
+
+class Message:
+   def __init__(self, payload):
+      self.payload = payload
+
+#=============================================================================================
+# Benchmarks.  Each takes the fleet size, sets up what it needs and returns the function to
+# time and a function to run before each timed call (or None).
+#=============================================================================================
+def bench_config(size):
+   return(config.read_config_variables, None)
+
+def bench_load_table(size):
+   make_fleet(size)
+   return(store.load_table, None)
+
+def bench_write_table(size):
+   make_fleet(size)
+   store.load_table()
+   return(store.write_table, None)
+
+def bench_display_table(size):
+   from yl_health.display import display_table
+   make_fleet(size)
+   store.load_table()
+   return(display_table, None)
+
+def bench_check_status(size):
+   from yl_health.alerts import check_status
+   make_fleet(size)
+   store.load_table()
+   return(check_status, None)
+
+def bench_classify(size):
+   from yl_health import mqtt_ingest
+   mqtt_ingest.build_event_table()
+   events = [device['type']+'.Report' for device in fleet_devices(min(size, 100))]
+   events += ['Hub.Report', 'Outlet.powerReport', 'Unknown.Event']
+   events = (events * (classify_count//len(events) + 1))[:classify_count]
+   classify = mqtt_ingest.classify
+
+   def run():
+      for event in events:
+         classify(event)
+   return(run, None)
+
+def bench_on_message(size):
+   from yl_health import api
+   from yl_health import mqtt_ingest
+   from yl_health.catalog import Catalog
+
+   make_fleet(size)
+   store.load_table()
+   mqtt_ingest.build_event_table()
+   api.catalog = Catalog()
+   api.catalog.apply(fleet_devices(size))
+   mqtt_ingest.catalog_ready.set()
+   mqtt_ingest.display_table = lambda: None
+   messages = [Message(payload) for payload in fleet_payloads(size, message_count)]
+
+   def reset():
+      mqtt_ingest.seen_msgids.clear()
+      mqtt_ingest.event_watermark.clear()
+      mqtt_ingest.last_processed.clear()
+
+   def run():
+      for message in messages:
+         mqtt_ingest.YL_on_message(None, None, message)
+   return(run, reset)
+
+benchmarks = {'config':bench_config, 'load_table':bench_load_table, 'write_table':bench_write_table,
+              'display_table':bench_display_table, 'check_status':bench_check_status,
+              'classify':bench_classify, 'on_message':bench_on_message}
+
+#=============================================================================================
+# Run the benchmarks.  Returns {"name/size": {"median": s, "min": s}}.
+#=============================================================================================
+def run_benchmarks(sizes, repeats, names):
+   results = {}
+   start_dir = os.getcwd()
+   with tempfile.TemporaryDirectory(prefix='yl_benchmark_') as work_dir:
+      os.chdir(work_dir)
+      try:
+         fid = open(config.config_file, 'w')
+         fid.write(config_text)
+         fid.close()
+         config.read_config_variables()
+         for size in sizes:
+            for name in names:
+               with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                  function, reset = benchmarks[name](size)
+                  times = []
+                  for i in range(repeats):
+                     if reset is not None:
+                        reset()
+                     started = time.perf_counter()
+                     function()
+                     times.append(time.perf_counter() - started)
+               times.sort()
+               key = '%s/%s' % (name, size)
+               results[key] = {'median':times[len(times)//2], 'min':times[0]}
+               print("   %-22s %10.2f ms" % (key, results[key]['median']*1000))
+      finally:
+         os.chdir(start_dir)
+   return(results)
+
+# Function to compare results with a baseline.  Returns the keys of benchmarks which are slower.
+def compare(results, baseline, tolerance):
+   slower = []
+   print("\n   %-22s %10s %10s %8s" % ('Benchmark', 'Baseline', 'Now', 'Change'))
+   for key, result in results.items():
+      base = baseline['results'].get(key)
+      if base is None:
+         print("   %-22s %10s %10.2f ms  (new)" % (key, '', result['median']*1000))
+         continue
+      change = 100*(result['median'] - base['median'])/max(base['median'], 1e-9)
+      flag = ''
+      if change > tolerance and result['median'] - base['median'] > min_difference:
+         flag = '  SLOWER'
+         slower.append(key)
+      print("   %-22s %7.2f ms %7.2f ms %+7.1f%%%s" % (key, base['median']*1000, result['median']*1000, change, flag))
+   return(slower)
+
+def main(argv):
+   import argparse
+
+   parser = argparse.ArgumentParser(prog='python -m yl_health.benchmark', description='Time program components for fleets of generated devices.')
+   parser.add_argument('--devices', default=','.join([str(s) for s in fleet_sizes]), help='fleet sizes (default %(default)s)')
+   parser.add_argument('--repeat', type=int, default=repeat_count, help='timed runs of each benchmark (default %(default)s)')
+   parser.add_argument('--only', action='append', choices=list(benchmarks), help='benchmark to run (may be given more than once; default all)')
+   parser.add_argument('--save', help='write the results to this JSON baseline file')
+   parser.add_argument('--compare', help='compare the results with this JSON baseline file')
+   parser.add_argument('--tolerance', type=float, default=tolerance_percent, help='slowdown in percent flagged by --compare (default %(default)s)')
+   args = parser.parse_args(argv)
+
+   try:
+      sizes = [int(s) for s in args.devices.split(',')]
+   except ValueError:
+      print('Invalid fleet sizes "%s" (use e.g. 10,1000,50000)' % args.devices, file=sys.stderr)
+      return(1)
+
+   baseline = None
+   if args.compare:
+      try:
+         fid = open(args.compare, 'r')
+         baseline = json.load(fid)
+         fid.close()
+      except (OSError, ValueError) as e:
+         print('Unable to read baseline "%s": %s' % (args.compare, e), file=sys.stderr)
+         return(1)
+
+   print("Version %s, Python %s on %s" % (Version, platform.python_version(), platform.machine()))
+   results = run_benchmarks(sizes, max(1, args.repeat), args.only or list(benchmarks))
+
+   if args.save:
+      fid = open(args.save, 'w')
+      json.dump({'version':Version, 'python':platform.python_version(), 'machine':platform.machine(),
+                 'created':time.strftime('%Y-%m-%d %H:%M:%S'), 'repeat':args.repeat, 'results':results}, fid, indent=1)
+      fid.close()
+      print("\nBaseline written to %s" % args.save)
+
+   if baseline is not None:
+      slower = compare(results, baseline, args.tolerance)
+      if len(slower) > 0:
+         print("\n%s benchmarks slower than the baseline by more than %s%%" % (len(slower), args.tolerance))
+         return(1)
+      print("\nNo benchmark slower than the baseline by more than %s%%" % args.tolerance)
+   return(0)
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
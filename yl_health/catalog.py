@@ -0,0 +1,177 @@
+#=============================================================================================
+# Device catalog
+#
+# The device list returned by YoLink is kept as one small entry for each device:
+#    id     - deviceId
+#    name   - name given to the device in the YoLink app
+#    type   - device type, e.g. 'DoorSensor' or 'Hub'
+#    token  - device token, needed for getState requests
+#    home   - ID of the home the device belongs to ('' with a single home)
+#    key    - state key, see below
+# Strings are interned, since the same IDs, types and names are looked up for every message.
+#
+# Devices are found by ID in one dictionary lookup, and there are indexes by type (e.g. all
+# hubs) and by name.  When the device list is reloaded only the differences are applied:
+# new devices are added, devices no longer listed are dropped and renamed devices re-keyed.
+#
+# State key.  The status table, report statistics and alerts keep each device under a name,
+# which must fit the name column of "yolink_health_table.txt" (key_size-1 characters) and
+# must not be shared with another device.  A device's key is its name, shortened to fit, with
+# " #" and the end of its ID added if another device already has that key.  Keys are saved
+# with the device index in the history folder, so each device keeps its key from one run to
+# the next, and a device renamed in the YoLink app (while the program runs or while it is
+# stopped) has its status and statistics moved to the new key instead of being left behind.
+#=============================================================================================
+import sys
+
+from yl_health.store import key_size
+
+# Longest state key
+max_key_length = key_size - 1
+
+class Device:
+   __slots__ = ('id', 'name', 'type', 'token', 'home', 'key')
+
+   def __init__(self, device_id, name, device_type, token, home):
+      self.id = device_id
+      self.name = name
+      self.type = device_type
+      self.token = token
+      self.home = home
+      self.key = ''
+
+   def __repr__(self):
+      return('Device(%s, %s, %s)' % (self.id, self.name, self.type))
+
+class Catalog:
+   def __init__(self):
+      self.devices = {}
+      self.by_type = {}
+      self.by_name = {}
+      self.by_key = {}
+      # Keys and names from the last run, by device ID: {id: (key, name)}
+      self.saved_keys = {}
+
+   def __len__(self):
+      return(len(self.devices))
+
+   def __iter__(self):
+      return(iter(list(self.devices.values())))
+
+   # Function to return the device with an ID, or None
+   def get(self, device_id):
+      return(self.devices.get(device_id))
+
+   # Function to return the devices of a type
+   def of_type(self, device_type):
+      return(list(self.by_type.get(device_type, {}).values()))
+
+   def hubs(self):
+      return(self.of_type('Hub'))
+
+   # Function to return the device with a state key or, failing that, the first device with
+   # a name.  Returns None if there is neither.
+   def find(self, name):
+      device = self.by_key.get(name)
+      if device is None:
+         named = self.by_name.get(name)
+         if named:
+            device = named[0]
+      return(device)
+
+   # Function to set the keys saved by the last run, from the device index
+   def load_keys(self, index):
+      for device_id, entry in index.items():
+         if 'key' in entry:
+            self.saved_keys[device_id] = (entry['key'], entry['name'])
+      return()
+
+   # Function to return a key for a name which is not used by another device
+   def make_key(self, name, device_id):
+      key = ' '.join(name.split())[:max_key_length].rstrip()
+      owner = self.by_key.get(key)
+      if owner is None or owner.id == device_id:
+         return(sys.intern(key))
+      for length in (4, 8, len(device_id)):
+         suffix = ' #' + device_id[-length:]
+         key = (' '.join(name.split())[:max_key_length-len(suffix)].rstrip() + suffix)[:max_key_length]
+         owner = self.by_key.get(key)
+         if owner is None or owner.id == device_id:
+            break
+      return(sys.intern(key))
+
+   def add_to_indexes(self, device):
+      self.devices[device.id] = device
+      self.by_type.setdefault(device.type, {})[device.id] = device
+      self.by_name.setdefault(device.name, []).append(device)
+      self.by_key[device.key] = device
+      return()
+
+   def remove_from_indexes(self, device):
+      del self.devices[device.id]
+      del self.by_type[device.type][device.id]
+      self.by_name[device.name].remove(device)
+      if len(self.by_name[device.name]) == 0:
+         del self.by_name[device.name]
+      if self.by_key.get(device.key) is device:
+         del self.by_key[device.key]
+      return()
+
+   #==========================================================================================
+   # Apply a device list from YoLink.  Only devices of the given home are replaced.  Returns
+   # lists of the devices added and removed, and (device, old key) for each device whose key
+   # has changed.
+   #==========================================================================================
+   def apply(self, device_list, home=''):
+      added = []
+      renamed = []
+      listed = set()
+      for d in device_list:
+         device_id = sys.intern(d['deviceId'])
+         name = sys.intern(d['name'])
+         device_type = sys.intern(d['type'])
+         listed.add(device_id)
+
+         device = self.devices.get(device_id)
+         if device is not None and device.name == name and device.type == device_type:
+            device.token = d.get('token', '')
+            device.home = home
+            continue
+
+         old_key = None
+         if device is not None:
+            old_key = device.key
+            self.remove_from_indexes(device)
+         else:
+            saved = self.saved_keys.get(device_id)
+            if saved is not None:
+               if saved[1] == name and self.by_key.get(saved[0]) is None:
+                  old_key = saved[0]
+                  device = Device(device_id, name, device_type, d.get('token', ''), home)
+                  device.key = sys.intern(saved[0])
+                  self.add_to_indexes(device)
+                  added.append(device)
+                  continue
+               # Renamed while the program was stopped
+               old_key = saved[0]
+
+         is_new = device is None
+         device = Device(device_id, name, device_type, d.get('token', ''), home)
+         device.key = self.make_key(name, device_id)
+         self.add_to_indexes(device)
+         if is_new:
+            added.append(device)
+         if old_key is not None and old_key != device.key:
+            renamed.append((device, old_key))
+
+      removed = [device for device in self.devices.values() if device.home == home and device.id not in listed]
+      for device in removed:
+         self.remove_from_indexes(device)
+      return(added, removed, renamed)
+
+   # Function to return the device index saved in the history folder
+   def index(self):
+      entries = {}
+      for device in self.devices.values():
+         entries[device.id] = {'name':device.name, 'type':device.type, 'key':device.key}
+      return(entries)
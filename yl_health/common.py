@@ -0,0 +1,109 @@
+#=============================================================================================
+# Helper functions shared by all modules: time stamps, activity log and console output
+#=============================================================================================
+import time
+import datetime
+
+from yl_health import config
+
+# Name of activity log file
+log_file="yolink_health.log"
+
+# Set to False once the first pass through the main loop has completed.  Several
+# startup steps are only written to the activity log on the first pass.
+first_time = True
+
+# Display variables
+line_len = 80
+backspaces = '\b'*line_len
+
+# Function to conditionally log activity.  Skipped with "logging" flag is set to False
+def post(text):
+   if config.logging:
+      log_fid = open(log_file,'a')
+      log_fid.write("%s %s\n" % (timestamp(),text))
+      log_fid.close()
+   return
+
+# Build Yolink unix style date/time string from current date/time
+def unix_timestamp():
+   now = int(time.time()*1000)
+   return str(now)
+
+# Convert Yolink version of Unix time to Python datetime format
+def unpack_unix_time(time):
+   dt=datetime.datetime.fromtimestamp(int(time/1000))
+   return(dt.strftime('%Y-%m-%d %I:%M:%S %p'))
+
+# Build formatted date/time string from current date/time.
+def timestamp():
+   now=datetime.datetime.now()
+   return(now.strftime('%Y-%m-%d %I:%M:%S %p'))
+
+# Function to print backspaces, then text right padded with spaces to standard length WITHOUT new line
+def print_bs(text):
+   print(backspaces+ text+ ' '*(line_len-len(text)), end='', flush=True)
+   return
+
+# Function to print backspaces, then text right padded with spaces to standard length WITH new line
+def print_nl(text):
+   print(backspaces+ text+ ' '*(line_len-len(text)))
+   return()
+
+#=============================================================================================
+# Get Decade
+#=============================================================================================
+
+# Function to return integer value of "decade"
+def get_decade():
+    time = datetime.datetime.now()
+    decade = time.strftime("%M")
+    decade = int(decade[0:1])
+    return decade
+
+#=============================================================================================
+# Get Minute
+#=============================================================================================
+
+# Function to return integer value of minute
+def get_minute():
+    time = datetime.datetime.now()
+    return time.minute
+
+#=============================================================================================
+# Get Hour
+#=============================================================================================
+
+# Function to return integer value of hour
+def get_hour():
+    time = datetime.datetime.now()
+    hour = time.strftime("%H")
+    return hour
+
+#=============================================================================================
+# Get day of week
+#=============================================================================================
+
+# Function to return integer value of "decade"
+def get_dow():
+    time = datetime.datetime.now()
+    dow = time.strftime("%w")
+    return int(dow)
+
+#=============================================================================================
+# Parse a duration such as "30m", "12h" or "7d"
+#=============================================================================================
+
+# Function to return the number of seconds in a duration.  A number without a unit is
+# taken as days.  Returns None if the text is not a valid duration.
+def parse_duration(text):
+    units = {'s':1, 'm':60, 'h':3600, 'd':86400, 'w':7*86400}
+    text = str(text).strip().lower()
+    multiplier = 86400
+    if len(text) > 0 and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+    try:
+        return float(text)*multiplier
+    except:
+        return None
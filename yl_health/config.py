@@ -0,0 +1,203 @@
+#=============================================================================================
+# Configuration file variables
+#
+# read_config_variables() loads every entry from the configuration file into a module
+# level variable of the same name, e.g. "config.verbose" or "config.max_age_minutes".
+#=============================================================================================
+
+# Name of file containing configuration information
+config_file='yolink_health.cfg'
+
+# Flag for valid config file contents
+valid_config_file = False
+
+# Function to get program configuration information from external file
+def read_config_variables():
+    global UAID
+    global SECRET_KEY
+    global color_enabled
+    global logging
+    global log_unsupported_messages
+    global log_raw
+    global verbose
+    global mid_battery, min_battery, min_signal, max_age_minutes, max_alerts
+    global send_status_emails, email_addr_list, email_server, email_account_name, email_account_pw
+    global api_workers, api_requests_per_minute, startup_backfill, probe_after_minutes
+    global learned_staleness, staleness_factor, staleness_min_minutes
+    global history_enabled, forecast_window_days, battery_forecast_days, metrics_enabled
+    global dashboard_port, dashboard_address
+    global extra_events, excluded_events, heartbeat_events, sampled_events
+    global notifiers, notify_retries, notify_timeout, notify_per_minute, notify_settings, email_ssl
+    global webhook_url, push_url, push_format, push_token, syslog_address, mqtt_notify_broker, mqtt_notify_topic
+    global runtime, extra_homes, ingest_workers, ingest_max_devices, json_decoder
+    global hub_outage_percent, hub_outage_min_devices
+    global recent_samples
+    global influx_url, influx_token, influx_batch_size, influx_flush_seconds, influx_spool_mb, influx_timeout
+    global standby_dir, lease_seconds, instance_name
+    global valid_config_file
+
+    # Flag for valid config file contents.  Gets turned off if any entry from this
+    # point forward is invalid in which case the rest of the lookups are abandoned
+    valid_config_file = True
+
+    if valid_config_file: UAID=get_config_string('UAID')
+    if valid_config_file: SECRET_KEY=get_config_string('SECRET_KEY')
+    if valid_config_file: color_enabled=get_config_truefalse('color_enabled')
+    if valid_config_file: logging=get_config_truefalse('logging')
+    if valid_config_file: log_unsupported_messages=get_config_truefalse('log_unsupported_messages')
+    if valid_config_file: log_raw=get_config_truefalse('log_raw')
+    if valid_config_file: verbose=get_config_truefalse('verbose')
+    if valid_config_file: mid_battery=get_config_integer('mid_battery')
+    if valid_config_file: min_battery=get_config_integer('min_battery')
+    if valid_config_file: min_signal=get_config_integer('min_signal')
+    if valid_config_file: max_age_minutes=get_config_integer('max_age_minutes')
+    if valid_config_file: max_alerts=get_config_integer('max_alerts')
+    if valid_config_file: send_status_emails=get_config_truefalse('send_status_emails')
+    if valid_config_file: email_addr_list=get_config_list('email_addr_list')
+    if valid_config_file: email_server=get_config_string('email_server')
+    if valid_config_file: email_account_name=get_config_string('email_account_name')
+    if valid_config_file: email_account_pw=get_config_string('email_account_pw')
+
+    # Optional entries
+    if valid_config_file: api_workers=get_config_integer('api_workers', 4)
+    if valid_config_file: api_requests_per_minute=get_config_integer('api_requests_per_minute', 60)
+    if valid_config_file: startup_backfill=get_config_truefalse('startup_backfill', True)
+    if valid_config_file: probe_after_minutes=get_config_integer('probe_after_minutes', 60)
+    if valid_config_file: learned_staleness=get_config_truefalse('learned_staleness', True)
+    if valid_config_file: staleness_factor=get_config_integer('staleness_factor', 3)
+    if valid_config_file: staleness_min_minutes=get_config_integer('staleness_min_minutes', 15)
+    if valid_config_file: history_enabled=get_config_truefalse('history_enabled', True)
+    if valid_config_file: forecast_window_days=get_config_integer('forecast_window_days', 90)
+    if valid_config_file: battery_forecast_days=get_config_integer('battery_forecast_days', 30)
+    if valid_config_file: metrics_enabled=get_config_truefalse('metrics_enabled', True)
+    if valid_config_file: dashboard_port=get_config_integer('dashboard_port', 8080)
+    if valid_config_file: dashboard_address=get_config_string('dashboard_address', '127.0.0.1')
+    if valid_config_file: extra_events=get_config_list('extra_events', '')
+    if valid_config_file: excluded_events=get_config_list('excluded_events', '')
+    if valid_config_file: heartbeat_events=get_config_list('heartbeat_events', '')
+    if valid_config_file: sampled_events=get_config_list('sampled_events', 'Outlet.powerReport:3600,THSensor.DataRecord:600')
+    if valid_config_file: notifiers=get_config_list('notifiers', '')
+    if valid_config_file: notify_retries=get_config_integer('notify_retries', 3)
+    if valid_config_file: notify_timeout=get_config_integer('notify_timeout', 10)
+    if valid_config_file: notify_per_minute=get_config_integer('notify_per_minute', 10)
+    if valid_config_file: email_ssl=get_config_truefalse('email_ssl', True)
+    if valid_config_file: webhook_url=get_config_string('webhook_url', '')
+    if valid_config_file: push_url=get_config_string('push_url', '')
+    if valid_config_file: push_format=get_config_string('push_format', 'ntfy')
+    if valid_config_file: push_token=get_config_string('push_token', '')
+    if valid_config_file: syslog_address=get_config_string('syslog_address', 'localhost:514')
+    if valid_config_file: mqtt_notify_broker=get_config_string('mqtt_notify_broker', 'localhost:1883')
+    if valid_config_file: mqtt_notify_topic=get_config_string('mqtt_notify_topic', 'yolink_health/alerts')
+    if valid_config_file: runtime=get_config_string('runtime', 'threads')
+    if valid_config_file: extra_homes=get_config_list('extra_homes', '')
+    if valid_config_file: ingest_workers=get_config_integer('ingest_workers', 0)
+    if valid_config_file: ingest_max_devices=get_config_integer('ingest_max_devices', 4096)
+    if valid_config_file: json_decoder=get_config_string('json_decoder', 'auto')
+    if valid_config_file: hub_outage_percent=get_config_integer('hub_outage_percent', 80)
+    if valid_config_file: hub_outage_min_devices=get_config_integer('hub_outage_min_devices', 2)
+    if valid_config_file: recent_samples=get_config_integer('recent_samples', 32)
+    if valid_config_file: influx_url=get_config_string('influx_url', '')
+    if valid_config_file: influx_token=get_config_string('influx_token', '')
+    if valid_config_file: influx_batch_size=get_config_integer('influx_batch_size', 500)
+    if valid_config_file: influx_flush_seconds=get_config_integer('influx_flush_seconds', 10)
+    if valid_config_file: influx_spool_mb=get_config_integer('influx_spool_mb', 10)
+    if valid_config_file: influx_timeout=get_config_integer('influx_timeout', 10)
+    if valid_config_file: standby_dir=get_config_string('standby_dir', '')
+    if valid_config_file: lease_seconds=get_config_integer('lease_seconds', 15)
+    if valid_config_file: instance_name=get_config_string('instance_name', '')
+
+    # Retries, timeout and rate for each notifier, e.g. "webhook_retries", defaulting to the
+    # notify_ entries
+    notify_settings = {}
+    for backend in ('email', 'webhook', 'push', 'syslog', 'mqtt'):
+        settings = {}
+        if valid_config_file: settings['retries']=get_config_integer(backend+'_retries', notify_retries)
+        if valid_config_file: settings['timeout']=get_config_integer(backend+'_timeout', notify_timeout)
+        if valid_config_file: settings['per_minute']=get_config_integer(backend+'_per_minute', notify_per_minute)
+        notify_settings[backend] = settings
+
+    return valid_config_file
+
+
+# Function to search configuration file for a specific variable entry.
+# Entries added after version 1.68 are optional: when a default is given and the entry is
+# missing from the file, the default is returned without a message.
+def get_config_string(vname, default=None):
+    global valid_config_file
+
+    found = False
+    vname_value = ''
+
+    try:
+        file = open(config_file,'r')
+
+        for line in file:
+            ptr=line.find('=')
+            if ptr >= 0:
+                tag = line[:ptr]
+                tag=tag.rstrip(' ')
+                if tag == vname:
+                    vname_value = line[ptr+1:]
+                    vname_value = vname_value.rstrip('\n')
+                    vname_value = vname_value.lstrip(' ').rstrip(' ')
+                    found = True
+
+        file.close()
+    except:
+       valid_config_file = False
+
+    if found == False and default is not None:
+       vname_value = str(default)
+    elif found == False:
+       print('Unable to locate entry for key "%s" in "%s" configuration file.\n' % (vname,config_file))
+
+    return vname_value
+
+# Function to search configuration/state file for a specific variable which must have True or False value
+def get_config_truefalse(vname, default=None):
+    global valid_config_file
+
+    vname_value = get_config_string(vname, default)
+    result=''
+    if valid_config_file:
+        if vname_value=='True':
+            result = True
+        elif vname_value=='False':
+            result = False
+        else:
+            valid_config_file = False
+            print('Invalid True/False setting for key "%s" in "%s" configuration file.\n' % (vname,config_file))
+
+    return result
+
+# Function to search configuration file for a specific variable which must convert to an integer
+def get_config_integer(vname, default=None):
+    global valid_config_file
+
+    vname_value = get_config_string(vname, default)
+    result=''
+    if valid_config_file:
+       try:
+          result = int(vname_value)
+       except:
+          result = ''
+          valid_config_file = False
+          print('Invalid integer value for key "%s" in "%s" configuration file.\n' % (vname,config_file))
+
+    return result
+
+# Function to search configuration file for a specific variable which must convert to a list
+def get_config_list(vname, default=None):
+    global valid_config_file
+
+    vname_value = get_config_string(vname, default)
+    result=''
+    if valid_config_file:
+       try:
+          result = vname_value.split(',')
+       except:
+          result = []
+          valid_config_file = False
+          print('Invalid list entry for key "%s" in "%s" configuration file.\n' % (vname,config_file))
+
+    return result
@@ -0,0 +1,409 @@
+#=============================================================================================
+# Web dashboard
+#
+# A small read-only web server, run by asyncio on its own thread, serving:
+#
+#    /                  dashboard page (updated live)
+#    /api/state         current state of every device, as JSON
+#    /api/alarms        devices with a low battery, weak signal or no recent report
+#    /api/history       history of one device: ?device=<name>&since=7d
+#    /api/recent        recent samples of one device, from memory: ?device=<name>
+#    /events            server-sent events carrying the state each time it changes
+#
+# Device updates call notify(), which only schedules a refresh on the server's event loop,
+# so the MQTT and API threads never wait for the web server.  The loop builds one snapshot
+# of the state per change (at most one per "coalesce_seconds"), serializes it once and hands
+# the same bytes to every viewer.  Each viewer has a queue holding only the newest snapshot:
+# a slow viewer skips the versions it could not keep up with rather than holding anything up.
+#
+# The server listens on "dashboard_port" (0 turns it off) at "dashboard_address", which is
+# 127.0.0.1 (this computer only) unless set otherwise.  asyncio is imported when the server
+# is started.
+#=============================================================================================
+import json
+import time
+import threading
+
+from yl_health import config
+from yl_health import api
+from yl_health import store
+from yl_health import stats
+from yl_health import history
+from yl_health import recent
+from yl_health import forecast
+from yl_health import signal_stats
+from yl_health.common import post, timestamp, print_nl, parse_duration
+
+# Event loop and thread running the server
+dashboard_loop = None
+dashboard_thread = None
+
+# Current snapshot: version number, dictionary, JSON bytes of the whole snapshot and of the
+# alarms, and the server-sent event carrying it
+snapshot_version = 0
+snapshot = {}
+snapshot_json = b'{}'
+alarms_json = b'[]'
+snapshot_event = b''
+
+# Set (on the event loop) when the state has changed, flag set when a refresh has already
+# been scheduled, and queues of connected viewers
+state_changed = None
+refresh_pending = False
+viewers = set()
+
+# Characters of the signal trend, weakest to strongest, and the signal range they cover
+trend_characters = '\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+trend_weakest = -120
+trend_strongest = -40
+trend_length = 16
+
+# Shortest time between snapshots, time between snapshots when nothing has changed (ages
+# keep increasing), and time between keep-alive comments on idle event streams
+coalesce_seconds = 1.0
+refresh_seconds = 60
+keepalive_seconds = 15
+
+#=============================================================================================
+# Notification from other threads
+#=============================================================================================
+
+# Function called (from any thread) when device state has changed
+def notify():
+   global refresh_pending
+   loop = dashboard_loop
+   if loop is None or refresh_pending:
+      return()
+   refresh_pending = True
+   try:
+      loop.call_soon_threadsafe(state_changed.set)
+   except RuntimeError:
+      # Loop has been closed
+      pass
+   return()
+
+#=============================================================================================
+# Snapshot
+#=============================================================================================
+
+# Function to build the snapshot dictionary from the current status (see store.current_status)
+def build_snapshot():
+   status = store.current_status()
+   with store.status_lock:
+      rings = dict((name, ring.snapshot()) for name, ring in recent.rings.items())
+
+   now = time.time()
+   devices = []
+   alarms = []
+   for name, record, last_time in status:
+      device_stats = stats.get_stats(name)
+      age = stats.minutes_since(last_time, now)
+      stale = device_stats.stale_minutes()
+      window = signal_stats.window_stats(name, '24h', now)
+      device = {'name':name,
+                'battery':record[0],
+                'signal':record[1],
+                'min_signal':record[2],
+                'last_update':record[3],
+                'longest_minutes':int(record[4]),
+                'age_minutes':age,
+                'stale_minutes':stale,
+                'battery_days':forecast.days_remaining(name),
+                'hub':signal_stats.device_hub.get(name),
+                'signal_p5_24h':window['p5'] if window is not None else None,
+                'signal_trend':signal_trend(rings.get(name)),
+                'alarms':[]}
+
+      if str(record[0]).strip() != '-' and int(record[0]) <= config.min_battery:
+         device['alarms'].append('battery')
+      if str(record[1]).strip() != '??' and int(record[1]) < config.min_signal:
+         device['alarms'].append('signal')
+      if age > stale:
+         device['alarms'].append('stale')
+      if len(device['alarms']) > 0:
+         alarms.append({'name':name, 'alarms':device['alarms'], 'battery':record[0],
+                        'signal':record[1], 'age_minutes':age})
+      devices.append(device)
+
+   return({'time':timestamp(), 'devices':devices, 'alarms':alarms})
+
+# Function to draw the latest signal readings in a ring snapshot as a row of bars
+def signal_trend(data):
+   if data is None:
+      return('')
+   signals = [signal for t, signal, battery, kind in recent.sample.iter_unpack(data) if signal != history.signal_unknown]
+   top = len(trend_characters)-1
+   trend = ''
+   for signal in signals[-trend_length:]:
+      level = (signal-trend_weakest)*top//(trend_strongest-trend_weakest)
+      trend += trend_characters[max(0, min(top, level))]
+   return(trend)
+
+# Function to make a new snapshot and pass it to every viewer.  Runs on the event loop.
+def publish():
+   global snapshot_version, snapshot, snapshot_json, alarms_json, snapshot_event, refresh_pending
+
+   refresh_pending = False
+   snapshot_version += 1
+   snapshot = build_snapshot()
+   snapshot['version'] = snapshot_version
+   snapshot_json = json.dumps(snapshot).encode()
+   alarms_json = json.dumps(snapshot['alarms']).encode()
+   snapshot_event = b'id: %d\nevent: snapshot\ndata: %s\n\n' % (snapshot_version, snapshot_json)
+
+   for queue in viewers:
+      if queue.full():
+         queue.get_nowait()
+      queue.put_nowait(snapshot_event)
+   return()
+
+# Task making snapshots as the state changes
+async def publisher():
+   import asyncio
+   while True:
+      try:
+         await asyncio.wait_for(state_changed.wait(), refresh_seconds)
+      except asyncio.TimeoutError:
+         pass
+      state_changed.clear()
+      try:
+         publish()
+      except Exception as e:
+         print_nl("%s Dashboard snapshot failed: %s" % (timestamp(),e))
+      await asyncio.sleep(coalesce_seconds)
+
+#=============================================================================================
+# HTTP
+#=============================================================================================
+
+status_text = {200:'OK', 304:'Not Modified', 400:'Bad Request', 404:'Not Found', 405:'Method Not Allowed'}
+
+# Function to build a complete HTTP response
+def response(code, body, content_type='application/json', headers=None):
+   head = 'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nCache-Control: no-cache\r\nConnection: close\r\n' % (code, status_text[code], content_type, len(body))
+   for name, value in (headers or {}).items():
+      head += '%s: %s\r\n' % (name, value)
+   return(head.encode() + b'\r\n' + body)
+
+# Function to look up a device ID by state key or name
+def device_id_for(name):
+   device = api.catalog.find(name)
+   if device is not None:
+      return(device.id)
+   for device_id, entry in history.load_device_index().items():
+      if entry.get('key') == name or entry['name'] == name:
+         return(device_id)
+   return(None)
+
+# Function to return the history of a device as JSON.  Runs on a worker thread.
+def history_json(name, since):
+   device_id = device_id_for(name)
+   if device_id is None:
+      return(None)
+   records = history.read(device_id, time.time()-since)
+   kinds = {history.kind_report:'report', history.kind_contact:'contact', history.kind_state:'state'}
+   entries = []
+   for t, signal, battery, kind in records:
+      entries.append({'time':t,
+                      'signal':None if signal == history.signal_unknown else signal,
+                      'battery':None if battery == history.battery_unknown else battery,
+                      'kind':kinds.get(kind, kind)})
+   return(json.dumps({'device':name, 'records':entries}).encode())
+
+# Function to return the recent samples of a device as JSON, or None if it has none
+def recent_json(name):
+   with store.status_lock:
+      ring = recent.rings.get(name)
+      data = ring.snapshot() if ring is not None else None
+   if data is None:
+      return(None)
+   entries = []
+   for t, signal, battery, kind in recent.sample.iter_unpack(data):
+      entries.append({'time':t,
+                      'signal':None if signal == history.signal_unknown else signal,
+                      'battery':None if battery == history.battery_unknown else battery,
+                      'kind':history.kind_names.get(kind, kind)})
+   return(json.dumps({'device':name, 'samples':entries}).encode())
+
+# Function to stream snapshots to one viewer
+async def stream_events(writer):
+   import asyncio
+   writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+   queue = asyncio.Queue(maxsize=1)
+   queue.put_nowait(snapshot_event)
+   viewers.add(queue)
+   try:
+      while True:
+         try:
+            event = await asyncio.wait_for(queue.get(), keepalive_seconds)
+         except asyncio.TimeoutError:
+            event = b': keep-alive\n\n'
+         writer.write(event)
+         await asyncio.wait_for(writer.drain(), keepalive_seconds*2)
+   finally:
+      viewers.discard(queue)
+   return()
+
+# Function to handle one connection
+async def handle_connection(reader, writer):
+   import asyncio
+   from urllib.parse import urlsplit, parse_qs
+   try:
+      request_line = await asyncio.wait_for(reader.readline(), 10)
+      headers = {}
+      while True:
+         line = await asyncio.wait_for(reader.readline(), 10)
+         if line in (b'\r\n', b'\n', b''):
+            break
+         name, _, value = line.decode('latin-1').partition(':')
+         headers[name.strip().lower()] = value.strip()
+
+      parts = request_line.decode('latin-1').split()
+      if len(parts) < 2:
+         writer.write(response(400, b'{"error":"bad request"}'))
+      elif parts[0] != 'GET':
+         writer.write(response(405, b'{"error":"method not allowed"}'))
+      else:
+         target = urlsplit(parts[1])
+         query = parse_qs(target.query)
+         path = target.path
+
+         if path == '/':
+            writer.write(response(200, dashboard_page, 'text/html; charset=utf-8'))
+         elif path == '/api/state':
+            etag = '"%d"' % snapshot_version
+            if headers.get('if-none-match') == etag:
+               writer.write(response(304, b'', headers={'ETag':etag}))
+            else:
+               writer.write(response(200, snapshot_json, headers={'ETag':etag}))
+         elif path == '/api/alarms':
+            writer.write(response(200, alarms_json))
+         elif path == '/api/history':
+            name = query.get('device', [''])[0]
+            since = parse_duration(query.get('since', ['7d'])[0])
+            if since is None:
+               writer.write(response(400, b'{"error":"invalid since"}'))
+            else:
+               body = await asyncio.get_running_loop().run_in_executor(None, history_json, name, since)
+               if body is None:
+                  writer.write(response(404, b'{"error":"unknown device"}'))
+               else:
+                  writer.write(response(200, body))
+         elif path == '/api/recent':
+            body = recent_json(query.get('device', [''])[0])
+            if body is None:
+               writer.write(response(404, b'{"error":"unknown device"}'))
+            else:
+               writer.write(response(200, body))
+         elif path == '/events':
+            await stream_events(writer)
+         else:
+            writer.write(response(404, b'{"error":"not found"}'))
+      await asyncio.wait_for(writer.drain(), 30)
+   except Exception:
+      # Viewer went away or sent something unreadable
+      pass
+   finally:
+      writer.close()
+   return()
+
+#=============================================================================================
+# Start the server
+#=============================================================================================
+async def serve(started):
+   global state_changed, dashboard_loop
+   import asyncio
+   state_changed = asyncio.Event()
+   publish()
+   server = await asyncio.start_server(handle_connection, config.dashboard_address or None, config.dashboard_port)
+   report_addresses(server)
+   asyncio.get_running_loop().create_task(publisher())
+   dashboard_loop = asyncio.get_running_loop()
+   started.set()
+   async with server:
+      await server.serve_forever()
+
+# Function to show the addresses the server is listening on.  An empty dashboard_address
+# listens on every network interface, so anyone on the network can view the dashboard.
+def report_addresses(server):
+   for sock in server.sockets:
+      host, port = sock.getsockname()[:2]
+      if ':' in host:
+         host = '[%s]' % host
+      print_nl("%s Dashboard at http://%s:%s/" % (timestamp(),host,port))
+      post("Dashboard listening on %s:%s" % (host,port))
+   if config.dashboard_address in ('', '0.0.0.0', '::'):
+      print_nl("%s Dashboard open to every network interface, without a password" % timestamp())
+   return()
+
+def run_dashboard(started):
+   global dashboard_loop
+   import asyncio
+   try:
+      asyncio.run(serve(started))
+   except Exception as e:
+      print_nl("%s Dashboard stopped: %s" % (timestamp(),e))
+      post("Dashboard stopped: %s" % e)
+   finally:
+      dashboard_loop = None
+      started.set()
+   return()
+
+# Function to start the dashboard thread.  Returns False when the dashboard is turned off.
+def start_dashboard():
+   global dashboard_thread
+   if config.dashboard_port <= 0 or dashboard_thread is not None:
+      return(False)
+   store.change_listeners.append(notify)
+   started = threading.Event()
+   dashboard_thread = threading.Thread(target=run_dashboard, args=(started,), name='dashboard', daemon=True)
+   dashboard_thread.start()
+   started.wait(5)
+   if dashboard_loop is None:
+      return(False)
+   return(True)
+
+#=============================================================================================
+# Dashboard page
+#=============================================================================================
+dashboard_page = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>YoLink Health</title>
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<style>
+body{font-family:sans-serif;margin:1em;background:#fafafa}
+table{border-collapse:collapse;width:100%}
+th,td{padding:4px 8px;border-bottom:1px solid #ddd;text-align:left}
+th{background:#eee}
+tr.alarm{background:#fde2e2}
+td.num{text-align:right}
+#status{color:#666;font-size:90%}
+</style></head>
+<body>
+<h2>YoLink Device Health</h2>
+<div id="status">Connecting...</div>
+<h3>Alarms</h3><ul id="alarms"></ul>
+<h3>Devices</h3>
+<table><thead><tr><th>Device</th><th>Battery</th><th>Signal</th><th>Min Signal (7d)</th><th>p5 Signal (24h)</th><th>Signal Trend</th>
+<th>Last Update</th><th>Age (min)</th><th>Stale After (min)</th><th>Battery Days</th></tr></thead>
+<tbody id="devices"></tbody></table>
+<script>
+function cell(text,num){var td=document.createElement('td');td.textContent=(text===null||text===undefined)?'':text;if(num)td.className='num';return td;}
+function show(s){
+  document.getElementById('status').textContent='Version '+s.version+' at '+s.time;
+  var alarms=document.getElementById('alarms');alarms.innerHTML='';
+  s.alarms.forEach(function(a){var li=document.createElement('li');li.textContent=a.name+': '+a.alarms.join(', ');alarms.appendChild(li);});
+  if(s.alarms.length==0){var li=document.createElement('li');li.textContent='None';alarms.appendChild(li);}
+  var body=document.getElementById('devices');body.innerHTML='';
+  s.devices.forEach(function(d){
+    var tr=document.createElement('tr');if(d.alarms.length>0)tr.className='alarm';
+    tr.appendChild(cell(d.name));tr.appendChild(cell(d.battery,1));tr.appendChild(cell(d.signal,1));
+    tr.appendChild(cell(d.min_signal,1));tr.appendChild(cell(d.signal_p5_24h,1));tr.appendChild(cell(d.signal_trend));tr.appendChild(cell(d.last_update));
+    tr.appendChild(cell(d.age_minutes,1));tr.appendChild(cell(d.stale_minutes,1));
+    tr.appendChild(cell(d.battery_days===null?'':Math.round(d.battery_days),1));
+    body.appendChild(tr);});
+}
+var source=new EventSource('/events');
+source.addEventListener('snapshot',function(e){show(JSON.parse(e.data));});
+source.onerror=function(){document.getElementById('status').textContent='Disconnected - retrying';};
+</script></body></html>
+'''
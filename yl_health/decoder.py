@@ -0,0 +1,159 @@
+#=============================================================================================
+# MQTT message decoding
+#
+# Only a few fields of each MQTT message are used: deviceId, event, msgid, time and, from
+# "data", state, battery, online and loraInfo signal and gatewayId.  Payloads are decoded
+# straight into a Message holding just those fields.
+#
+# The JSON decoder is chosen by "json_decoder" in the configuration file:
+#    msgspec - decodes into a typed schema; fields not in the schema are skipped without
+#              building dictionaries or strings for them
+#    orjson  - fast drop-in replacement for json.loads
+#    json    - the standard library
+#    auto    - (default) the first of these which is installed
+# A message which doesn't fit the msgspec schema (e.g. "data" is not an object) is decoded
+# again with the standard library, so every decoder gives the same result.
+#
+# Enter "python -m yl_health.shared_ingest" to compare the message rate of the decoders.
+#=============================================================================================
+import json
+import importlib.util
+
+# Decoders in order of preference
+decoder_names = ['msgspec', 'orjson', 'json']
+
+# Name of the decoder in use and its decode function, set by select() on first use
+decoder_name = ''
+decode_function = None
+
+class Message:
+   __slots__ = ('device_id', 'event', 'msgid', 'time', 'state', 'battery', 'online', 'signal', 'hub')
+
+   def __repr__(self):
+      return('Message(%s, %s, %s)' % (self.device_id, self.event, self.msgid))
+
+# Function to return the decoders which are installed
+def available_decoders():
+   return([name for name in decoder_names if name == 'json' or importlib.util.find_spec(name) is not None])
+
+#=============================================================================================
+# Decoders
+#=============================================================================================
+
+# Function to make a Message from a decoded payload.  Raises ValueError, as for invalid JSON,
+# if the payload is not a JSON object.
+def message_from_dict(payload):
+   if type(payload) is not dict:
+      raise ValueError('MQTT payload is not a JSON object')
+   message = Message()
+   message.device_id = payload.get('deviceId')
+   message.event = payload.get('event', '')
+   message.msgid = payload.get('msgid')
+   message.time = payload.get('time')
+   data = payload.get('data')
+   if type(data) is not dict:
+      data = {}
+   message.state = data.get('state', '???')
+   message.battery = data.get('battery')
+   message.online = data.get('online', True)
+   lora = data.get('loraInfo')
+   if type(lora) is not dict:
+      lora = {}
+   message.signal = lora.get('signal')
+   message.hub = lora.get('gatewayId')
+   return(message)
+
+def json_decoder():
+   loads = json.loads
+   return(lambda payload: message_from_dict(loads(payload)))
+
+def orjson_decoder():
+   import orjson
+   loads = orjson.loads
+   return(lambda payload: message_from_dict(loads(payload)))
+
+def msgspec_decoder():
+   from typing import Any, Optional
+   import msgspec
+
+   class LoraInfo(msgspec.Struct):
+      signal: Any = None
+      gatewayId: Any = None
+
+   class Data(msgspec.Struct):
+      state: Any = '???'
+      battery: Any = None
+      online: Any = True
+      loraInfo: Optional[LoraInfo] = None
+
+   class Payload(msgspec.Struct):
+      deviceId: Any = None
+      event: Any = ''
+      msgid: Any = None
+      time: Any = None
+      data: Optional[Data] = None
+
+   schema = msgspec.json.Decoder(Payload)
+   loads = json.loads
+
+   def decode(payload):
+      try:
+         decoded = schema.decode(payload)
+      except msgspec.ValidationError:
+         return(message_from_dict(loads(payload)))
+      message = Message()
+      message.device_id = decoded.deviceId
+      message.event = decoded.event
+      message.msgid = decoded.msgid
+      message.time = decoded.time
+      data = decoded.data
+      if data is None:
+         message.state = '???'
+         message.battery = None
+         message.online = True
+         message.signal = None
+         message.hub = None
+      else:
+         message.state = data.state
+         message.battery = data.battery
+         message.online = data.online
+         lora = data.loraInfo
+         if lora is None:
+            message.signal = None
+            message.hub = None
+         else:
+            message.signal = lora.signal
+            message.hub = lora.gatewayId
+      return(message)
+   return(decode)
+
+decoder_factories = {'msgspec':msgspec_decoder, 'orjson':orjson_decoder, 'json':json_decoder}
+
+#=============================================================================================
+# Select the decoder by name ('auto' for the fastest installed).  A decoder which is not
+# installed is replaced by the next one available.
+#=============================================================================================
+def select(name='auto'):
+   global decoder_name, decode_function
+   from yl_health.common import print_nl
+
+   available = available_decoders()
+   if name in (None, '', 'auto'):
+      name = available[0]
+   elif name not in decoder_factories:
+      print_nl('Unknown json_decoder "%s", using %s' % (name,available[0]))
+      name = available[0]
+   elif name not in available:
+      print_nl('json_decoder %s is not installed, using %s' % (name,available[0]))
+      name = available[0]
+   decode_function = decoder_factories[name]()
+   decoder_name = name
+   return(name)
+
+# Function to decode a payload (bytes or str) into a Message.  Raises ValueError if the
+# payload is not valid JSON.
+def decode(payload):
+   if decode_function is None:
+      from yl_health import config
+      select(config.json_decoder)
+   return(decode_function(payload))
@@ -0,0 +1,128 @@
+#=============================================================================================
+# Console display: ANSI color helpers and device status table
+#=============================================================================================
+import time
+
+from yl_health import config
+from yl_health import store
+from yl_health import stats
+from yl_health.common import print_nl
+
+""" ANSI color codes """
+BLACK = "\x1b[0;30m"
+RED = "\x1b[0;31m"
+RED2 = "\x1b[31;0m"
+GREEN = "\x1b[0;32m"
+BROWN = "\x1b[0;33m"
+BLUE = "\x1b[0;34m"
+PURPLE = "\x1b[0;35m"
+CYAN = "\x1b[0;36m"
+LIGHT_GRAY = "\x1b[0;37m"
+DARK_GRAY = "\x1b[1;30m"
+LIGHT_RED = "\x1b[1;31m"
+LIGHT_GREEN = "\x1b[1;32m"
+YELLOW = "\x1b[1;33m"
+LIGHT_BLUE = "\x1b[1;34m"
+LIGHT_PURPLE = "\x1b[1;35m"
+LIGHT_CYAN = "\x1b[1;36m"
+LIGHT_WHITE = "\x1b[1;37m"
+BOLD = "\x1b[1m"
+FAINT = "\x1b[2m"
+ITALIC = "\x1b[3m"
+UNDERLINE = "\x1b[4m"
+BLINK = "\x1b[5m"
+NEGATIVE = "\x1b[7m"
+CROSSED = "\x1b[9m"
+END = "\x1b[0m"
+
+# Function to display text with color
+def pcolor(attribute,text):
+   if config.color_enabled:
+      print(attribute+text+END)
+   else:
+      print(text)
+   return()
+
+# Function to build text string with embedded ANSI color codes
+def encode(attribute,text):
+   if config.color_enabled:
+      encoded_text = attribute+text+END
+   else:
+      encoded_text = text
+   return(encoded_text)
+
+def display_table():
+   key_size = store.key_size
+
+   now = time.time()
+
+   divider = "="*123
+   ###print("\033c\n\n\n"+divider)
+
+   print(divider)
+
+   for d, status, last_time in store.current_status():
+      key=d+":"
+      if status[0] == '-':
+         battery_status = ' -'
+      else:
+        battery_status=str(status[0]).rjust(2,' ')
+      current_signal_status=str(status[1]).rjust(4,' ')
+      minimum_signal_status=str(status[2]).rjust(4,' ')
+      device_stats = stats.get_stats(d)
+      et_minutes = stats.minutes_since(last_time, now)
+
+      longest_et=int(status[4])
+
+      if et_minutes > longest_et:
+         # Update longest update time current length is greater than longest
+         longest_update=str(et_minutes)
+         with store.status_lock:
+            if d in store.dev_status_dictionary:
+               store.dev_status_dictionary[d][4] = longest_update
+         store.file_dirty = True
+      else:
+         longest_update = status[4]
+
+      # Test for alarm conditions and, where appropriate, display fields as red on white
+      alarm_condition = False
+
+
+      if battery_status != ' -' and int(battery_status) <= config.mid_battery and int(battery_status) > config.min_battery:
+         display_text = encode(YELLOW+NEGATIVE,"Battery:" + battery_status) + "   "
+      elif battery_status != ' -' and int(battery_status) <= config.min_battery:
+         display_text = encode(LIGHT_RED+NEGATIVE,"Battery:" + battery_status) + "   "
+         alarm_condition = True
+      else:
+         display_text = "Battery:" + battery_status + "   "
+
+      if current_signal_status.lstrip() != '??' and int(current_signal_status) < config.min_signal:
+         display_text += encode(LIGHT_RED+NEGATIVE,"Signal:"+current_signal_status) + "   "
+         alarm_condition = True
+      else:
+         display_text += "Signal:"+current_signal_status+"   "
+
+      display_text += "Min Signal:" + minimum_signal_status + "   "
+
+      et_text = str(round(et_minutes/60,1)).rjust(5,' ')
+
+      if et_minutes > device_stats.stale_minutes():
+         display_text += encode(LIGHT_RED+NEGATIVE,"Last Update: " + et_text + " Hrs")
+         alarm_condition = True
+      else:
+         display_text += "Last Update: " + et_text + " Hrs"
+
+      lt_text = str(round(int(longest_update)/60,1)).rjust(5,' ')
+
+      display_text += "   Longest: " + lt_text + " Hrs"
+
+      if alarm_condition:
+         header = "  "+encode(LIGHT_RED+NEGATIVE,key.ljust(key_size," "))+" "
+      else:
+         header = "  "+key.ljust(key_size," ")+" "
+
+      print(header+display_text)
+
+   print_nl(divider)
+   print()
+   return()
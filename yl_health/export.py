@@ -0,0 +1,200 @@
+#=============================================================================================
+# History export
+#
+#    yolink_health.py export [--device NAME ...] [--since 30d] [--until 0d]
+#                            [--format csv|parquet|arrow] [--output FILE]
+#
+# Writes the records in the history files as one table for analysis in a spreadsheet or
+# notebook, with the columns
+#    device_id, name, type, time, battery, signal, kind
+# Time is in seconds since the epoch in CSV and a UTC timestamp in Parquet and Arrow.
+# Battery and signal are empty (null) when the record has none.  CSV is written to the
+# screen unless --output is given.  Parquet and Arrow (IPC file, also read as Feather) need
+# the "pyarrow" library ("pip install pyarrow").
+#
+# Only the history files of the chosen devices are opened, and the start and end of the
+# time range in each file are found by binary search (history.read_chunks).  Records are read
+# and written chunk_records at a time, so memory use doesn't depend on how much history
+# there is.
+#=============================================================================================
+import os
+import sys
+import time
+import datetime
+
+from yl_health import history
+from yl_health.query import error
+from yl_health.common import parse_duration
+
+# Records read at a time, and rows in each Parquet row group or Arrow record batch
+chunk_records = 65536
+
+formats = {'.csv':'csv', '.parquet':'parquet', '.arrow':'arrow', '.feather':'arrow'}
+
+# Function to convert a --since or --until value to seconds since the epoch: either how long
+# ago (e.g. 7d) or a date and time (e.g. 2024-05-01 or 2024-05-01T12:00).  Returns None if
+# it is neither.
+def parse_time(text, now):
+   duration = parse_duration(text)
+   if duration is not None:
+      return(now - duration)
+   try:
+      return(datetime.datetime.fromisoformat(text).timestamp())
+   except ValueError:
+      return(None)
+
+#=============================================================================================
+# Devices to export: [(device ID, name, type)] and the names that matched no device
+#=============================================================================================
+def select_devices(names):
+   index = history.load_device_index()
+   ids = history.device_ids()
+
+   def entry_for(device_id):
+      entry = index.get(device_id, {})
+      return((device_id, entry.get('key', entry.get('name', device_id)), entry.get('type', '')))
+
+   if len(names) == 0:
+      return(sorted([entry_for(device_id) for device_id in ids], key=lambda d: d[1]), [])
+
+   selected = []
+   missing = []
+   for name in names:
+      matches = [device_id for device_id in ids if device_id == name]
+      if len(matches) == 0:
+         matches = [device_id for device_id, entry in index.items()
+                    if (entry.get('key') == name or entry['name'] == name) and device_id in ids]
+      if len(matches) == 0:
+         missing.append(name)
+      for device_id in matches:
+         if device_id not in [d[0] for d in selected]:
+            selected.append(entry_for(device_id))
+   return(selected, missing)
+
+# Function to return (device ID, name, type, records) for each chunk of records to export
+def record_chunks(devices, since, until):
+   for device_id, name, device_type in devices:
+      for records in history.read_chunks(device_id, since, until, chunk_records):
+         yield(device_id, name, device_type, records)
+
+#=============================================================================================
+# CSV
+#=============================================================================================
+def export_csv(devices, since, until, fid):
+   import csv
+
+   writer = csv.writer(fid, lineterminator='\n')
+   writer.writerow(['device_id', 'name', 'type', 'time', 'battery', 'signal', 'kind'])
+   count = 0
+   for device_id, name, device_type, records in record_chunks(devices, since, until):
+      writer.writerows([(device_id, name, device_type, '%.3f' % t,
+                         '' if battery == history.battery_unknown else battery,
+                         '' if signal == history.signal_unknown else signal,
+                         history.kind_names.get(kind, kind))
+                        for t, signal, battery, kind in records])
+      count += len(records)
+   return(count)
+
+#=============================================================================================
+# Parquet and Arrow
+#=============================================================================================
+def arrow_schema():
+   import pyarrow as pa
+   return(pa.schema([('device_id', pa.string()), ('name', pa.string()), ('type', pa.string()),
+                     ('time', pa.timestamp('ms', tz='UTC')), ('battery', pa.int8()),
+                     ('signal', pa.int16()), ('kind', pa.string())]))
+
+# Function to make a record batch from one chunk of records
+def arrow_batch(schema, device_id, name, device_type, records):
+   import pyarrow as pa
+   n = len(records)
+   columns = [pa.array([device_id]*n, pa.string()),
+              pa.array([name]*n, pa.string()),
+              pa.array([device_type]*n, pa.string()),
+              pa.array([int(r[0]*1000) for r in records], schema.field('time').type),
+              pa.array([None if r[2] == history.battery_unknown else r[2] for r in records], pa.int8()),
+              pa.array([None if r[1] == history.signal_unknown else r[1] for r in records], pa.int16()),
+              pa.array([history.kind_names.get(r[3], str(r[3])) for r in records], pa.string())]
+   return(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+def export_arrow(devices, since, until, path, output_format):
+   import pyarrow as pa
+
+   schema = arrow_schema()
+   if output_format == 'parquet':
+      import pyarrow.parquet as pq
+      writer = pq.ParquetWriter(path, schema)
+   else:
+      writer = pa.ipc.new_file(path, schema)
+
+   # Small chunks (devices with little history) are written together
+   pending = []
+   pending_rows = 0
+   count = 0
+   try:
+      for device_id, name, device_type, records in record_chunks(devices, since, until):
+         pending.append(arrow_batch(schema, device_id, name, device_type, records))
+         pending_rows += len(records)
+         count += len(records)
+         if pending_rows >= chunk_records:
+            writer.write_table(pa.Table.from_batches(pending, schema).combine_chunks())
+            pending = []
+            pending_rows = 0
+      if pending_rows > 0:
+         writer.write_table(pa.Table.from_batches(pending, schema).combine_chunks())
+   finally:
+      writer.close()
+   return(count)
+
+#=============================================================================================
+# Command
+#=============================================================================================
+def export_command(args):
+   global chunk_records
+   import importlib.util
+
+   output_format = args.format
+   if output_format is None:
+      output_format = 'csv'
+      if args.output:
+         output_format = formats.get(os.path.splitext(args.output)[1].lower(), 'csv')
+   if output_format != 'csv':
+      if args.output is None:
+         return(error('--output is needed for %s' % output_format))
+      if importlib.util.find_spec('pyarrow') is None:
+         return(error('The %s format needs the "pyarrow" library (pip install pyarrow)' % output_format))
+   if args.chunk is not None:
+      chunk_records = max(1, args.chunk)
+
+   now = time.time()
+   since = until = None
+   if args.since is not None:
+      since = parse_time(args.since, now)
+      if since is None:
+         return(error('Invalid time "%s" (use e.g. 7d or 2024-05-01)' % args.since))
+   if args.until is not None:
+      until = parse_time(args.until, now)
+      if until is None:
+         return(error('Invalid time "%s" (use e.g. 1d or 2024-05-01T12:00)' % args.until))
+
+   devices, missing = select_devices(args.device or [])
+   for name in missing:
+      print('No history for device "%s"' % name, file=sys.stderr)
+   if len(devices) == 0:
+      return(error('No history to export'))
+
+   if output_format == 'csv':
+      if args.output is None:
+         count = export_csv(devices, since, until, sys.stdout)
+      else:
+         fid = open(args.output, 'w', newline='')
+         try:
+            count = export_csv(devices, since, until, fid)
+         finally:
+            fid.close()
+   else:
+      count = export_arrow(devices, since, until, args.output, output_format)
+
+   if args.output is not None:
+      print('%s records of %s devices written to %s' % (count, len(devices), args.output), file=sys.stderr)
+   return(0)
@@ -0,0 +1,187 @@
+#=============================================================================================
+# Battery depletion forecast
+#
+# Once a day a straight line is fitted to the battery level history of every device over
+# the last "forecast_window_days", and the number of days until the line reaches
+# min_battery is reported.  The fit for the whole fleet is done at once with NumPy: all
+# samples are placed in one array with a device index, and the least squares sums for
+# every device are formed with numpy.bincount.
+#
+# The fit runs in a separate worker process so that reading the history and the
+# arithmetic never hold up message handling.  NumPy is only needed in the worker; if it is
+# not installed the forecast is skipped.
+#=============================================================================================
+import time
+import importlib.util
+
+from yl_health import config
+from yl_health import api
+from yl_health import store
+from yl_health import history
+from yl_health.common import post, timestamp, print_nl
+
+# Worker process pool, current forecast job, and latest results: days until min_battery
+# keyed by device name (None when the battery is not falling)
+forecast_executor = None
+forecast_future = None
+forecast_started = 0
+latest = {}
+latest_time = ''
+numpy_missing_reported = False
+
+# Minimum number of battery readings needed for a forecast
+min_readings = 3
+
+#=============================================================================================
+# Worker process
+#=============================================================================================
+
+# Function run in the worker process.  Returns {device ID: (days, slope per day, fitted battery now)}
+def run_forecast(history_folder, min_battery, window_days, now=None):
+   import os
+   import numpy as np
+
+   if now is None:
+      now = time.time()
+   cutoff = now - window_days*86400
+   dtype = np.dtype([('t','<f8'),('signal','<i2'),('battery','i1'),('kind','u1')])
+
+   ids = []
+   times = []
+   levels = []
+   index = []
+   for name in sorted(os.listdir(history_folder)):
+      if name.endswith('.dat') == False:
+         continue
+      records = np.fromfile(os.path.join(history_folder,name), dtype=dtype)
+      keep = (records['battery'] >= 0) & (records['t'] >= cutoff)
+      if np.count_nonzero(keep) == 0:
+         continue
+      index.append(np.full(np.count_nonzero(keep), len(ids), dtype=np.int64))
+      times.append((records['t'][keep]-now)/86400.0)
+      levels.append(records['battery'][keep].astype(np.float64))
+      ids.append(name[:-4])
+
+   if len(ids) == 0:
+      return({})
+
+   idx = np.concatenate(index)
+   t = np.concatenate(times)
+   b = np.concatenate(levels)
+   m = len(ids)
+
+   n = np.bincount(idx, minlength=m).astype(np.float64)
+   st = np.bincount(idx, weights=t, minlength=m)
+   sb = np.bincount(idx, weights=b, minlength=m)
+   stt = np.bincount(idx, weights=t*t, minlength=m)
+   stb = np.bincount(idx, weights=t*b, minlength=m)
+
+   denominator = n*stt - st*st
+   valid = (n >= min_readings) & (denominator > 1e-9)
+   slope = np.zeros(m)
+   slope[valid] = (n[valid]*stb[valid] - st[valid]*sb[valid])/denominator[valid]
+   intercept = np.zeros(m)
+   intercept[n > 0] = (sb[n > 0] - slope[n > 0]*st[n > 0])/n[n > 0]
+
+   falling = valid & (slope < 0)
+   days = np.full(m, np.nan)
+   days[falling] = np.maximum(0.0, (intercept[falling]-min_battery)/(-slope[falling]))
+
+   results = {}
+   for i in range(m):
+      if valid[i] == False:
+         continue
+      if np.isnan(days[i]):
+         results[ids[i]] = (None, float(slope[i]), float(intercept[i]))
+      else:
+         results[ids[i]] = (float(days[i]), float(slope[i]), float(intercept[i]))
+   return(results)
+
+#=============================================================================================
+# Main process
+#=============================================================================================
+
+# Function to start a forecast in the worker process.  Returns False if one can't be started.
+def start_forecast():
+   global forecast_executor, forecast_future, forecast_started, numpy_missing_reported
+
+   if config.history_enabled == False:
+      return(False)
+   if importlib.util.find_spec('numpy') is None:
+      if numpy_missing_reported == False:
+         print_nl("Battery forecast skipped because numpy is not installed")
+         numpy_missing_reported = True
+      return(False)
+   if forecast_future is not None and forecast_future.done() == False:
+      return(True)
+
+   if forecast_executor is None:
+      import multiprocessing
+      from concurrent.futures import ProcessPoolExecutor
+      # The worker is started fresh (not forked) since other threads are running
+      forecast_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+   forecast_future = forecast_executor.submit(run_forecast, history.history_dir, config.min_battery, config.forecast_window_days)
+   forecast_started = time.monotonic()
+   return(True)
+
+# Function to collect the result of a finished forecast.  Returns True once there is no
+# forecast in progress.
+def poll_forecast():
+   global forecast_future, latest, latest_time
+
+   if forecast_future is None:
+      return(True)
+   if forecast_future.done() == False:
+      return(False)
+
+   try:
+      results = forecast_future.result()
+   except Exception as e:
+      print_nl("%s Battery forecast failed: %s" % (timestamp(),e))
+      post("Battery forecast failed: %s" % e)
+      results = None
+   forecast_future = None
+
+   if results is not None:
+      names = {}
+      for d in api.catalog:
+         names[d.id] = d.key
+      for device_id, entry in history.load_device_index().items():
+         names.setdefault(device_id, entry.get('key', entry['name']))
+
+      forecast = {}
+      for device_id, (days, slope, fitted) in results.items():
+         if device_id in names:
+            forecast[names[device_id]] = days
+      latest = forecast
+      latest_time = timestamp()
+      if config.verbose: print_nl("%s Battery forecast complete for %s devices" % (timestamp(),len(forecast)))
+   return(True)
+
+# Function to return seconds since the current forecast was started
+def forecast_running_seconds():
+   if forecast_future is None:
+      return(0)
+   return(time.monotonic()-forecast_started)
+
+# Function to return the predicted days until min_battery for a device, or None
+def days_remaining(device_name):
+   return(latest.get(device_name))
+
+# Function to move the forecast of a renamed device to its new name
+def rename_device(old_name, new_name):
+   if old_name in latest:
+      latest[new_name] = latest.pop(old_name)
+   return()
+
+store.rename_listeners.append(rename_device)
+
+# Function to return a list of (days, device name) for devices predicted to reach
+# min_battery within "battery_forecast_days", soonest first
+def devices_due():
+   due = []
+   for name, days in latest.items():
+      if days is not None and days <= config.battery_forecast_days:
+         due.append((days, name))
+   due.sort()
+   return(due)
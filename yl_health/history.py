@@ -0,0 +1,221 @@
+#=============================================================================================
+# Device history store
+#
+# Every accepted device update is appended to a history file for the device in the
+# "yolink_health_history" folder.  Files are named after the YoLink device ID so that
+# renaming a device does not split its history.  Each record has a fixed size:
+#
+#    time     8 byte float   seconds since the epoch
+#    signal   2 byte integer LoRa signal strength, or signal_unknown
+#    battery  1 byte integer battery level 0-4, or battery_unknown
+#    kind     1 byte integer kind_report, kind_contact or kind_state
+#
+# Records are appended in time order, so a time range is found by binary search on the
+# memory-mapped file without reading the rest of it.  "devices.json" in the same folder
+# maps device IDs to names and types for tools reading the history.
+#
+# With start_writer() (used by the asyncio runtime) records are written by a thread every
+# writer_interval seconds, each file opened once for all of its records, so appending never
+# waits for the disk.
+#=============================================================================================
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+
+from yl_health import config
+
+# Folder holding history files
+history_dir = "yolink_health_history"
+
+# Record layout
+record_format = '<dhbB'
+record_size = struct.calcsize(record_format)
+
+# Values stored when battery or signal were not reported
+signal_unknown = -32768
+battery_unknown = -1
+
+# Kinds of record
+kind_report = 1      # report received from the device
+kind_contact = 2     # hub poll or event which only shows that the device is on line
+kind_state = 3       # state fetched from the YoLink API
+kind_names = {kind_report:'report', kind_contact:'contact', kind_state:'state'}
+
+history_lock = threading.Lock()
+
+# Records waiting for the writer thread as (device ID, record), or None when records are
+# written as they are appended.  writer_lock is held while they are written.
+pending_records = None
+writer_interval = 0.5
+writer_lock = threading.Lock()
+
+# Function to return the history file name for a device
+def history_path(device_id):
+   return(os.path.join(history_dir, device_id+'.dat'))
+
+#=============================================================================================
+# Append a record.  Battery and signal are given as stored in the status dictionary
+# ('-' and '??' when not reported).
+#=============================================================================================
+def append(device_id, battery, signal, kind, t=None):
+   if config.history_enabled == False:
+      return()
+   if t is None:
+      t = time.time()
+   try:
+      battery = int(battery)
+   except:
+      battery = battery_unknown
+   try:
+      signal = int(signal)
+   except:
+      signal = signal_unknown
+
+   record = struct.pack(record_format, t, signal, battery, kind)
+   if pending_records is not None:
+      with history_lock:
+         pending_records.append((device_id, record))
+      return()
+   with history_lock:
+      try:
+         fid = open(history_path(device_id),'ab')
+      except FileNotFoundError:
+         os.makedirs(history_dir, exist_ok=True)
+         fid = open(history_path(device_id),'ab')
+      fid.write(record)
+      fid.close()
+   return()
+
+#=============================================================================================
+# Writer thread
+#=============================================================================================
+
+# Function to write the records waiting for the writer thread
+def write_pending():
+   global pending_records
+   with history_lock:
+      if not pending_records:
+         return()
+      records = pending_records
+      pending_records = []
+   by_device = {}
+   for device_id, record in records:
+      by_device.setdefault(device_id, []).append(record)
+   with writer_lock:
+      for device_id, device_records in by_device.items():
+         try:
+            fid = open(history_path(device_id),'ab')
+         except FileNotFoundError:
+            os.makedirs(history_dir, exist_ok=True)
+            fid = open(history_path(device_id),'ab')
+         fid.write(b''.join(device_records))
+         fid.close()
+   return()
+
+def run_writer():
+   while True:
+      time.sleep(writer_interval)
+      try:
+         write_pending()
+      except Exception as e:
+         from yl_health.common import timestamp, print_nl
+         print_nl("%s History write failed: %s" % (timestamp(),e))
+
+# Function to start writing records from a thread
+def start_writer():
+   global pending_records
+   import atexit
+   if pending_records is not None:
+      return()
+   pending_records = []
+   threading.Thread(target=run_writer, name='history', daemon=True).start()
+   atexit.register(write_pending)
+   return()
+
+# Function to save the device ID to name, type and state key map (see catalog.py) used by
+# tools reading the history and to keep state keys from one run to the next
+def save_device_index(catalog):
+   if config.history_enabled == False:
+      return()
+   index = catalog.index()
+   os.makedirs(history_dir, exist_ok=True)
+   fid = open(os.path.join(history_dir,'devices.json'),'w')
+   json.dump(index, fid, indent=1)
+   fid.close()
+   return()
+
+# Function to load the device ID to name, type and state key map.  Returns {} if there is none.
+def load_device_index():
+   try:
+      fid = open(os.path.join(history_dir,'devices.json'),'r')
+      index = json.load(fid)
+      fid.close()
+   except:
+      index = {}
+   return(index)
+
+#=============================================================================================
+# Read history for one device
+#
+# Returns a list of (time, signal, battery, kind) tuples for records with since <= time
+# < until.  The file is memory mapped and the first record is found by binary search.
+#=============================================================================================
+def read(device_id, since=None, until=None):
+   records = []
+   for chunk in read_chunks(device_id, since, until):
+      records.extend(chunk)
+   return(records)
+
+# Function to read the same records as read(), as lists of at most chunk_records tuples, so
+# that a long history can be handled without holding all of it in memory.  Only the binary
+# search uses the memory map; the records are read in chunks so that the pages of a large
+# file don't stay mapped.
+def read_chunks(device_id, since=None, until=None, chunk_records=65536):
+   try:
+      fid = open(history_path(device_id),'rb')
+   except:
+      return
+   try:
+      size = os.fstat(fid.fileno()).st_size
+      count = size//record_size
+      if count == 0:
+         return
+      mm = mmap.mmap(fid.fileno(), count*record_size, access=mmap.ACCESS_READ)
+      try:
+         first = 0
+         if since is not None:
+            first = search(mm, count, since)
+         last = count
+         if until is not None:
+            last = search(mm, count, until)
+      finally:
+         mm.close()
+      fid.seek(first*record_size)
+      for start in range(first, last, chunk_records):
+         end = min(last, start+chunk_records)
+         yield list(struct.iter_unpack(record_format, fid.read((end-start)*record_size)))
+   finally:
+      fid.close()
+
+# Function to return the index of the first record with time >= t
+def search(mm, count, t):
+   lo = 0
+   hi = count
+   while lo < hi:
+      mid = (lo+hi)//2
+      if struct.unpack_from('<d', mm, mid*record_size)[0] < t:
+         lo = mid+1
+      else:
+         hi = mid
+   return(lo)
+
+# Function to return the device IDs with history files
+def device_ids():
+   try:
+      names = os.listdir(history_dir)
+   except:
+      return([])
+   return([n[:-4] for n in names if n.endswith('.dat')])
@@ -0,0 +1,91 @@
+#=============================================================================================
+# Import time budget check
+#
+# Measures the time taken to import the program modules, using the "-X importtime" option
+# of the Python interpreter in a fresh process, and compares it to a budget.  Also confirms
+# that the heavy libraries are not loaded by the import.
+#
+# Usage:  python -m yl_health.import_budget [budget_ms]
+#
+# Exit code is 0 when the import is within budget, 1 otherwise.
+#=============================================================================================
+import os
+import sys
+import subprocess
+
+# Default budget in milliseconds for "import yl_health.main".  Chosen for a Raspberry Pi 3;
+# a desktop PC will typically be well under a quarter of this.
+import_budget_ms = 150
+
+# Module imported to start the program
+target_module = 'yl_health.main'
+
+# Libraries which must only be loaded when the feature that uses them is enabled
+lazy_modules = ['requests', 'paho', 'smtplib', 'pprint', 'asyncio']
+
+# Function to import the target module in a fresh interpreter and return a list of
+# (module name, self time us, cumulative time us) plus the set of loaded modules
+def measure_import():
+   code = "import sys, %s; print(' '.join(sorted(sys.modules)))" % target_module
+   package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+   proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         cwd=package_dir, capture_output=True, text=True)
+   if proc.returncode != 0:
+      print(proc.stderr)
+      return([], set())
+
+   timings = []
+   for line in proc.stderr.splitlines():
+      if line.startswith('import time:') == False:
+         continue
+      fields = line[len('import time:'):].split('|')
+      if len(fields) != 3:
+         continue
+      try:
+         self_us = int(fields[0])
+         cumulative_us = int(fields[1])
+      except:
+         # Header line
+         continue
+      timings.append((fields[2].strip(), self_us, cumulative_us))
+
+   loaded = set(proc.stdout.split())
+   return(timings, loaded)
+
+def check_budget(budget_ms=import_budget_ms, top=10):
+   timings, loaded = measure_import()
+   if len(timings) == 0:
+      print("Unable to measure import time of %s" % target_module)
+      return(False)
+
+   total_us = 0
+   for name, self_us, cumulative_us in timings:
+      if name == target_module:
+         total_us = cumulative_us
+
+   print("Import of %s: %.1f ms (budget %s ms)" % (target_module, total_us/1000, budget_ms))
+   print("\nSlowest modules (self time):")
+   for name, self_us, cumulative_us in sorted(timings, key=lambda t: t[1], reverse=True)[:top]:
+      print("   %8.1f ms   %s" % (self_us/1000, name))
+
+   within_budget = total_us/1000 <= budget_ms
+
+   eager = [m for m in lazy_modules if m in loaded]
+   if len(eager) > 0:
+      print("\nLibraries loaded at import time which should be loaded on demand: %s" % ', '.join(eager))
+      within_budget = False
+
+   if within_budget:
+      print("\nImport time within budget")
+   else:
+      print("\nImport time OVER budget")
+   return(within_budget)
+
+if __name__ == '__main__':
+   budget = import_budget_ms
+   if len(sys.argv) > 1:
+      budget = int(sys.argv[1])
+   if check_budget(budget):
+      sys.exit(0)
+   else:
+      sys.exit(1)
@@ -0,0 +1,381 @@
+#=============================================================================================
+# InfluxDB sink
+#
+# When "influx_url" is set, every accepted device update (reports, state fetched from the
+# YoLink API, heartbeats and hub polls) is sent to InfluxDB (or anything else that accepts
+# the line protocol, such as Telegraf or VictoriaMetrics) as one point:
+#
+#    yolink_device,device=Front\ Door,type=DoorSensor,id=d123,kind=report battery=4i,signal=-62i,online=true 1718000000000
+#
+# Battery and signal are only included when the update had them.  "influx_url" is the full
+# write URL, e.g.
+#    http://localhost:8086/api/v2/write?org=home&bucket=yolink   (InfluxDB 2, with influx_token)
+#    http://localhost:8086/write?db=yolink                       (InfluxDB 1)
+# and "precision=ms" is added if the URL doesn't give a precision.
+#
+# Adding a point only formats one line and appends it to a list, so the message path is not
+# held up.  A sending thread writes the points in batches of "influx_batch_size", or every
+# "influx_flush_seconds" if fewer have been added, over one HTTP connection which is kept
+# open between batches.  This thread is also used in the asyncio runtime.
+#
+# While the database can't be reached, batches are appended to a spool file
+# ("yolink_health_influx_spool.txt") of at most "influx_spool_mb" megabytes, dropping the
+# oldest points when it is full.  The spool is sent, oldest first, after the next batch
+# that gets through.  Batches the database rejects as invalid (HTTP 4xx other than 429) are
+# dropped rather than spooled.
+#
+# To try it against a stand-in receiver which prints what it is sent:
+#    python -m yl_health.influx --receive 8086 [--fail]
+#    python -m yl_health.influx --send http://localhost:8086/write?db=yolink [--points 10000]
+#=============================================================================================
+import os
+import time
+import threading
+
+from yl_health import config
+from yl_health import metrics
+from yl_health import history
+from yl_health.common import post, timestamp, print_nl
+
+# Name of the spool file
+spool_file = "yolink_health_influx_spool.txt"
+
+# Measurement name
+measurement = "yolink_device"
+
+# Sink started by start_sink(), or None
+sink = None
+
+# Function to escape a tag value (or key) for the line protocol
+def escape_tag(value):
+   return(str(value).replace('\\','\\\\').replace(',','\\,').replace('=','\\=').replace(' ','\\ ').replace('\n','\\n'))
+
+# Function to build the line for one update
+def point_line(device_name, device_id, device_type, battery, signal, kind, t):
+   tags = 'device=' + escape_tag(device_name)
+   if device_type:
+      tags += ',type=' + escape_tag(device_type)
+   if device_id:
+      tags += ',id=' + escape_tag(device_id)
+   tags += ',kind=' + history.kind_names.get(kind, str(kind))
+
+   fields = []
+   try:
+      fields.append('battery=%di' % int(battery))
+   except:
+      pass
+   try:
+      fields.append('signal=%di' % int(signal))
+   except:
+      pass
+   fields.append('online=true')
+   return('%s,%s %s %d' % (measurement, tags, ','.join(fields), int(t*1000)))
+
+class Sink:
+   def __init__(self, url, token='', batch_size=500, flush_seconds=10, spool_bytes=10*1024*1024, timeout=10):
+      from urllib.parse import urlsplit
+
+      if 'precision=' not in url:
+         url += ('&' if '?' in url else '?') + 'precision=ms'
+      parts = urlsplit(url)
+      self.url = url
+      self.secure = parts.scheme == 'https'
+      self.host = parts.hostname or 'localhost'
+      self.port = parts.port or (443 if self.secure else 80)
+      self.path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+      self.headers = {'Content-Type':'text/plain; charset=utf-8'}
+      if token:
+         self.headers['Authorization'] = 'Token ' + token
+      self.batch_size = max(1, batch_size)
+      self.flush_seconds = flush_seconds
+      self.spool_bytes = spool_bytes
+      self.timeout = timeout
+
+      self.buffer = []
+      self.lock = threading.Lock()
+      self.wake = threading.Event()
+      self.stopping = False
+      self.connection = None
+      self.thread = None
+      self.reachable = True
+      self.spooled = count_spooled()
+      metrics.set_gauge('yolink_influx_spooled_points', self.spooled)
+
+   # Add a point.  Called on the message path, so it only appends the line.
+   def add(self, line):
+      with self.lock:
+         self.buffer.append(line)
+         full = len(self.buffer) >= self.batch_size
+      if full:
+         self.wake.set()
+      return()
+
+   def start(self):
+      self.thread = threading.Thread(target=self.run, name='influx', daemon=True)
+      self.thread.start()
+      return()
+
+   # Send what is buffered and stop the sending thread
+   def stop(self, wait=5):
+      self.stopping = True
+      self.wake.set()
+      if self.thread is not None:
+         self.thread.join(wait)
+      return()
+
+   # Sending thread
+   def run(self):
+      while self.stopping == False:
+         self.wake.wait(self.flush_seconds)
+         self.wake.clear()
+         try:
+            self.flush()
+         except Exception as e:
+            print_nl("%s InfluxDB sink error: %s" % (timestamp(),e))
+      self.flush()
+      self.close()
+      return()
+
+   # Function to send the buffered points, batch_size at a time.  Points which can't be sent
+   # are spooled.  Returns the number of points sent.
+   def flush(self):
+      with self.lock:
+         lines = self.buffer
+         self.buffer = []
+      sent = 0
+      for start in range(0, len(lines), self.batch_size):
+         batch = lines[start:start+self.batch_size]
+         result = self.send(batch)
+         if result == 'sent':
+            sent += len(batch)
+         elif result == 'failed':
+            self.spool(lines[start:])
+            return(sent)
+      if self.spooled > 0 and (len(lines) == 0 or sent > 0):
+         self.replay()
+      return(sent)
+
+   #==========================================================================================
+   # HTTP
+   #==========================================================================================
+
+   # Function to write one batch.  Returns 'sent', 'rejected' (dropped) or 'failed' (to be
+   # spooled).
+   def send(self, lines):
+      import http.client
+
+      body = ('\n'.join(lines)).encode('utf-8')
+      try:
+         if self.connection is None:
+            if self.secure:
+               self.connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+            else:
+               self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+         self.connection.request('POST', self.path, body, self.headers)
+         response = self.connection.getresponse()
+         text = response.read()
+         if response.getheader('connection', '').lower() == 'close':
+            self.close()
+      except Exception as e:
+         self.close()
+         return(self.failed(len(lines), e))
+
+      if response.status < 300:
+         metrics.inc('yolink_influx_points_total', len(lines))
+         metrics.inc('yolink_influx_batches_total')
+         if self.reachable == False:
+            print_nl("%s InfluxDB reachable again" % timestamp())
+            post("InfluxDB reachable again")
+            self.reachable = True
+         return('sent')
+      if response.status >= 500 or response.status == 429:
+         return(self.failed(len(lines), "HTTP status %s" % response.status))
+
+      metrics.inc('yolink_influx_rejected_points_total', len(lines))
+      print_nl("%s InfluxDB rejected %s points: HTTP status %s %s" % (timestamp(),len(lines),response.status,text[:200].decode('utf-8','replace')))
+      return('rejected')
+
+   def failed(self, count, error):
+      metrics.inc('yolink_influx_failures_total')
+      if self.reachable:
+         print_nl("%s Unable to send %s points to InfluxDB, spooling: %s" % (timestamp(),count,error))
+         post("Unable to send points to InfluxDB, spooling: %s" % error)
+         self.reachable = False
+      return('failed')
+
+   def close(self):
+      if self.connection is not None:
+         try:
+            self.connection.close()
+         except:
+            pass
+         self.connection = None
+      return()
+
+   #==========================================================================================
+   # Spool
+   #==========================================================================================
+
+   # Function to append points to the spool, dropping the oldest if it is over its size
+   def spool(self, lines):
+      fid = open(spool_file, 'a', encoding='utf-8')
+      fid.write('\n'.join(lines) + '\n')
+      size = fid.tell()
+      fid.close()
+      self.spooled += len(lines)
+      if size > self.spool_bytes:
+         fid = open(spool_file, 'r', encoding='utf-8')
+         kept = fid.readlines()
+         fid.close()
+         # Keep the newest points filling three quarters of the spool, so it isn't
+         # rewritten for every batch
+         total = 0
+         first = len(kept)
+         while first > 0 and total + len(kept[first-1]) <= self.spool_bytes*3//4:
+            first -= 1
+            total += len(kept[first])
+         metrics.inc('yolink_influx_dropped_points_total', first)
+         self.write_spool(kept[first:])
+      metrics.set_gauge('yolink_influx_spooled_points', self.spooled)
+      return()
+
+   # Function to send the spooled points, oldest first.  Points not sent are kept.
+   def replay(self):
+      try:
+         fid = open(spool_file, 'r', encoding='utf-8')
+         lines = [line.rstrip('\n') for line in fid if line.strip()]
+         fid.close()
+      except OSError:
+         lines = []
+      start = 0
+      while start < len(lines):
+         if self.send(lines[start:start+self.batch_size]) == 'failed':
+            break
+         start += self.batch_size
+      self.write_spool([line+'\n' for line in lines[start:]])
+      metrics.set_gauge('yolink_influx_spooled_points', self.spooled)
+      return()
+
+   def write_spool(self, lines):
+      if len(lines) == 0:
+         if os.path.exists(spool_file):
+            os.remove(spool_file)
+      else:
+         fid = open(spool_file, 'w', encoding='utf-8')
+         fid.writelines(lines)
+         fid.close()
+      self.spooled = len(lines)
+      return()
+
+# Function to return the number of points in the spool file
+def count_spooled():
+   try:
+      fid = open(spool_file, 'rb')
+      count = sum(1 for line in fid if line.strip())
+      fid.close()
+   except OSError:
+      count = 0
+   return(count)
+
+#=============================================================================================
+# Updates from the status store
+#=============================================================================================
+def record_update(device_name, device_id, battery, signal, kind, t):
+   from yl_health import api
+
+   device = None
+   if device_id:
+      device = api.catalog.get(device_id)
+   if device is None:
+      device = api.catalog.by_key.get(device_name)
+   sink.add(point_line(device_name, device_id, device.type if device is not None else '', battery, signal, kind, t))
+   return()
+
+# Function to start the sink if "influx_url" is set
+def start_sink():
+   global sink
+   import atexit
+   from yl_health import store
+
+   if config.influx_url == '' or sink is not None:
+      return(False)
+   sink = Sink(config.influx_url, config.influx_token, config.influx_batch_size, config.influx_flush_seconds,
+               config.influx_spool_mb*1024*1024, config.influx_timeout)
+   sink.start()
+   atexit.register(sink.stop)
+   store.update_listeners.append(record_update)
+   post("Sending device updates to %s" % sink.url)
+   return(True)
+
+metrics.describe('yolink_influx_points_total', 'Points written to InfluxDB')
+metrics.describe('yolink_influx_batches_total', 'Batches written to InfluxDB')
+metrics.describe('yolink_influx_failures_total', 'Batches which could not be sent to InfluxDB and were spooled')
+metrics.describe('yolink_influx_rejected_points_total', 'Points InfluxDB rejected as invalid')
+metrics.describe('yolink_influx_dropped_points_total', 'Spooled points dropped because the spool was full')
+metrics.describe('yolink_influx_spooled_points', 'Points waiting in the spool file')
+
+#=============================================================================================
+# Stand-in receiver and test sender
+#=============================================================================================
+
+# Function to run an HTTP server which accepts writes and prints a line for each batch.  With
+# fail=True it answers 503, to test the spool.
+def receive(port, fail=False, show=2):
+   from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+   class Receiver(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_POST(self):
+         body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+         lines = body.decode('utf-8').splitlines()
+         print("%s %s %s points%s" % (timestamp(), self.path, len(lines), ' (refused)' if fail else ''))
+         for line in lines[:show]:
+            print("   " + line)
+         self.send_response(503 if fail else 204)
+         self.send_header('Content-Length', '0')
+         self.end_headers()
+
+      def log_message(self, format, *args):
+         return
+
+   server = ThreadingHTTPServer(('', port), Receiver)
+   print("Receiving on port %s" % port)
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   return()
+
+# Function to send generated points through a sink and report the time taken to add them
+def send_test_points(url, points, batch_size):
+   test_sink = Sink(url, batch_size=batch_size, flush_seconds=1)
+   test_sink.start()
+   now = time.time()
+   started = time.perf_counter()
+   for i in range(points):
+      test_sink.add(point_line('Test Device %s' % (i % 50), 'd%015d' % (i % 50), 'DoorSensor', 4, -60 - i % 40, history.kind_report, now + i/1000))
+   elapsed = time.perf_counter() - started
+   print("%s points added in %.1f ms (%.2f us per point)" % (points, elapsed*1000, elapsed*1e6/max(1,points)))
+   test_sink.stop(30)
+   print(metrics.counters)
+   print("%s points in the spool" % test_sink.spooled)
+   return()
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(description='InfluxDB sink test tools')
+   parser.add_argument('--receive', type=int, metavar='PORT', help='run a stand-in receiver on this port')
+   parser.add_argument('--fail', action='store_true', help='stand-in receiver refuses every write (HTTP 503)')
+   parser.add_argument('--send', metavar='URL', help='send generated points to this write URL')
+   parser.add_argument('--points', type=int, default=10000, help='number of points to send (default 10000)')
+   parser.add_argument('--batch', type=int, default=500, help='points per batch (default 500)')
+   args = parser.parse_args()
+   # The test tools don't use the configuration file or the activity log
+   config.logging = False
+   if args.receive:
+      receive(args.receive, args.fail)
+   elif args.send:
+      send_test_points(args.send, args.points, args.batch)
+   else:
+      parser.print_help()
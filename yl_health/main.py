@@ -0,0 +1,141 @@
+#=============================================================================================
+# Main Program
+#=============================================================================================
+import os
+import time
+import datetime
+
+from yl_health import Filename, Version
+from yl_health import config
+from yl_health import common
+from yl_health import api
+from yl_health import store
+from yl_health import mqtt_ingest
+from yl_health import startup
+from yl_health import prober
+from yl_health import topology
+from yl_health import forecast
+from yl_health import metrics
+from yl_health import dashboard
+from yl_health import notifiers
+from yl_health import influx
+from yl_health import standby
+from yl_health import shared_ingest
+from yl_health.common import post, timestamp, print_bs, print_nl, get_decade, get_minute, get_hour, get_dow
+from yl_health.display import display_table
+from yl_health.alerts import check_status
+
+def main():
+   common.first_time = True
+   current_decade = get_decade()
+   current_hour = 99
+   current_minute = 99
+   current_dow=9
+   daily_check_due = False
+   store.file_dirty=False
+
+   print("\033c\n%s Program start: %s Version %s\n" % (timestamp(),Filename, Version))
+
+   if os.path.exists(config.config_file):
+      config.read_config_variables()
+      if config.valid_config_file:
+         post("\n%s\nProgram %s Version %s startup\n%s" % ('='*50, Filename, Version, '='*50))
+      else:
+         print('Invalid configuration file "%s".  Program unable to continue.\n' % config.config_file)
+
+   else:
+      config.valid_config_file = False
+      print('Missing configuraton file "%s".\n' % config.config_file)
+      print('Obtain a copy of "yolink_health_template.cfg", edit it for your environment,')
+      print('then save it as "%s" in the same folder as the main "yolink_health.py" program.' % config.config_file)
+      print('\nExiting program\n')
+
+   if config.valid_config_file == False:
+      return()
+
+   mqtt_ingest.build_event_table()
+   store.load_table()
+
+   # Optional hot standby: wait until this copy holds the lease (see standby.py)
+   if standby.enabled():
+      standby.wait_for_lease(warm=(config.runtime == 'threads'))
+      standby.start_active()
+
+   # Optional single event loop for all network I/O (see aio.py)
+   if config.runtime == 'asyncio':
+      from yl_health import aio
+      aio.run()
+      return()
+
+   dashboard.start_dashboard()
+   notifiers.start_notifiers()
+   influx.start_sink()
+   if config.ingest_workers > 0:
+      shared_ingest.start(config.ingest_workers, config.ingest_max_devices)
+
+   while True:
+      # ------------------------------------------------------------------------
+      # Get a new token, connect to the MQTT broker and get the list of devices.
+      # Runs at program start and agin 5 minutes before end of
+      # each access token valid period
+      startup.YL_start_session()
+
+      # ------------------------------------------------------------------------
+      # Non-Blocking infinite loop looking for responses
+      if config.verbose: print_nl("%s Starting Loop" % timestamp())
+      if common.first_time: post("Starting Loop\n")
+      if common.first_time: display_table()
+      if common.first_time: topology.start()
+      YL_refresh_time = api.YL_access_token_timestamp+datetime.timedelta(minutes=(api.YL_token_valid_minutes-5))
+      common.first_time = False
+      while datetime.datetime.now() < YL_refresh_time and api.dictionary_reload_required == False:
+
+         # Write the status table to file once every ten minutes
+         if current_decade != get_decade():
+            if store.file_dirty:
+               if config.verbose: print_nl("New Decade - Writing Table")
+               store.write_table()
+            metrics.write_metrics()
+            current_decade = get_decade()
+
+         # Check for overdue devices once a minute
+         if current_minute != get_minute():
+            prober.probe_overdue_devices()
+            topology.check_deadlines()
+            current_minute = get_minute()
+
+         # Update hub status once an hour
+         if current_hour != get_hour():
+            # Poll for hub status since hubs don't broadcast status messages
+            for d in api.catalog.hubs():
+               on_line = api.get_device_status(d)
+               if on_line:
+                  # Update status dictionary with current time -- creates new record if necessary
+                  store.record_contact(d.key,d.id)
+            current_hour = get_hour()
+
+         # If new day, start the battery forecast.  Then check status and send warning emails
+         # as appropriate once the forecast is complete (or has taken longer than two minutes)
+         if current_dow != get_dow():
+            forecast.start_forecast()
+            daily_check_due = True
+            current_dow = get_dow()
+
+         forecast_complete = forecast.poll_forecast()
+         if daily_check_due and (forecast_complete or forecast.forecast_running_seconds() > 120):
+            display_table()
+            if standby.claim_daily_check():
+               check_status()
+            daily_check_due = False
+
+         standby.heartbeat()
+         print_bs(timestamp())
+         time.sleep(1)
+
+      # ------------------------------------------------------------------------
+      # Time for refresh.  Go to top of loop, re-establish MQQT connection and reload dictionary
+      print(common.backspaces)
+      if common.first_time: post("Disconnecting")
+      mqtt_ingest.YL_close_MQTT_connection()
+      print_nl("%s Recycling\n" % timestamp())
+      post("\nRecyling\n")
@@ -0,0 +1,149 @@
+#=============================================================================================
+# Metrics output
+#
+# Program counters and per-device values are written every ten minutes (with the status
+# table) to "yolink_health_metrics.prom" in the Prometheus text format, so that they can be
+# collected by the node_exporter "textfile" collector or read directly.
+#
+# Other modules count events with inc() and report values with set_gauge().
+#=============================================================================================
+import os
+import threading
+
+from yl_health import config
+from yl_health import store
+from yl_health import stats
+from yl_health import forecast
+from yl_health import signal_stats
+
+# Name of metrics file
+metrics_file = "yolink_health_metrics.prom"
+
+# Counters and gauges by metric name, and help text for each metric
+counters = {}
+gauges = {}
+help_text = {}
+metrics_lock = threading.Lock()
+
+# Functions called before the file is written, to set gauges which change continuously
+collectors = []
+
+# Add to a counter.  The name may include labels, e.g. 'name{event="x"}'.
+def inc(name, amount=1):
+   with metrics_lock:
+      counters[name] = counters.get(name, 0) + amount
+   return()
+
+# Set a gauge.  The name may include labels.
+def set_gauge(name, value):
+   with metrics_lock:
+      gauges[name] = value
+   return()
+
+# Function to add help text for a metric
+def describe(name, text):
+   help_text[name] = text
+   return()
+
+# Function to escape a label value
+def label(value):
+   return(str(value).replace('\\','\\\\').replace('"','\\"').replace('\n',' '))
+
+# Function to build the per-device lines of the metrics file
+def device_lines():
+   lines = []
+   battery = []
+   signal = []
+   age = []
+   stale = []
+   days = []
+   signal_window = []
+   for name, record, last_time in store.current_status():
+      tag = '{device="%s"}' % label(name)
+      if str(record[0]).strip() != '-':
+         battery.append('yolink_device_battery%s %s' % (tag, record[0]))
+      if str(record[1]).strip() != '??':
+         signal.append('yolink_device_signal%s %s' % (tag, record[1]))
+      device_stats = stats.get_stats(name)
+      age.append('yolink_device_age_minutes%s %s' % (tag, stats.minutes_since(last_time)))
+      stale.append('yolink_device_stale_minutes%s %s' % (tag, device_stats.stale_minutes()))
+      remaining = forecast.days_remaining(name)
+      if remaining is not None:
+         days.append('yolink_device_battery_days_remaining%s %.1f' % (tag, remaining))
+      for window in signal_stats.windows:
+         result = signal_stats.window_stats(name, window)
+         if result is None:
+            continue
+         window_tag = '{device="%s",window="%s",hub="%s"}' % (label(name), window, label(signal_stats.device_hub.get(name,'')))
+         for p in ('p5','p50','p95'):
+            signal_window.append('yolink_device_signal_%s%s %s' % (p, window_tag, result[p]))
+         signal_window.append('yolink_device_signal_slope%s %.3f' % (window_tag, result['slope']))
+         signal_window.append('yolink_device_dropout_ratio%s %.3f' % (window_tag, result['dropout']))
+
+   for name, text, values in [('yolink_device_battery', 'Battery level (1-4)', battery),
+                              ('yolink_device_signal', 'Current LoRa signal strength', signal),
+                              ('yolink_device_age_minutes', 'Minutes since last report', age),
+                              ('yolink_device_stale_minutes', 'Minutes without a report after which the device is stale', stale),
+                              ('yolink_device_battery_days_remaining', 'Predicted days until battery reaches min_battery', days)]:
+      if len(values) > 0:
+         lines.append('# HELP %s %s' % (name, text))
+         lines.append('# TYPE %s gauge' % name)
+         lines.extend(values)
+
+   # Rolling signal statistics, one line per device, window and statistic
+   if len(signal_window) > 0:
+      for name, text in [('yolink_device_signal_p5', '5th percentile signal strength over the window'),
+                         ('yolink_device_signal_p50', 'Median signal strength over the window'),
+                         ('yolink_device_signal_p95', '95th percentile signal strength over the window'),
+                         ('yolink_device_signal_slope', 'Signal strength trend over the window in dBm per day'),
+                         ('yolink_device_dropout_ratio', 'Fraction of expected reports not received over the window')]:
+         lines.append('# HELP %s %s' % (name, text))
+         lines.append('# TYPE %s gauge' % name)
+         lines.extend([line for line in signal_window if line.startswith(name+'{')])
+   return(lines)
+
+#=============================================================================================
+# Write the metrics file
+#=============================================================================================
+def write_metrics():
+   if config.metrics_enabled == False:
+      return()
+
+   for collector in collectors:
+      collector()
+
+   lines = []
+   with metrics_lock:
+      counter_items = sorted(counters.items())
+      gauge_items = sorted(gauges.items())
+   family = None
+   for name, value in counter_items:
+      if name.split('{')[0] != family:
+         family = name.split('{')[0]
+         if family in help_text: lines.append('# HELP %s %s' % (family, help_text[family]))
+         lines.append('# TYPE %s counter' % family)
+      lines.append('%s %s' % (name, value))
+   family = None
+   for name, value in gauge_items:
+      if name.split('{')[0] != family:
+         family = name.split('{')[0]
+         if family in help_text: lines.append('# HELP %s %s' % (family, help_text[family]))
+         lines.append('# TYPE %s gauge' % family)
+      lines.append('%s %s' % (name, value))
+   lines.extend(device_lines())
+
+   # Write to a temporary file and rename so that readers never see a partial file
+   temp_file = metrics_file + '.tmp'
+   fid = open(temp_file,'w')
+   fid.write('\n'.join(lines) + '\n')
+   fid.close()
+   os.replace(temp_file, metrics_file)
+   return()
+
+describe('yolink_messages_total', 'MQTT messages received')
+describe('yolink_messages_duplicate_total', 'Messages dropped because their msgid had been seen recently')
+describe('yolink_messages_invalid_total', 'Messages dropped because they could not be decoded')
+describe('yolink_messages_reordered_total', 'Messages dropped because they were older than the latest message from the device')
+describe('yolink_message_delay_seconds', 'Time between the event time of the latest message and its arrival')
+describe('yolink_messages_sampled_out_total', 'Messages of sampled events which only updated the last contact time')
+describe('yolink_messages_overrun_total', 'Updates lost because a device sent more than the worker queue holds between two scans')
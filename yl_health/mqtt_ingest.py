@@ -0,0 +1,562 @@
+#=============================================================================================
+# MQTT ingest: connection to the YoLink MQTT broker and handling of device reports
+#
+# The "paho-mqtt" library is imported when the connection is established so that the
+# other modules can be used without it.
+#=============================================================================================
+import json
+import time
+import random
+import threading
+from collections import OrderedDict
+
+from yl_health import config
+from yl_health import common
+from yl_health import api
+from yl_health import store
+from yl_health import metrics
+from yl_health import decoder
+from yl_health import signal_stats
+from yl_health.common import post, timestamp, print_nl, unpack_unix_time
+from yl_health.display import display_table
+
+# Yolink MQTT Broker variables:
+YL_mqttBroker = 'api.yosmart.com'
+YL_port = 8003
+
+# MQTT client and subscription topic, set by YL_establish_MQTT_connection()
+YL_client = None
+YL_topic = ''
+
+# Events handled as device reports.  Entries from "extra_events" in the configuration file
+# are added to these.
+recognized_events = ['LeakSensor.Alert', 'LeakSensor.Report',
+                     'DoorSensor.Alert', 'DoorSensor.Report', 'DoorSensor.setOpenRemind',
+                     'MotionSensor.Alert', 'MotionSensor.StatusChange', 'MotionSensor.Report',
+                     'Manipulator.Alert', 'Manipulator.getState', 'Manipulator.Report', 'Manipulator.StatusChange',
+                     'PowerFailureAlarm.Alert', 'PowerFailureAlarm.StatusChange', 'PowerFailureAlarm.Report',
+                     'Switch.Alert', 'Switch.Report', 'Switch.StatusChange', 'Switch.setState', 'Switch.getState',
+                     'Outlet.Alert', 'Outlet.Report', 'Outlet.StatusChange', 'Outlet.setState', 'Outlet.getState',
+                     'Outlet.powerReport',
+                     'THSensor.Alert', 'THSensor.Report', 'THSensor.DataRecord']
+
+# Device types powered from the mains, whose messages carry no battery level
+powered_types = ('Outlet', 'Switch')
+
+# Actions taken for an event
+action_report = 1       # update battery, signal and last contact, redraw the table
+action_heartbeat = 2    # update last contact only, if the device reports itself on line
+action_excluded = 3     # ignore
+action_unsupported = 4  # ignore, and log if "log_unsupported_messages" is set
+
+# Dispatch tables built by build_event_table(): (action, field extractor, sampling interval
+# in seconds) by event name, and by device type for "Type.*" entries in the configuration file
+event_table = {}
+type_table = {}
+
+# Monotonic time each (device ID, event) pair was last fully processed, for sampled events
+last_processed = {}
+
+# Message IDs seen recently, oldest first, with the time each was received.  An ID is
+# remembered for dedupe_seconds, and at most dedupe_size IDs are kept.
+seen_msgids = OrderedDict()
+dedupe_seconds = 600
+dedupe_size = 4096
+
+# Event time (milliseconds) of the latest message accepted from each device, and the delay
+# after which a message is recorded at its event time rather than when it arrived
+event_watermark = {}
+late_seconds = 60
+
+# Set once the device list for the current session has been loaded.  Messages that arrive
+# before then are held in pending_messages and processed by release_pending_messages().
+catalog_ready = threading.Event()
+pending_messages = []
+pending_lock = threading.Lock()
+
+# Function which takes over the handling of message payloads, set when the multi-process
+# ingest is running (see shared_ingest.py)
+message_router = None
+
+#=============================================================================================
+# Establish connection to YoLink MQTT Broker
+#
+# The connection is looked after by a supervisor thread, which runs the paho network loop
+# and reconnects when the connection fails or is lost.  Attempts are spaced by exponential
+# backoff with jitter (reconnect_min_delay doubling up to reconnect_max_delay), so a broker
+# outage never blocks the network thread and many clients don't retry in step.  The access
+# token is only refreshed when the broker rejects it (return codes 4 and 5).  The topic is
+# subscribed once for each successful connection.
+#=============================================================================================
+
+# Reconnect delays in seconds
+reconnect_min_delay = 1
+reconnect_max_delay = 120
+
+# Supervisor thread and the event used to stop it
+supervisor_thread = None
+supervisor_stop = None
+
+# Connection state, for the metrics file: whether connected, monotonic time of the last
+# connect or disconnect, number of failed attempts since the last connection, and whether
+# the access token must be refreshed before the next attempt
+connected = False
+connected_since = 0
+disconnected_since = 0
+connect_failures = 0
+auth_failed = False
+sessions = 0
+
+# Establish MQTT connection
+def YL_establish_MQTT_connection():
+   global YL_topic, YL_client, supervisor_thread, supervisor_stop, connect_failures, disconnected_since, sessions
+   import paho.mqtt.client as mqtt
+
+   # The access token and home ID must be current before this is called.  See
+   # api.YL_refresh_credentials().
+   if common.first_time: post("Establishing connection to MQTT Broker")
+
+   if config.verbose: print_nl("%s Establishing connection to MQTT Broker" % timestamp())
+
+   #Normal topic that gets all responses with 'report' in the topic name
+   YL_topic = 'yl-home/' + api.YL_home_ID + '/+/report'
+
+   # Create the MQTT client
+   YL_client = mqtt.Client()
+   YL_client.username_pw_set(username=api.YL_access_token)
+   YL_client.on_connect = YL_on_connect
+   YL_client.on_disconnect = YL_on_disconnect
+   YL_client.on_message = YL_on_message
+
+   # Start the supervisor.  It connects, and the subscription is made by YL_on_connect()
+   connect_failures = 0
+   sessions = 0
+   disconnected_since = time.monotonic()
+   supervisor_stop = threading.Event()
+   supervisor_thread = threading.Thread(target=YL_supervise_connection, args=(YL_client, supervisor_stop), name='mqtt', daemon=True)
+   supervisor_thread.start()
+   if common.first_time: post("Started MQTT connection supervisor")
+   return()
+
+# Function to close the MQTT connection and stop the supervisor
+def YL_close_MQTT_connection():
+   global supervisor_thread
+   if supervisor_thread is not None:
+      supervisor_stop.set()
+      supervisor_thread.join(10)
+      supervisor_thread = None
+   return()
+
+# Function to return the delay before the next connection attempt
+def backoff_delay(failures):
+   delay = min(reconnect_max_delay, reconnect_min_delay * 2**min(failures,16))
+   return(delay/2 + random.uniform(0, delay/2))
+
+# Supervisor thread: connect, run the network loop, and reconnect after failures
+def YL_supervise_connection(client, stop):
+   global connect_failures, auth_failed
+
+   link_up = False
+   next_attempt = 0
+   while stop.is_set() == False:
+      if link_up == False:
+         wait = next_attempt - time.monotonic()
+         if wait > 0:
+            stop.wait(min(wait, 1.0))
+            continue
+         if auth_failed:
+            try:
+               api.YL_refresh_credentials()
+               client.username_pw_set(username=api.YL_access_token)
+               auth_failed = False
+            except Exception as e:
+               # Keep backing off; the token endpoint may only be briefly unavailable
+               connect_failures += 1
+               metrics.inc('yolink_mqtt_connect_failures_total')
+               delay = backoff_delay(connect_failures)
+               print_nl("%s Unable to refresh access token (%s).  Retrying in %.0f seconds" % (timestamp(),e,delay))
+               next_attempt = time.monotonic() + delay
+               continue
+         try:
+            client.connect(host=YL_mqttBroker, port=YL_port, keepalive=60)
+            link_up = True
+         except Exception as e:
+            connect_failures += 1
+            metrics.inc('yolink_mqtt_connect_failures_total')
+            delay = backoff_delay(connect_failures)
+            print_nl("%s Unable to connect to YoLink MQTT Broker (%s).  Retrying in %.0f seconds" % (timestamp(),e,delay))
+            post("MQTT connect failed: %s" % e)
+            next_attempt = time.monotonic() + delay
+            continue
+
+      # The network loop returns non-zero once the connection has been lost or refused
+      if client.loop(timeout=1.0) != 0:
+         link_up = False
+         if connected:
+            YL_on_disconnect(client, None, -1)
+         delay = backoff_delay(connect_failures)
+         if config.verbose: print_nl("%s MQTT connection lost.  Reconnecting in %.0f seconds" % (timestamp(),delay))
+         next_attempt = time.monotonic() + delay
+
+   try:
+      client.disconnect()
+      client.loop(timeout=0.1)
+   except:
+      pass
+   YL_on_disconnect(client, None, 0)
+   return()
+
+# Function to add the connection state to the metrics file
+def connection_metrics():
+   now = time.monotonic()
+   metrics.set_gauge('yolink_mqtt_connected', 1 if connected else 0)
+   metrics.set_gauge('yolink_mqtt_connection_uptime_seconds', round(now-connected_since) if connected else 0)
+   metrics.set_gauge('yolink_mqtt_disconnected_seconds', 0 if connected else round(now-disconnected_since))
+   return()
+
+metrics.collectors.append(connection_metrics)
+metrics.describe('yolink_mqtt_connected', '1 while connected to the YoLink MQTT broker')
+metrics.describe('yolink_mqtt_connection_uptime_seconds', 'Time since the current MQTT connection was made')
+metrics.describe('yolink_mqtt_disconnected_seconds', 'Time since the MQTT connection was lost, while disconnected')
+metrics.describe('yolink_mqtt_disconnected_seconds_total', 'Total time disconnected between MQTT connections')
+metrics.describe('yolink_mqtt_reconnects_total', 'MQTT connections made after the first of the program run')
+metrics.describe('yolink_mqtt_connect_failures_total', 'Failed or refused MQTT connection attempts')
+
+#=============================================================================================
+# Functions to hold messages received before the device list has been loaded
+#=============================================================================================
+
+# Start holding messages.  Called at the start of each session.
+def hold_messages():
+   catalog_ready.clear()
+   return()
+
+# Process messages received while the device list was being loaded, then stop holding.
+# Messages arriving while the held ones are processed are queued behind them, so they are
+# all handled in order on this thread; holding stops once the queue is empty.
+def release_pending_messages():
+   global pending_messages
+
+   total = 0
+   while True:
+      with pending_lock:
+         held = pending_messages
+         pending_messages = []
+         if len(held) == 0:
+            catalog_ready.set()
+            break
+      total += len(held)
+      for YL_msg in held:
+         handle_message(YL_msg)
+
+   if config.verbose and total > 0: print_nl("Processed %s messages received during startup" % total)
+   return()
+
+#=============================================================================================
+# Functions to be executed when a connection to the YoLink MQTT Broker is established,
+# refused or lost.  These run on the supervisor thread and must not block.
+#=============================================================================================
+
+def YL_on_connect(YL_client, YL_username, YL_flags, YL_rc):
+   global connected, connected_since, connect_failures, auth_failed, sessions
+
+   if common.first_time: post("On Connect - Return Code %s" % YL_rc)
+
+   if YL_rc == 0:
+      if config.verbose: print_nl("%s Connected to YoLink MQTT Broker" % timestamp())
+      now = time.monotonic()
+      if sessions > 0:
+         metrics.inc('yolink_mqtt_reconnects_total')
+         metrics.inc('yolink_mqtt_disconnected_seconds_total', round(now-disconnected_since,1))
+      sessions += 1
+      connected = True
+      connected_since = now
+      connect_failures = 0
+
+      # Subscribe once for each connection.  The subscription does not survive a reconnect.
+      if common.first_time: post("Subscribing to %s" % YL_topic)
+      if config.verbose: print_nl("*** Topic Subscribed: %s" % YL_topic)
+      YL_client.subscribe(YL_topic)
+      return()
+
+   elif YL_rc == 5:
+      print_nl("\n%s Authorization error connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   elif YL_rc == 1:
+      print_nl("\n%s 'Incorrect Protocol' reported while connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   elif YL_rc == 2:
+      print_nl("\n%s 'Invalid Client Identifier' reported while connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   elif YL_rc == 3:
+      print_nl("\n%s 'Server Unavailable' reported while connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   elif YL_rc== 4:
+      print_nl("\n%s 'Invalid User Name or Password' reported while connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   else:
+      print_nl("\n%s 'Unknown Error' reported while connecting to YoLink MQTT Broker, result code %s" % (timestamp(),str(YL_rc)))
+
+   # Connection refused.  Refresh the access token before the next attempt if it was
+   # rejected, and let the supervisor retry after the backoff delay.
+   connect_failures += 1
+   metrics.inc('yolink_mqtt_connect_failures_total')
+   if YL_rc in (4, 5):
+      auth_failed = True
+   YL_client.disconnect()
+   return()
+
+def YL_on_disconnect(YL_client, YL_userdata, YL_rc):
+   global connected, disconnected_since
+   if connected:
+      connected = False
+      disconnected_since = time.monotonic()
+      if YL_rc != 0:
+         print_nl("%s Disconnected from YoLink MQTT Broker, result code %s" % (timestamp(),YL_rc))
+         post("Disconnected from MQTT broker, result code %s" % YL_rc)
+   return()
+
+#=============================================================================================
+# Field extractors.  Each returns (state, battery, signal, hub) from a decoded message (see
+# decoder.py), with '-' and '??' for a missing battery and signal.
+#=============================================================================================
+def battery_device_fields(message):
+   battery = message.battery
+   signal = message.signal
+   return(message.state,
+          '-' if battery is None else str(battery),
+          '??' if signal is None else str(signal),
+          message.hub)
+
+def powered_device_fields(message):
+   signal = message.signal
+   return(message.state, '-', '??' if signal is None else str(signal), message.hub)
+
+# Function to return the field extractor for an event name
+def fields_for(event):
+   if event.split('.')[0] in powered_types:
+      return(powered_device_fields)
+   return(battery_device_fields)
+
+unsupported_entry = (action_unsupported, battery_device_fields, 0)
+
+# Function to read the "sampled_events" entries ("event:seconds").  Returns {event: seconds}.
+def sampling_intervals():
+   intervals = {}
+   for entry in config.sampled_events:
+      entry = entry.strip()
+      if len(entry) == 0:
+         continue
+      name, _, seconds = entry.rpartition(':')
+      try:
+         intervals[name.strip()] = int(seconds)
+      except:
+         print_nl('Invalid sampled_events entry "%s" ignored (use event:seconds)' % entry)
+   return(intervals)
+
+#=============================================================================================
+# Build the dispatch table from the built-in list of recognized events and the
+# "extra_events", "excluded_events" and "heartbeat_events" configuration entries.  Later
+# lists override earlier ones.  An entry may name every event of a device type as "Type.*".
+#
+# Events listed in "sampled_events" are fully processed at most once per interval for each
+# device.  In between, only the device's last contact time is updated.
+#=============================================================================================
+def build_event_table():
+   global event_table, type_table
+   events = {}
+   types = {}
+   rules = [(action_report, recognized_events + config.extra_events),
+            (action_excluded, config.excluded_events),
+            (action_heartbeat, config.heartbeat_events)]
+   for action, names in rules:
+      for name in names:
+         name = name.strip()
+         if len(name) == 0:
+            continue
+         if name.endswith('.*'):
+            device_type = name[:-2]
+            types[device_type] = (action, fields_for(name))
+            # A type rule also applies to events of that type listed earlier
+            for event in list(events):
+               if event.split('.')[0] == device_type:
+                  events[event] = types[device_type]
+         else:
+            events[name] = (action, fields_for(name))
+   # Add sampling intervals.  An exact entry takes precedence over a "Type.*" entry.
+   intervals = sampling_intervals()
+   for table, suffix in ((events, ''), (types, '.*')):
+      for name, (action, extract_fields) in table.items():
+         interval = intervals.get(name+suffix, intervals.get(name.split('.')[0]+'.*', 0))
+         if action == action_excluded:
+            interval = 0
+         table[name] = (action, extract_fields, interval)
+
+   event_table = events
+   type_table = types
+
+   if config.verbose:
+      names = {action_report:'report', action_heartbeat:'heartbeat', action_excluded:'excluded'}
+      print("\n\nEvent table:\n")
+      for table, suffix in ((event_table, ''), (type_table, '.*')):
+         for name in sorted(table):
+            action, extract_fields, interval = table[name]
+            print("   %s %s%s" % ((name+suffix).ljust(32), names[action], (' every %s seconds' % interval) if interval > 0 else ''))
+      print("")
+   return()
+
+# Function to return the (action, field extractor, sampling interval) for an event
+def classify(event):
+   entry = event_table.get(event)
+   if entry is None:
+      entry = type_table.get(event.split('.')[0], unsupported_entry)
+   return(entry)
+
+#=============================================================================================
+# Duplicate and late message suppression
+#
+# The broker may deliver a message more than once (e.g. after a reconnect).  Each message
+# carries a "msgid", which is looked up in the set of recently seen IDs.  Messages from a
+# device also carry the device's event "time"; a message older than the latest one accepted
+# from the device is late and must not move its state backwards.
+#=============================================================================================
+
+# Function to return True if the message ID has been seen recently.  Otherwise the ID is
+# remembered and False is returned.
+def duplicate_message(msgid):
+   if msgid is None:
+      return(False)
+   if msgid in seen_msgids:
+      return(True)
+   now = time.monotonic()
+   seen_msgids[msgid] = now
+   while len(seen_msgids) > dedupe_size or next(iter(seen_msgids.values())) < now - dedupe_seconds:
+      seen_msgids.popitem(last=False)
+   return(False)
+
+# Function to check a message's event time against the device's watermark.  Returns the
+# event time in milliseconds (None if the message has none) and whether the message is late.
+def check_event_time(device_id, event_time):
+   if type(event_time) is not int or event_time <= 0:
+      return(None, False)
+   if event_time < event_watermark.get(device_id, 0):
+      return(event_time, True)
+   event_watermark[device_id] = event_time
+   return(event_time, False)
+
+#=============================================================================================
+# FUnction to be used as callback when message is received from MQTT Broker
+#=============================================================================================
+
+def YL_on_message(YL_client, YL_userdata, YL_msg):
+   if catalog_ready.is_set() == False:
+      with pending_lock:
+         if catalog_ready.is_set() == False:
+            pending_messages.append(YL_msg)
+            return
+   handle_message(YL_msg)
+   return
+
+# Function to handle one message once the device list has been loaded
+def handle_message(YL_msg):
+   if message_router is not None:
+      message_router(YL_msg.payload)
+      return
+
+   metrics.inc('yolink_messages_total')
+
+   try:
+      YL_message = decoder.decode(YL_msg.payload)
+   except ValueError as e:
+      metrics.inc('yolink_messages_invalid_total')
+      if config.verbose: print_nl("%s: Invalid message dropped: %s" % (timestamp(),e))
+      return
+   YL_device_id=YL_message.device_id
+
+   if config.log_raw:
+      fid = open("MQTT_raw.txt","a")
+      fid.write("%s\n" % timestamp())
+      for key, value in json.loads(YL_msg.payload).items():
+         fid.write("%s:%s\n" % (key,value))
+      fid.write("\n")
+      fid.close()
+
+   if duplicate_message(YL_message.msgid):
+      metrics.inc('yolink_messages_duplicate_total')
+      if config.verbose: print_nl("%s: Duplicate message %s dropped" % (timestamp(),YL_message.msgid))
+      return
+
+   YL_device=api.catalog.get(YL_device_id)
+   if YL_device is None:
+      api.dictionary_reload_required = True
+      print("\n\n*** New Device Reported.  Device List Reload Required")
+      return
+   api.dictionary_reload_required = False
+   YL_device_name=YL_device.key
+
+   YL_event_time, late = check_event_time(YL_device_id, YL_message.time)
+   if late:
+      metrics.inc('yolink_messages_reordered_total')
+      if config.verbose: print_nl("%s: Late message from %s dropped (sent %s)" % (timestamp(),YL_device_name,unpack_unix_time(YL_event_time)))
+      return
+
+   # A message delivered late (e.g. held by the broker during a reconnect) is recorded at its
+   # event time.  Otherwise the local time is used, so that small differences between the
+   # YoLink and local clocks don't matter.
+   YL_update_time = None
+   if YL_event_time is not None:
+      delay = time.time() - YL_event_time/1000
+      metrics.set_gauge('yolink_message_delay_seconds', round(delay,3))
+      if delay > late_seconds:
+         YL_update_time = unpack_unix_time(YL_event_time)
+
+   YL_event=YL_message.event
+   action, extract_fields, interval = classify(YL_event)
+
+   # Sampled event received within the interval: update the last contact time only
+   if interval > 0:
+      key = (YL_device_id, YL_event)
+      now = time.monotonic()
+      last = last_processed.get(key)
+      if last is not None and now - last < interval:
+         store.touch_device(YL_device_name)
+         metrics.inc('yolink_messages_sampled_out_total{event="%s"}' % metrics.label(YL_event))
+         return
+      last_processed[key] = now
+
+   if action == action_report:
+      YL_state, YL_battery, YL_signal, YL_hub = extract_fields(YL_message)
+      print("\033c\n%s *** Event: %s for %s, state: %s\n" % (timestamp(),YL_event, YL_device_name, YL_state))
+      signal_stats.set_hub(YL_device_name, YL_hub)
+
+      if config.verbose:
+         print_nl("%s: %s  Event: %s" % (timestamp(),YL_device_name, YL_event))
+         print_nl("     Battery %s" % YL_battery)
+         print_nl("     Signal  %s" % YL_signal)
+         print_nl('-' * 40)
+
+      # Update status dictionary
+      store.update_device_status(YL_device_name,YL_battery,YL_signal,YL_update_time,YL_device_id)
+
+      display_table()
+
+   elif action == action_heartbeat:
+      # Update status dictionary entry with current time.  Battery and current signal are
+      # set to unknown.
+      if config.verbose: print_nl("%s: Heartbeat event: %s on %s" % (timestamp(),YL_event, YL_device_name))
+      if YL_message.online:
+         store.record_contact(YL_device_name,YL_device_id)
+
+   elif action == action_excluded:
+      print_nl("%s: Excluded event: %s on %s" % (timestamp(),YL_event, YL_device_name))
+
+   else:
+      print("\033c\n%s *** Event: %s for %s, state: %s\n" % (timestamp(),YL_event, YL_device_name, YL_message.state))
+      print_nl("%s: Unsupported event: %s on %s" % (timestamp(),YL_event, YL_device_name))
+      if config.log_unsupported_messages:
+         fid = open("yolink_health_failed_log.txt","a")
+         fid.write(timestamp()+': '+YL_device_name+'  ')
+         fid.write(json.dumps(json.loads(YL_msg.payload)))
+         fid.write("-"*50+"\n")
+         fid.close()
+   return
@@ -0,0 +1,583 @@
+#=============================================================================================
+# Alert notifiers
+#
+# Alerts can be sent through any of these backends:
+#
+#    email     - SMTP email (enabled by "send_status_emails")
+#    webhook   - HTTP POST of a JSON document to "webhook_url"
+#    push      - ntfy or Gotify push notification to "push_url"
+#    syslog    - syslog message over UDP to "syslog_address"
+#    mqtt      - JSON message published to "mqtt_notify_topic" on a local MQTT broker
+#
+# The backends other than email are listed in "notifiers".  Each backend has its own queue
+# and sending thread, so a slow mail server never holds up a webhook, and the main loop only
+# queues the alert.  Each backend retries failed sends "<backend>_retries" times, gives up on
+# a single attempt after "<backend>_timeout" seconds, and sends at most "<backend>_per_minute"
+# alerts per minute (defaults: notify_retries, notify_timeout and notify_per_minute).
+#
+# Libraries used by a backend are imported when the backend is started.
+#
+# In the asyncio runtime (runtime=asyncio, see aio.py) each backend sends from a task on the
+# event loop instead of a thread.  The webhook and push backends use the asyncio HTTP client
+# in ahttp.py and the syslog backend sends directly; email and MQTT, whose libraries block,
+# send through asyncio.to_thread().
+#
+# To send a test alert through the configured backends:  python -m yl_health.notifiers
+# To run a local stand-in for a backend's server, which prints the alerts it is sent:
+#    python -m yl_health.notifiers --receive webhook 8080 [--fail] [--delay 15]
+#=============================================================================================
+import json
+import time
+import queue
+import socket
+import threading
+
+from yl_health import config
+from yl_health import metrics
+from yl_health.ratelimit import RateLimiter
+from yl_health.common import post, timestamp, print_nl
+
+# Alerts waiting in each backend's queue before new ones are dropped
+queue_size = 100
+
+# Wait before the first retry, doubling for each retry up to max_retry_delay, in seconds
+min_retry_delay = 1
+max_retry_delay = 60
+
+class Notifier:
+   name = ''
+
+   def __init__(self, settings):
+      self.retries = settings['retries']
+      self.timeout = settings['timeout']
+      self.limiter = RateLimiter(settings['per_minute'], max_concurrent=1, burst=1)
+      self.queue = queue.Queue(maxsize=queue_size)
+      self.queue_full = queue.Full
+      self.thread = None
+      self.task = None
+
+   # Set up the backend before the first alert.  Raises an exception if it can't be used.
+   def prepare(self):
+      return()
+
+   # Set up the backend for the asyncio runtime
+   def prepare_async(self):
+      self.prepare()
+      return()
+
+   # Start the sending thread
+   def start(self):
+      self.prepare()
+      self.thread = threading.Thread(target=self.run, name='notify-'+self.name, daemon=True)
+      self.thread.start()
+      return()
+
+   # Start the sending task on the running event loop
+   def start_async(self):
+      import asyncio
+      self.prepare_async()
+      self.queue = asyncio.Queue(maxsize=queue_size)
+      self.queue_full = asyncio.QueueFull
+      self.task = asyncio.get_running_loop().create_task(self.run_async())
+      return()
+
+   # Queue an alert.  Returns False if the queue is full.  In the asyncio runtime this must
+   # be called on the event loop.
+   def submit(self, subject, message):
+      try:
+         self.queue.put_nowait((subject, message, time.time()))
+      except self.queue_full:
+         metrics.inc('yolink_alerts_dropped_total{backend="%s"}' % self.name)
+         return(False)
+      return(True)
+
+   # Sending thread
+   def run(self):
+      while True:
+         alert = self.queue.get()
+         if alert is None:
+            break
+         self.send_with_retries(*alert)
+         self.queue.task_done()
+      return()
+
+   def send_with_retries(self, subject, message, created):
+      error = None
+      for attempt in range(self.retries+1):
+         self.limiter.acquire()
+         try:
+            self.send(subject, message, created)
+            error = None
+         except Exception as e:
+            error = e
+         finally:
+            self.limiter.release()
+         if error is None:
+            metrics.inc('yolink_alerts_sent_total{backend="%s"}' % self.name)
+            return(True)
+         if attempt < self.retries:
+            time.sleep(min(max_retry_delay, min_retry_delay*2**attempt))
+
+      self.report_failure(subject, error)
+      return(False)
+
+   def report_failure(self, subject, error):
+      metrics.inc('yolink_alerts_failed_total{backend="%s"}' % self.name)
+      print_nl("%s Unable to send alert \"%s\" by %s: %s" % (timestamp(),subject,self.name,error))
+      post("Unable to send alert \"%s\" by %s: %s" % (subject,self.name,error))
+      return()
+
+   # Sending task for the asyncio runtime
+   async def run_async(self):
+      while True:
+         alert = await self.queue.get()
+         await self.send_with_retries_async(*alert)
+         self.queue.task_done()
+
+   async def send_with_retries_async(self, subject, message, created):
+      import asyncio
+      error = None
+      for attempt in range(self.retries+1):
+         wait = self.limiter.take()
+         while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.limiter.take()
+         try:
+            await self.send_async(subject, message, created)
+            error = None
+         except Exception as e:
+            error = e
+         if error is None:
+            metrics.inc('yolink_alerts_sent_total{backend="%s"}' % self.name)
+            return(True)
+         if attempt < self.retries:
+            await asyncio.sleep(min(max_retry_delay, min_retry_delay*2**attempt))
+
+      self.report_failure(subject, error)
+      return(False)
+
+   # Send one alert.  Raises an exception if it could not be sent.
+   def send(self, subject, message, created):
+      raise NotImplementedError
+
+   # Send one alert from the event loop.  Backends whose send() blocks run it on a thread.
+   async def send_async(self, subject, message, created):
+      import asyncio
+      await asyncio.to_thread(self.send, subject, message, created)
+      return()
+
+#=============================================================================================
+# Email
+#=============================================================================================
+class EmailNotifier(Notifier):
+   name = 'email'
+
+   def send(self, subject, message, created):
+      import smtplib
+      from email.message import EmailMessage
+
+      email = EmailMessage()
+      email['From'] = config.email_account_name
+      email['To'] = ', '.join(a.strip() for a in config.email_addr_list)
+      email['Subject'] = subject
+      email.set_content(message)
+
+      if config.email_ssl:
+         server = smtplib.SMTP_SSL(config.email_server, timeout=self.timeout)
+      else:
+         server = smtplib.SMTP(config.email_server, timeout=self.timeout)
+      try:
+         if config.email_ssl or server.has_extn('auth'):
+            server.login(config.email_account_name, config.email_account_pw)
+         refused = server.send_message(email)
+      finally:
+         server.quit()
+      if len(refused) > 0:
+         raise Exception("Recipients refused: %s" % ', '.join(refused))
+      return()
+
+#=============================================================================================
+# Webhook
+#=============================================================================================
+class WebhookNotifier(Notifier):
+   name = 'webhook'
+
+   def prepare(self):
+      import requests
+      # One session for all requests, so the connection is reused
+      self.session = requests.Session()
+      return()
+
+   # The asyncio runtime uses ahttp instead of requests
+   def prepare_async(self):
+      return()
+
+   def send(self, subject, message, created):
+      document = {'subject':subject, 'message':message, 'time':created, 'host':socket.gethostname()}
+      response = self.session.post(config.webhook_url, json=document, timeout=self.timeout)
+      response.raise_for_status()
+      return()
+
+   async def send_async(self, subject, message, created):
+      from yl_health import ahttp
+      document = {'subject':subject, 'message':message, 'time':created, 'host':socket.gethostname()}
+      response = await ahttp.post_json(config.webhook_url, document, timeout=self.timeout)
+      response.raise_for_status()
+      return()
+
+#=============================================================================================
+# Push notification (ntfy or Gotify)
+#=============================================================================================
+class PushNotifier(Notifier):
+   name = 'push'
+
+   def prepare(self):
+      import requests
+      self.session = requests.Session()
+      return()
+
+   def prepare_async(self):
+      return()
+
+   def send(self, subject, message, created):
+      if config.push_format == 'gotify':
+         headers = {}
+         if config.push_token: headers['X-Gotify-Key'] = config.push_token
+         response = self.session.post(config.push_url, json={'title':subject, 'message':message, 'priority':5},
+                                      headers=headers, timeout=self.timeout)
+      else:
+         headers = {'Title':subject.encode('utf-8'), 'Tags':'warning'}
+         if config.push_token: headers['Authorization'] = 'Bearer ' + config.push_token
+         response = self.session.post(config.push_url, data=message.encode('utf-8'), headers=headers, timeout=self.timeout)
+      response.raise_for_status()
+      return()
+
+   async def send_async(self, subject, message, created):
+      from yl_health import ahttp
+      if config.push_format == 'gotify':
+         headers = {}
+         if config.push_token: headers['X-Gotify-Key'] = config.push_token
+         response = await ahttp.post_json(config.push_url, {'title':subject, 'message':message, 'priority':5},
+                                          headers=headers, timeout=self.timeout)
+      else:
+         headers = {'Title':subject.encode('utf-8'), 'Tags':'warning'}
+         if config.push_token: headers['Authorization'] = 'Bearer ' + config.push_token
+         response = await ahttp.request('POST', config.push_url, message, headers=headers, timeout=self.timeout)
+      response.raise_for_status()
+      return()
+
+#=============================================================================================
+# Syslog (RFC 3164 over UDP, facility "user", severity "warning")
+#=============================================================================================
+class SyslogNotifier(Notifier):
+   name = 'syslog'
+
+   def prepare(self):
+      host, _, port = config.syslog_address.rpartition(':')
+      self.address = (host or 'localhost', int(port or 514))
+      self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      self.sock.settimeout(self.timeout)
+      return()
+
+   def send(self, subject, message, created):
+      priority = 1*8 + 4
+      stamp = time.strftime('%b %d %H:%M:%S', time.localtime(created))
+      text = ' '.join((subject + ' - ' + message).split())
+      line = '<%d>%s %s yolink_health: %s' % (priority, stamp, socket.gethostname(), text)
+      self.sock.sendto(line.encode('utf-8')[:1024], self.address)
+      return()
+
+   # A UDP send doesn't wait for the server
+   async def send_async(self, subject, message, created):
+      self.send(subject, message, created)
+      return()
+
+#=============================================================================================
+# MQTT republish to a local broker
+#=============================================================================================
+class MqttNotifier(Notifier):
+   name = 'mqtt'
+
+   def prepare(self):
+      import paho.mqtt.client as mqtt
+      host, _, port = config.mqtt_notify_broker.rpartition(':')
+      self.client = mqtt.Client()
+      self.client.connect_async(host or 'localhost', int(port or 1883), keepalive=60)
+      self.client.loop_start()
+      return()
+
+   def send(self, subject, message, created):
+      document = {'subject':subject, 'message':message, 'time':created, 'host':socket.gethostname()}
+      info = self.client.publish(config.mqtt_notify_topic, json.dumps(document), qos=1)
+      info.wait_for_publish(self.timeout)
+      if info.is_published() == False:
+         raise Exception("Not published (result %s)" % info.rc)
+      return()
+
+#=============================================================================================
+# Start the backends and send alerts
+#=============================================================================================
+
+# Backend classes by name, and the backends started by start_notifiers()
+notifier_classes = {'email':EmailNotifier, 'webhook':WebhookNotifier, 'push':PushNotifier,
+                    'syslog':SyslogNotifier, 'mqtt':MqttNotifier}
+active_notifiers = []
+
+# Function to start the configured backends.  With async_mode=True (asyncio runtime) it must
+# be called on the event loop.
+def start_notifiers(async_mode=False):
+   global active_notifiers
+   names = []
+   if config.send_status_emails:
+      names.append('email')
+   for name in config.notifiers:
+      name = name.strip()
+      if len(name) > 0 and name not in names:
+         names.append(name)
+
+   active_notifiers = []
+   for name in names:
+      if name not in notifier_classes:
+         print_nl('Unknown notifier "%s" ignored' % name)
+         continue
+      notifier = notifier_classes[name](config.notify_settings[name])
+      try:
+         if async_mode:
+            notifier.start_async()
+         else:
+            notifier.start()
+      except Exception as e:
+         print_nl("%s Unable to start %s notifier: %s" % (timestamp(),name,e))
+         continue
+      active_notifiers.append(notifier)
+      post("Started %s notifier" % name)
+   return(len(active_notifiers))
+
+# Function to queue an alert on every backend.  Returns the number of backends it was queued on.
+def send_alert(subject, message):
+   queued = 0
+   for notifier in active_notifiers:
+      if notifier.submit(subject, message):
+         queued += 1
+   return(queued)
+
+# Function to wait until every queued alert has been sent or has failed
+def wait_for_alerts():
+   for notifier in active_notifiers:
+      notifier.queue.join()
+   return()
+
+metrics.describe('yolink_alerts_sent_total', 'Alerts sent, by backend')
+metrics.describe('yolink_alerts_failed_total', 'Alerts which could not be sent after all retries, by backend')
+metrics.describe('yolink_alerts_dropped_total', 'Alerts dropped because the backend queue was full, by backend')
+
+#=============================================================================================
+# Stand-in receivers
+#
+# Local servers which accept alerts the way each backend's server does, so the backends can
+# be tried without a mail server, webhook, ntfy/Gotify server, syslog server or MQTT broker.
+# Each keeps the (subject, message) of the alerts it accepts in "received" and counts every
+# attempt in "attempts".  The first "fail" attempts are refused (all of them if fail is -1),
+# and each answer is held back for "delay" seconds, to try the retries and the timeout.
+#=============================================================================================
+
+# Function to count an attempt on a stand-in.  Returns True if it is to be refused.
+def stand_in_refuses(server):
+   time.sleep(server.delay)
+   with server.lock:
+      server.attempts += 1
+      return(server.fail < 0 or server.attempts <= server.fail)
+
+# Function to keep an alert accepted by a stand-in
+def stand_in_accepts(server, subject, message):
+   with server.lock:
+      server.received.append((subject, message))
+   if server.show: print("%s %s: %s - %s" % (timestamp(), server.backend, subject, message))
+   return()
+
+# Function to split the text of a syslog line or a message body into subject and message
+def split_alert(text):
+   subject, _, message = text.partition(' - ')
+   return(subject, message)
+
+def email_stand_in():
+   import socketserver
+   from email import message_from_bytes
+
+   class Receiver(socketserver.StreamRequestHandler):
+      def reply(self, line):
+         self.wfile.write((line + '\r\n').encode('ascii'))
+
+      def handle(self):
+         self.reply('220 yolink_health stand-in ESMTP')
+         for line in self.rfile:
+            verb = line[:4].decode('ascii', 'replace').upper()
+            if verb in ('EHLO', 'HELO'):
+               self.reply('250 yolink_health stand-in')
+            elif verb == 'MAIL':
+               if stand_in_refuses(self.server):
+                  self.reply('451 Try again later')
+               else:
+                  self.reply('250 OK')
+            elif verb == 'DATA':
+               self.reply('354 End data with <CR><LF>.<CR><LF>')
+               body = b''
+               for line in self.rfile:
+                  if line == b'.\r\n':
+                     break
+                  body += line[1:] if line.startswith(b'..') else line
+               email = message_from_bytes(body)
+               stand_in_accepts(self.server, email['Subject'], email.get_payload().strip())
+               self.reply('250 OK')
+            elif verb == 'QUIT':
+               self.reply('221 Bye')
+               return
+            else:
+               self.reply('250 OK')
+
+   return(socketserver.ThreadingTCPServer, Receiver)
+
+def http_stand_in():
+   from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+   class Receiver(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_POST(self):
+         body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+         refused = stand_in_refuses(self.server)
+         if refused == False:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+               # Webhook document, or Gotify message
+               document = json.loads(body)
+               stand_in_accepts(self.server, document.get('subject', document.get('title')), document['message'])
+            else:
+               # ntfy message, with the subject in the Title header
+               stand_in_accepts(self.server, self.headers.get('Title'), body.decode('utf-8'))
+         try:
+            self.send_response(503 if refused else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+         except OSError:
+            pass
+
+      def log_message(self, format, *args):
+         return
+
+   return(ThreadingHTTPServer, Receiver)
+
+def syslog_stand_in():
+   import socketserver
+
+   class Receiver(socketserver.BaseRequestHandler):
+      def handle(self):
+         line = self.request[0].decode('utf-8', 'replace')
+         if stand_in_refuses(self.server) == False:
+            stand_in_accepts(self.server, *split_alert(line.partition(': ')[2]))
+
+   return(socketserver.ThreadingUDPServer, Receiver)
+
+# MQTT 3.1.1 broker which acknowledges connections and QoS 1 publishes.  A refused publish is
+# never acknowledged.
+def mqtt_stand_in():
+   import socketserver
+
+   class Receiver(socketserver.StreamRequestHandler):
+      def packet(self):
+         header = self.rfile.read(1)
+         if len(header) == 0:
+            return(None, b'')
+         length, shift = 0, 0
+         while True:
+            byte = self.rfile.read(1)[0]
+            length += (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+               break
+         return(header[0], self.rfile.read(length))
+
+      def handle(self):
+         while True:
+            header, body = self.packet()
+            if header is None or header >> 4 == 14:
+               return
+            kind = header >> 4
+            if kind == 1:
+               self.wfile.write(b'\x20\x02\x00\x00')
+            elif kind == 12:
+               self.wfile.write(b'\xd0\x00')
+            elif kind == 3:
+               start = 2 + int.from_bytes(body[:2], 'big')
+               packet_id = b''
+               if header & 0x06:
+                  packet_id = body[start:start+2]
+                  start += 2
+               if stand_in_refuses(self.server):
+                  continue
+               document = json.loads(body[start:])
+               stand_in_accepts(self.server, document['subject'], document['message'])
+               if packet_id:
+                  self.wfile.write(b'\x40\x02' + packet_id)
+
+   return(socketserver.ThreadingTCPServer, Receiver)
+
+stand_in_types = {'email':email_stand_in, 'webhook':http_stand_in, 'push':http_stand_in,
+                  'syslog':syslog_stand_in, 'mqtt':mqtt_stand_in}
+
+# Function to start a stand-in for a backend on a thread.  Port 0 picks a free port; the port
+# used is server.server_address[1].  Stop it with server.shutdown() and server.server_close().
+def stand_in(backend, port=0, fail=0, delay=0, show=False):
+   server_class, handler = stand_in_types[backend]()
+
+   class Server(server_class):
+      allow_reuse_address = True
+      daemon_threads = True
+
+   server = Server(('127.0.0.1', port), handler)
+   server.backend = backend
+   server.fail = fail
+   server.delay = delay
+   server.show = show
+   server.attempts = 0
+   server.received = []
+   server.lock = threading.Lock()
+   threading.Thread(target=server.serve_forever, args=(0.1,), name='stand-in-'+backend, daemon=True).start()
+   return(server)
+
+# Function to run a stand-in until interrupted, printing the alerts it receives
+def receive(backend, port, fail=False, delay=0):
+   server = stand_in(backend, port, -1 if fail else 0, delay, show=True)
+   print("Receiving %s alerts on port %s%s" % (backend, server.server_address[1], ', refusing them' if fail else ''))
+   try:
+      while True:
+         time.sleep(1)
+   except KeyboardInterrupt:
+      pass
+   server.shutdown()
+   server.server_close()
+   return()
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(description='Send a test alert through the configured notifiers, or run a stand-in receiver')
+   parser.add_argument('--receive', nargs=2, metavar=('BACKEND','PORT'), help='run a stand-in for a backend (%s) on this port' % ', '.join(stand_in_types))
+   parser.add_argument('--fail', action='store_true', help='stand-in refuses every alert')
+   parser.add_argument('--delay', type=float, default=0, help='seconds the stand-in waits before answering')
+   args = parser.parse_args()
+
+   if args.receive:
+      # The stand-ins don't use the configuration file or the activity log
+      config.logging = False
+      if args.receive[0] not in stand_in_types:
+         parser.error('unknown backend "%s"' % args.receive[0])
+      receive(args.receive[0], int(args.receive[1]), args.fail, args.delay)
+      raise SystemExit(0)
+
+   if config.read_config_variables() == False:
+      raise SystemExit(1)
+   if start_notifiers() == 0:
+      print("No notifiers enabled")
+      raise SystemExit(1)
+   send_alert("Yolink Test Alert", "%s Test alert from yolink_health" % timestamp())
+   wait_for_alerts()
+   print(metrics.counters)
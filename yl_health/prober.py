@@ -0,0 +1,171 @@
+#=============================================================================================
+# Active probing of overdue devices
+#
+# Devices other than hubs are normally only heard from when they send a report.  When a
+# device has not been heard from for "probe_after_minutes" (or its learned staleness
+# threshold, if that is shorter - see stats.py), its state is requested from
+# YoLink (through the getState handlers in api.get_device_status_fields) to tell a device
+# that is off line from one that is just quiet:
+#
+#    online   - YoLink reports the device on line.  If its "reportAt" time is later than the
+#               table's, the report that was missed is recorded at that time.  Otherwise
+#               the table entry is left to age, so a quiet device is still reported as
+#               not updated and the probe doesn't count as a report in its statistics.
+#    offline  - YoLink reports the device off line.  The table entry is left to age and
+#               the daily check reports the device as off line.
+#    unknown  - The request failed.
+#
+# A device is probed at most once every "probe_after_minutes".  Probes run on a small
+# thread pool and share the API rate limiter, so the request rate stays within the YoLink
+# limits however many devices are overdue.
+#=============================================================================================
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from yl_health import config
+from yl_health import api
+from yl_health import store
+from yl_health import stats
+from yl_health import history
+from yl_health.common import post, timestamp, print_nl
+
+# Thread pool for probes, created on first use
+probe_executor = None
+
+# Monotonic time of the last probe of each device, devices with a probe in progress and
+# the result of the last probe of each device: (time stamp, 'online'/'offline'/'unknown')
+last_probe = {}
+in_flight = set()
+probe_results = {}
+probe_lock = threading.Lock()
+
+# Function to return the thread pool used for probes
+def get_probe_executor():
+   global probe_executor
+   if probe_executor is None:
+      probe_executor = ThreadPoolExecutor(max_workers=max(1,config.api_workers), thread_name_prefix='probe')
+   return(probe_executor)
+
+#=============================================================================================
+# Probe one device
+#=============================================================================================
+def probe_device(device):
+   try:
+      fields, response = api.get_device_status_fields(device)
+   except:
+      fields, response = api.decode_device_status(device, []), []
+   return(record_probe(device, fields, response))
+
+# Function to record the result of a probe from the decoded getState response
+def record_probe(device, fields, response):
+   device_name = device.key
+   try:
+      if fields['status'] != 'Success':
+         result = 'unknown'
+      elif fields['online'] == False:
+         result = 'offline'
+      else:
+         result = 'online'
+
+      if result == 'online':
+         record_missed_report(device, response)
+
+      with probe_lock:
+         previous = probe_results.get(device_name, ('',''))[1]
+         probe_results[device_name] = (timestamp(), result)
+
+      if result != previous:
+         print_nl("%s Probe of overdue device %s: %s" % (timestamp(),device_name,result))
+         post("Probe of overdue device %s: %s" % (device_name,result))
+   finally:
+      with probe_lock:
+         in_flight.discard(device_name)
+   return(result)
+
+# Function to record the report held by YoLink for a device on line, if it is later than the
+# last one in the table.  Returns True if it was recorded.
+def record_missed_report(device, response):
+   from yl_health.startup import report_time
+   device_name = device.key
+   try:
+      update_time = report_time(response['data'].get('reportAt'))
+   except:
+      update_time = None
+   if update_time is None:
+      return(False)
+   last_time = stats.get_stats(device_name).last_time
+   if last_time is not None and stats.table_time_to_epoch(update_time) <= last_time:
+      return(False)
+
+   # Keep the previous battery and signal if the response doesn't include them
+   battery, signal = api.state_battery_signal(response)
+   record = store.dev_status_dictionary.get(device_name)
+   if record is not None:
+      if battery == '-': battery = str(record[0])
+      if signal == '??': signal = str(record[1])
+   return(store.update_device_status(device_name,battery,signal,update_time,device.id,history.kind_state))
+
+# Function to move the probe state of a renamed device to its new name
+def rename_device(old_name, new_name):
+   with probe_lock:
+      if old_name in last_probe:
+         last_probe[new_name] = last_probe.pop(old_name)
+      if old_name in probe_results:
+         probe_results[new_name] = probe_results.pop(old_name)
+   return()
+
+store.rename_listeners.append(rename_device)
+
+#=============================================================================================
+# Start probes for all overdue devices.  Called once a minute from the main loop.
+#=============================================================================================
+def probe_overdue_devices():
+   devices = select_overdue_devices()
+   for device in devices:
+      get_probe_executor().submit(probe_device, device)
+
+   if config.verbose and len(devices) > 0: print_nl("%s Probing %s overdue devices" % (timestamp(),len(devices)))
+   return(len(devices))
+
+# Function to return the devices due for a probe.  Each is marked as in progress until its
+# result is recorded.
+def select_overdue_devices():
+   if config.probe_after_minutes <= 0:
+      return([])
+
+   now = time.monotonic()
+   selected = []
+   for device_name, record in list(store.dev_status_dictionary.items()):
+      device = api.catalog.by_key.get(device_name)
+      if device is None or device.type == 'Hub':
+         continue
+      # Probe when the device passes its learned staleness threshold or probe_after_minutes,
+      # whichever comes first
+      device_stats = stats.get_stats(device_name)
+      deadline = min(config.probe_after_minutes, device_stats.stale_minutes())
+      if device_stats.age_minutes() < deadline:
+         continue
+
+      with probe_lock:
+         if device_name in in_flight:
+            continue
+         if now - last_probe.get(device_name, -1e9) < config.probe_after_minutes*60:
+            continue
+         in_flight.add(device_name)
+         last_probe[device_name] = now
+
+      selected.append(device)
+   return(selected)
+
+# Function to return text describing the last probe of a device, for alert messages
+def probe_note(device_name):
+   with probe_lock:
+      result = probe_results.get(device_name)
+   if result is None:
+      return('')
+   if result[1] == 'offline':
+      return(" (off line when checked at %s)" % result[0])
+   if result[1] == 'online':
+      return(" (on line when checked at %s)" % result[0])
+   return('')
@@ -0,0 +1,244 @@
+#=============================================================================================
+# Query commands
+#
+# Answer questions from the files the monitor saves, without starting it: no access token,
+# no MQTT connection and only light imports.
+#
+#    yolink_health.py status [--json] [--alarms]
+#    yolink_health.py history <device> [--since 7d] [--json]
+#    yolink_health.py recent <device> [--json]
+#    yolink_health.py worst-signal [--top 20] [--window 24h] [--json]
+#    yolink_health.py export [--device NAME ...] [--since 30d] [--format csv|parquet|arrow]
+#
+# "status" reads "yolink_health_table.txt" and the report timing statistics, which the
+# monitor saves every ten minutes.  "history" reads the device's history file (memory mapped,
+# with the start found by binary search).  "recent" reads the last samples of a device which
+# the monitor keeps in memory, from "yolink_health_recent.dat" saved with the table (see
+# recent.py).  "worst-signal" ranks devices by the 5th
+# percentile of their signal strength from the saved rolling signal statistics.  "export"
+# writes the history of some or all devices as CSV, Parquet or Arrow (see export.py).
+#=============================================================================================
+import os
+import sys
+import json
+import time
+
+from yl_health import config
+from yl_health import store
+from yl_health import stats
+from yl_health import history
+from yl_health import recent
+from yl_health import signal_stats
+from yl_health.common import parse_duration
+
+# Function to print an error message and return the exit code for errors
+def error(text):
+   print(text, file=sys.stderr)
+   return(1)
+
+# Function to read the configuration file quietly.  Returns False if it is missing or invalid.
+def load_config():
+   if os.path.exists(config.config_file) == False:
+      return(False)
+   return(config.read_config_variables())
+
+# Function to format a time from seconds since the epoch
+def format_time(t):
+   return(time.strftime('%Y-%m-%d %I:%M:%S %p', time.localtime(t)))
+
+#=============================================================================================
+# status
+#=============================================================================================
+def device_rows(now):
+   rows = []
+   for name in sorted(store.dev_status_dictionary):
+      record = store.dev_status_dictionary[name]
+      device_stats = stats.get_stats(name)
+      age = device_stats.age_minutes(now)
+      stale = device_stats.stale_minutes()
+      alarms = []
+      if str(record[0]).strip() != '-' and int(record[0]) <= config.min_battery:
+         alarms.append('battery')
+      if str(record[1]).strip() != '??' and int(record[1]) < config.min_signal:
+         alarms.append('signal')
+      if age > stale:
+         alarms.append('stale')
+      rows.append({'name':name, 'battery':record[0], 'signal':record[1], 'min_signal':record[2],
+                   'last_update':record[3], 'longest_minutes':int(record[4]),
+                   'age_minutes':age, 'stale_minutes':stale, 'alarms':alarms})
+   return(rows)
+
+def status_command(args):
+   if os.path.isfile(store.health_table) == False:
+      return(error('No status table "%s" in this folder' % store.health_table))
+   store.load_table()
+   rows = device_rows(time.time())
+   if args.alarms:
+      rows = [row for row in rows if len(row['alarms']) > 0]
+
+   if args.json:
+      print(json.dumps({'table_written':format_time(os.path.getmtime(store.health_table)), 'devices':rows}, indent=1))
+      return(0)
+
+   print("%s %7s %7s %7s  %-22s %8s %8s  %s" % ('Device'.ljust(store.key_size), 'Battery', 'Signal', 'Min', 'Last Update', 'Age', 'Stale', 'Alarms'))
+   for row in rows:
+      print("%s %7s %7s %7s  %-22s %8s %8s  %s" % (row['name'][:store.key_size].ljust(store.key_size), row['battery'], row['signal'],
+            row['min_signal'], row['last_update'], row['age_minutes'], row['stale_minutes'], ','.join(row['alarms'])))
+   print("\nTable written %s" % format_time(os.path.getmtime(store.health_table)))
+   return(0)
+
+#=============================================================================================
+# history
+#=============================================================================================
+def history_command(args):
+   since = parse_duration(args.since)
+   if since is None:
+      return(error('Invalid duration "%s" (use e.g. 30m, 12h, 7d)' % args.since))
+
+   index = history.load_device_index()
+   device_id = None
+   for candidate, entry in index.items():
+      if entry.get('key') == args.device or entry['name'] == args.device:
+         device_id = candidate
+   if device_id is None and args.device in history.device_ids():
+      device_id = args.device
+   if device_id is None:
+      return(error('No history for device "%s"' % args.device))
+
+   records = history.read(device_id, time.time()-since)
+   return(print_records({'device':args.device, 'id':device_id}, records, args.json))
+
+# Function to print (time, signal, battery, kind) records as a table or, with as_json, as a
+# JSON document made of "header" and the records
+def print_records(header, records, as_json):
+   kinds = history.kind_names
+   if as_json:
+      entries = []
+      for t, signal, battery, kind in records:
+         entries.append({'time':t,
+                         'signal':None if signal == history.signal_unknown else signal,
+                         'battery':None if battery == history.battery_unknown else battery,
+                         'kind':kinds.get(kind, kind)})
+      header['records'] = entries
+      print(json.dumps(header, indent=1))
+      return(0)
+
+   print("%-22s %7s %7s  %s" % ('Time', 'Battery', 'Signal', 'Kind'))
+   for t, signal, battery, kind in records:
+      print("%-22s %7s %7s  %s" % (format_time(t),
+            '-' if battery == history.battery_unknown else battery,
+            '??' if signal == history.signal_unknown else signal,
+            kinds.get(kind, kind)))
+   return(0)
+
+#=============================================================================================
+# recent
+#=============================================================================================
+def recent_command(args):
+   if os.path.isfile(recent.recent_file) == False:
+      return(error('No recent samples "%s" in this folder' % recent.recent_file))
+   # Rings are saved by state key, which is the device name unless names are shared
+   keys = [args.device]
+   for entry in history.load_device_index().values():
+      if entry['name'] == args.device and entry.get('key') is not None:
+         keys.append(entry['key'])
+   # Load only this device, with every saved sample
+   recent.load_recent(names=set(keys), keep_all=True)
+   ring = None
+   for key in keys:
+      if key in recent.rings:
+         ring = recent.rings[key]
+         break
+   if ring is None:
+      return(error('No recent samples for device "%s"' % args.device))
+   header = {'device':args.device, 'saved':format_time(os.path.getmtime(recent.recent_file))}
+   status = print_records(header, ring.samples(), args.json)
+   if args.json == False:
+      print("\nSaved %s" % header['saved'])
+   return(status)
+
+#=============================================================================================
+# worst-signal
+#=============================================================================================
+def worst_signal_command(args):
+   if args.window not in signal_stats.windows:
+      return(error('Invalid window "%s" (use %s)' % (args.window, ', '.join(signal_stats.windows))))
+   signal_stats.load_signal_stats()
+
+   now = time.time()
+   ranking = []
+   for name in signal_stats.device_buckets:
+      result = signal_stats.window_stats(name, args.window, now)
+      if result is not None:
+         result['name'] = name
+         result['hub'] = signal_stats.device_hub.get(name)
+         ranking.append(result)
+   ranking.sort(key=lambda r: (r['p5'], r['name']))
+   ranking = ranking[:args.top]
+
+   if args.json:
+      print(json.dumps(ranking, indent=1))
+      return(0)
+
+   print("%s %5s %5s %5s %5s %10s %8s" % ('Device'.ljust(store.key_size), 'p5', 'p50', 'p95', 'Min', 'dBm/day', 'Readings'))
+   for r in ranking:
+      print("%s %5s %5s %5s %5s %10.2f %8s" % (r['name'][:store.key_size].ljust(store.key_size), r['p5'], r['p50'], r['p95'],
+            r['minimum'], r['slope'], r['count']))
+   return(0)
+
+#=============================================================================================
+# Command line
+#=============================================================================================
+def main(argv):
+   import argparse
+
+   parser = argparse.ArgumentParser(prog='yolink_health.py', description='Query the saved YoLink device health data.  Run without arguments to start the monitor.')
+   subparsers = parser.add_subparsers(dest='command', required=True)
+
+   p = subparsers.add_parser('status', help='current state of every device')
+   p.add_argument('--json', action='store_true', help='print JSON')
+   p.add_argument('--alarms', action='store_true', help='only devices with a low battery, weak signal or no recent report')
+
+   p = subparsers.add_parser('history', help='history of one device')
+   p.add_argument('device', help='device name or ID')
+   p.add_argument('--since', default='7d', help='how far back, e.g. 30m, 12h, 7d (default 7d)')
+   p.add_argument('--json', action='store_true', help='print JSON')
+
+   p = subparsers.add_parser('recent', help='last samples of one device kept by the monitor')
+   p.add_argument('device', help='device name')
+   p.add_argument('--json', action='store_true', help='print JSON')
+
+   p = subparsers.add_parser('worst-signal', help='devices with the weakest signal')
+   p.add_argument('--top', type=int, default=20, help='number of devices (default 20)')
+   p.add_argument('--window', default='24h', help='1h, 24h or 7d (default 24h)')
+   p.add_argument('--json', action='store_true', help='print JSON')
+
+   p = subparsers.add_parser('export', help='history of some or all devices as CSV, Parquet or Arrow')
+   p.add_argument('--device', action='append', help='device name or ID (may be given more than once; default all devices)')
+   p.add_argument('--since', help='start, e.g. 30d or 2024-05-01 (default the oldest record)')
+   p.add_argument('--until', help='end, e.g. 1d or 2024-05-01T12:00 (default now)')
+   p.add_argument('--format', choices=['csv', 'parquet', 'arrow'], help='default csv, or from the --output file name')
+   p.add_argument('--output', help='file to write (default the screen, CSV only)')
+   p.add_argument('--chunk', type=int, help='records read and written at a time (default 65536)')
+
+   args = parser.parse_args(argv)
+
+   try:
+      if args.command == 'status':
+         if load_config() == False:
+            return(error('Missing or invalid configuration file "%s"' % config.config_file))
+         # Keep load_table quiet
+         config.verbose = False
+         return(status_command(args))
+      if args.command == 'history':
+         return(history_command(args))
+      if args.command == 'recent':
+         return(recent_command(args))
+      if args.command == 'export':
+         from yl_health import export
+         return(export.export_command(args))
+      return(worst_signal_command(args))
+   except BrokenPipeError:
+      # Output piped to a command such as "head" which exited early
+      os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+      return(0)
@@ -0,0 +1,105 @@
+#=============================================================================================
+# Rate limiter for YoLink API requests
+#
+# Token bucket shared by all threads making API calls, combined with a cap on the number
+# of requests in progress at the same time.  acquire() blocks until a request may be made
+# and release() must be called when it has completed.
+#
+# The rate adapts to throttling by the API: throttled() halves the current rate and
+# succeeded() raises it again in small steps until it is back at the configured maximum.
+# A rate of 0 (or less) means no limit until the API first throttles a request.  The rate
+# of requests in the minute before that becomes the maximum, and the rate then adapts as
+# above.  Only the cap on requests in progress applies until then.
+#=============================================================================================
+import time
+import threading
+from collections import deque
+
+class RateLimiter:
+   def __init__(self, requests_per_minute, max_concurrent=4, burst=None):
+      self.unlimited = requests_per_minute <= 0
+      self.burst = burst
+      self.set_max_rate(60 if self.unlimited else requests_per_minute)
+      self.tokens = self.capacity
+      self.last_refill = time.monotonic()
+      self.lock = threading.Lock()
+      self.slots = threading.BoundedSemaphore(max(1,max_concurrent))
+      self.throttle_count = 0
+
+      # Monotonic times of the requests of the last minute, kept while there is no limit
+      self.recent = deque()
+
+   # Set the maximum rate, and the current rate, minimum rate and bucket size which follow
+   # from it
+   def set_max_rate(self, requests_per_minute):
+      self.max_rate = requests_per_minute/60.0
+      self.min_rate = self.max_rate/16
+      self.rate = self.max_rate
+      burst = self.burst
+      if burst is None:
+         burst = max(1, int(self.rate*5))
+      self.capacity = float(burst)
+      return()
+
+   # Add tokens for the time elapsed since the last refill.  Lock must be held.
+   def refill(self):
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now-self.last_refill)*self.rate)
+      self.last_refill = now
+
+   # Take a token if one is available.  Returns 0 if it was taken, otherwise the number of
+   # seconds to wait before trying again.  Does not block, so it can also be used from an
+   # asyncio task.
+   def take(self):
+      with self.lock:
+         if self.unlimited:
+            now = time.monotonic()
+            self.recent.append(now)
+            while self.recent[0] < now-60:
+               self.recent.popleft()
+            return(0)
+         self.refill()
+         if self.tokens >= 1:
+            self.tokens -= 1
+            return(0)
+         return((1-self.tokens)/self.rate)
+
+   # Wait until a request slot and a token are available, then take them
+   def acquire(self):
+      self.slots.acquire()
+      while True:
+         wait = self.take()
+         if wait == 0:
+            return()
+         time.sleep(wait)
+
+   # Free the request slot taken by acquire()
+   def release(self):
+      self.slots.release()
+      return()
+
+   # Request was rejected because of the request limit: halve the rate and empty the bucket.
+   # Without a limit, the rate of the last minute becomes the maximum first.
+   def throttled(self):
+      with self.lock:
+         if self.unlimited:
+            now = time.monotonic()
+            while len(self.recent) > 0 and self.recent[0] < now-60:
+               self.recent.popleft()
+            self.set_max_rate(max(1, len(self.recent)))
+            self.recent.clear()
+            self.unlimited = False
+            self.last_refill = now
+         self.refill()
+         self.rate = max(self.min_rate, self.rate/2)
+         self.tokens = 0.0
+         self.throttle_count += 1
+      return()
+
+   # Request was accepted: raise the rate by 5% of the maximum, up to the maximum
+   def succeeded(self):
+      if self.unlimited == False and self.rate < self.max_rate:
+         with self.lock:
+            self.refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate/20)
+      return()
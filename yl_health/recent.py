@@ -0,0 +1,154 @@
+#=============================================================================================
+# Recent samples of each device
+#
+# A Ring for each device holds its last "recent_samples" updates (reports, state fetched
+# from the YoLink API and contacts) in memory, so the dashboard and the query commands can
+# show recent context without reading the history files.  Samples have the same layout as
+# history records (see history.py):
+#
+#    time     8 byte float   seconds since the epoch
+#    signal   2 byte integer LoRa signal strength, or history.signal_unknown
+#    battery  1 byte integer battery level 0-4, or history.battery_unknown
+#    kind     1 byte integer history.kind_report, kind_contact or kind_state
+#
+# Each ring is one preallocated bytearray written in place, so adding a sample takes
+# constant time and creates no objects, and a snapshot is a single copy of the bytes.
+# Rings are updated by store.py with the status lock held, and saved with the status table
+# to "yolink_health_recent.dat" so that they survive a restart and can be read by the query
+# commands while the monitor is running.
+#=============================================================================================
+import struct
+
+from yl_health import config
+from yl_health import history
+
+# Name of file holding the saved rings
+recent_file = "yolink_health_recent.dat"
+
+# Sample layout, header of the saved file (magic, sample size, number of devices) and
+# header of each device in it (name length, number of samples)
+sample = struct.Struct(history.record_format)
+file_header = struct.Struct('<4sHI')
+ring_header = struct.Struct('<HH')
+file_magic = b'YLR1'
+
+# Ring of each device, keyed by device name
+rings = {}
+
+class Ring:
+   __slots__ = ('data', 'size', 'count')
+
+   def __init__(self, size):
+      self.size = size
+      self.data = bytearray(size*sample.size)
+      self.count = 0
+
+   def __len__(self):
+      return(min(self.count, self.size))
+
+   # Add a sample, replacing the oldest when the ring is full
+   def append(self, t, signal, battery, kind):
+      sample.pack_into(self.data, (self.count % self.size)*sample.size, t, signal, battery, kind)
+      self.count += 1
+      return()
+
+   # Function to return the samples, oldest first, as bytes in the history record layout
+   def snapshot(self):
+      if self.count <= self.size:
+         return(bytes(self.data[:self.count*sample.size]))
+      split = (self.count % self.size)*sample.size
+      return(bytes(self.data[split:] + self.data[:split]))
+
+   # Function to return the samples, oldest first, as (time, signal, battery, kind) tuples
+   def samples(self):
+      return(list(sample.iter_unpack(self.snapshot())))
+
+   # Function to return the known signal readings, oldest first
+   def signals(self):
+      return([signal for t, signal, battery, kind in sample.iter_unpack(self.snapshot()) if signal != history.signal_unknown])
+
+# Function to convert battery or signal as stored in the status dictionary ('-' and '??'
+# when not reported) to the value stored in a sample
+def sample_value(value, unknown):
+   if type(value) is int:
+      return(value)
+   try:
+      return(int(value))
+   except:
+      return(unknown)
+
+#=============================================================================================
+# Updates, called by store.py with the status lock held
+#=============================================================================================
+def append(device_name, t, battery, signal, kind):
+   ring = rings.get(device_name)
+   if ring is None:
+      if config.recent_samples <= 0:
+         return()
+      ring = Ring(config.recent_samples)
+      rings[device_name] = ring
+   ring.append(t, sample_value(signal, history.signal_unknown), sample_value(battery, history.battery_unknown), kind)
+   return()
+
+def rename(old_name, new_name):
+   if old_name in rings:
+      rings[new_name] = rings.pop(old_name)
+   return()
+
+# Function to return the samples of a device, oldest first (empty if there are none)
+def samples(device_name):
+   ring = rings.get(device_name)
+   if ring is None:
+      return([])
+   return(ring.samples())
+
+#=============================================================================================
+# Save and load
+#=============================================================================================
+def save_recent():
+   parts = [b'']
+   for name, ring in list(rings.items()):
+      encoded = name.encode('utf-8')
+      parts.append(ring_header.pack(len(encoded), len(ring)) + encoded + ring.snapshot())
+   parts[0] = file_header.pack(file_magic, sample.size, len(parts)-1)
+   fid = open(recent_file, 'wb')
+   fid.write(b''.join(parts))
+   fid.close()
+   return()
+
+# Function to load the saved rings.  Rings saved with a different size are resized, keeping
+# the newest samples; with keep_all=True each ring is sized to hold all of its saved samples.
+# With names given, only the rings of those devices are loaded.
+def load_recent(size=None, names=None, keep_all=False):
+   global rings
+   rings = {}
+   if keep_all:
+      size = 0
+   elif size is None:
+      size = config.recent_samples
+   try:
+      fid = open(recent_file, 'rb')
+      data = fid.read()
+      fid.close()
+      magic, sample_size, count = file_header.unpack_from(data, 0)
+   except:
+      return()
+   if magic != file_magic or sample_size != sample.size or (size <= 0 and keep_all == False):
+      return()
+
+   offset = file_header.size
+   try:
+      for i in range(count):
+         name_length, n = ring_header.unpack_from(data, offset)
+         offset += ring_header.size
+         name = data[offset:offset+name_length].decode('utf-8')
+         offset += name_length
+         if names is None or name in names:
+            ring = Ring(max(n, 1) if keep_all else size)
+            for record in sample.iter_unpack(data[offset:offset+n*sample.size]):
+               ring.append(*record)
+            rings[name] = ring
+         offset += n*sample.size
+   except (struct.error, UnicodeDecodeError):
+      pass
+   return()
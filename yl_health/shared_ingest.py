@@ -0,0 +1,668 @@
+#=============================================================================================
+# Multi-process ingest (ingest_workers > 0 in the configuration file)
+#
+# MQTT payloads are passed, still encoded, to a pool of worker processes.  Each payload goes
+# to the worker chosen by the CRC-32 of its deviceId, so all messages from one device are
+# handled by the same worker in the order received.  The worker decodes the JSON (with the
+# decoder chosen by "json_decoder", see decoder.py), drops duplicate and late messages,
+# classifies the event with the dispatch table of mqtt_ingest and writes the result to the
+# device's record in a table in shared memory.
+#
+# Each record has a fixed layout and a sequence number: the worker makes it odd while
+# writing and even again when done, and a reader retries if it was odd or changed while the
+# record was read.  A record holds the device's last queue_depth reports and contacts, with
+# a count of all of them, so that several reports between two scans are each applied.  The
+# main process scans the table a few times a second (sync()) and passes the updates added
+# since the last scan to the status dictionary as one batch (store.apply_updates), so the
+# history, statistics and listeners see every report as they do without workers.  The
+# display, alerts and metrics read the latest report of each device straight from the table
+# (live_status(), see store.current_status).  Only a device sending more than queue_depth
+# updates between two scans loses the oldest of them (counted in the metrics as
+# yolink_messages_overrun_total).  Sampled-out events only keep the time of the latest.
+#
+# A device is given a slot in the table when it first appears in the device list.  Slots are
+# never reused, so a worker can go on writing while the device list is reloaded.
+#
+# To measure throughput by replaying messages:
+#    python -m yl_health.shared_ingest [--messages N] [--workers N] [--file payloads.txt]
+#                                      [--decoder auto|msgspec|orjson|json]
+# The file has one MQTT payload (JSON) per line.  Without one, messages are generated.  The
+# in-process rate (mqtt_ingest, without the table redraw) is shown for each installed JSON
+# decoder, and the rate with 1, 2, 4... workers (which use --decoder) is timed until sync()
+# has applied the last message.
+#
+# On a one-core machine, replays of 200,000 generated messages from 2,000 devices have run at
+# 1.3x to 1.9x the in-process rate with 1 worker, 1.0x to 1.85x with 2 and 0.9x to 1.75x with
+# 4.  The gain there comes from applying each scan's updates together; each added worker is
+# slower, and only pays off with spare CPU cores.
+#=============================================================================================
+import json
+import time
+import zlib
+import struct
+import threading
+
+from yl_health import config
+from yl_health import api
+from yl_health import store
+from yl_health import stats
+from yl_health import recent
+from yl_health import metrics
+from yl_health import history
+from yl_health import decoder
+from yl_health import mqtt_ingest
+from yl_health import signal_stats
+from yl_health.common import timestamp, print_nl
+from yl_health.display import display_table
+
+# Device record: a header with the sequence number, number of updates, number of touches
+# and time of the last touch (seconds since the epoch), followed by a queue of the last
+# queue_depth updates, update number n in entry n % queue_depth.  Each entry has the time,
+# battery, signal, kind and hub ID.
+#    report   - battery and signal from a device report
+#    contact  - heartbeat event: the device is on line (store.record_contact)
+#    touch    - sampled event within its interval (store.touch_device)
+queue_depth = 8
+header_format = struct.Struct('<III4xd')
+entry_format = struct.Struct('<dhhB3x16s')
+record_size = header_format.size + queue_depth*entry_format.size
+kind_report = 1
+kind_contact = 2
+
+# Per worker counters, 8 bytes each, after the device records
+counter_names = ['messages', 'duplicate', 'reordered', 'sampled_out', 'unknown', 'invalid']
+counter_format = struct.Struct('<%dQ' % len(counter_names))
+
+# Payloads sent to a worker together, and seconds between scans of the table
+batch_size = 256
+sync_interval = 0.25
+
+#=============================================================================================
+# Shared table
+#=============================================================================================
+class DeviceTable:
+   def __init__(self, buffer, capacity):
+      self.buffer = buffer
+      self.capacity = capacity
+      self.counter_offset = capacity*record_size
+
+   # Write a record, adding an update (kind, time, battery, signal, hub) to its queue if one
+   # is given.  Only the worker which owns the device's slot writes to it.
+   def write(self, slot, updates, touches, touch_time, update=None):
+      offset = slot*record_size
+      seq = struct.unpack_from('<I', self.buffer, offset)[0]
+      struct.pack_into('<I', self.buffer, offset, seq+1)
+      if update is not None:
+         kind, t, battery, signal, hub = update
+         entry_offset = offset + header_format.size + ((updates-1) % queue_depth)*entry_format.size
+         entry_format.pack_into(self.buffer, entry_offset, t, battery, signal, kind, hub)
+      header_format.pack_into(self.buffer, offset, seq+1, updates, touches, touch_time)
+      struct.pack_into('<I', self.buffer, offset, seq+2)
+      return()
+
+   def sequence(self, slot):
+      return(struct.unpack_from('<I', self.buffer, slot*record_size)[0])
+
+   # Read the updates of a record after the first "first", unpacking them straight from the
+   # shared memory.  Returns (sequence, updates, touches, touch time, entries), with entries
+   # (time, update number, kind, battery, signal, hub) for the updates still in the queue,
+   # oldest first; or None if the record is being written.
+   def read(self, slot, first=0):
+      offset = slot*record_size
+      entries_offset = offset + header_format.size
+      for attempt in range(10):
+         seq, updates, touches, touch_time = header_format.unpack_from(self.buffer, offset)
+         if seq % 2 == 1:
+            continue
+         entries = []
+         for n in range(max(first, updates-queue_depth), updates):
+            t, battery, signal, kind, hub = entry_format.unpack_from(self.buffer, entries_offset + (n % queue_depth)*entry_format.size)
+            entries.append((t, n, kind, battery, signal, hub))
+         if self.sequence(slot) == seq:
+            return(seq, updates, touches, touch_time, entries)
+      return(None)
+
+   # Read the latest update of a record.  Returns (touch time, entry), entry being (time,
+   # battery, signal, kind, hub) or None if there has been no update; or None if the record
+   # is being written.
+   def latest(self, slot):
+      offset = slot*record_size
+      for attempt in range(10):
+         seq, updates, touches, touch_time = header_format.unpack_from(self.buffer, offset)
+         if seq % 2 == 1:
+            continue
+         entry = None
+         if updates > 0:
+            entry = entry_format.unpack_from(self.buffer, offset + header_format.size + ((updates-1) % queue_depth)*entry_format.size)
+         if self.sequence(slot) == seq:
+            return(touch_time, entry)
+      return(None)
+
+   def write_counters(self, worker, counters):
+      counter_format.pack_into(self.buffer, self.counter_offset + worker*counter_format.size, *counters)
+      return()
+
+   def read_counters(self, worker):
+      return(counter_format.unpack_from(self.buffer, self.counter_offset + worker*counter_format.size))
+
+# Function to return the size of the shared memory for a table
+def table_size(capacity, workers):
+   return(capacity*record_size + workers*counter_format.size)
+
+#=============================================================================================
+# Worker process
+#=============================================================================================
+class Worker:
+   def __init__(self, index, table, slots):
+      self.index = index
+      self.table = table
+      self.slots = slots
+      self.counters = [0]*len(counter_names)
+      # Header last written to each slot: [updates, touches, touch time]
+      self.records = {}
+      self.last_processed = {}
+
+   def record(self, slot):
+      record = self.records.get(slot)
+      if record is None:
+         record = [0, 0, 0.0]
+         self.records[slot] = record
+      return(record)
+
+   # Handle one payload, as mqtt_ingest.YL_on_message does
+   def handle(self, payload):
+      self.counters[0] += 1
+      try:
+         message = decoder.decode(payload)
+         device_id = message.device_id
+      except:
+         self.counters[5] += 1
+         return()
+
+      if mqtt_ingest.duplicate_message(message.msgid):
+         self.counters[1] += 1
+         return()
+
+      slot = self.slots.get(device_id)
+      if slot is None:
+         self.counters[4] += 1
+         return()
+
+      event_time, late = mqtt_ingest.check_event_time(device_id, message.time)
+      if late:
+         self.counters[2] += 1
+         return()
+      now = time.time()
+      report_time = now
+      if event_time is not None and now - event_time/1000 > mqtt_ingest.late_seconds:
+         report_time = event_time/1000
+
+      event = message.event
+      action, extract_fields, interval = mqtt_ingest.classify(event)
+      record = self.record(slot)
+
+      if interval > 0:
+         key = (device_id, event)
+         last = self.last_processed.get(key)
+         if last is not None and now - last < interval:
+            self.counters[3] += 1
+            record[1] += 1
+            record[2] = now
+            self.table.write(slot, *record)
+            return()
+         self.last_processed[key] = now
+
+      if action == mqtt_ingest.action_report:
+         state, battery, signal, hub = extract_fields(message)
+         record[0] += 1
+         self.table.write(slot, *record, (kind_report, report_time,
+                                          history.battery_unknown if battery == '-' else int(battery),
+                                          history.signal_unknown if signal == '??' else int(signal),
+                                          (hub or '').encode('ascii', 'replace')[:16]))
+      elif action == mqtt_ingest.action_heartbeat:
+         if message.online:
+            record[0] += 1
+            self.table.write(slot, *record, (kind_contact, now, history.battery_unknown, history.signal_unknown, b''))
+      return()
+
+   # Handle a batch of payloads, or a dictionary of new slots by device ID
+   def handle_item(self, item):
+      if isinstance(item, dict):
+         self.slots.update(item)
+         return()
+      for payload in item:
+         try:
+            self.handle(payload)
+         except Exception:
+            self.counters[5] += 1
+      self.table.write_counters(self.index, self.counters)
+      return()
+
+# Worker process main function
+def worker_main(index, inbox, memory_name, capacity, slots, event_table, type_table, decoder_name):
+   mqtt_ingest.event_table = event_table
+   mqtt_ingest.type_table = type_table
+   decoder.select(decoder_name)
+   from multiprocessing import shared_memory
+   memory = shared_memory.SharedMemory(name=memory_name)
+   worker = Worker(index, DeviceTable(memory.buf, capacity), slots)
+   try:
+      while True:
+         item = inbox.get()
+         if item is None:
+            break
+         worker.handle_item(item)
+   except KeyboardInterrupt:
+      pass
+   worker.table = None
+   memory.close()
+   return()
+
+#=============================================================================================
+# Main process
+#=============================================================================================
+
+# Shared memory, table, worker processes and their queues, slot of each device ID and of each
+# device name, and (device ID, name) of each slot
+memory = None
+table = None
+workers = []
+queues = []
+slot_of = {}
+slot_by_name = {}
+slot_devices = []
+
+# Payloads waiting to be sent to each worker
+buffers = []
+submit_lock = threading.Lock()
+
+# (sequence, updates, touches) of the record last read from each slot, and worker counter
+# totals already added to the metrics
+last_records = []
+counted = [0]*len(counter_names)
+sync_thread = None
+atexit_registered = []
+
+# Function to return the device ID in an encoded payload, without decoding the JSON
+def payload_device_id(payload):
+   if isinstance(payload, str):
+      payload = payload.encode('utf-8')
+   start = payload.find(b'"deviceId"')
+   if start < 0:
+      return(b'')
+   start = payload.find(b'"', payload.find(b':', start)+1)
+   return(payload[start+1:payload.find(b'"', start+1)])
+
+# Function to pass a payload to the worker for its device.  Called by mqtt_ingest.
+def submit(payload):
+   shard = zlib.crc32(payload_device_id(payload)) % len(queues)
+   with submit_lock:
+      buffers[shard].append(payload)
+      if len(buffers[shard]) >= batch_size:
+         queues[shard].put(buffers[shard])
+         buffers[shard] = []
+   return()
+
+# Function to send the payloads waiting for each worker
+def flush():
+   with submit_lock:
+      for shard in range(len(queues)):
+         if len(buffers[shard]) > 0:
+            queues[shard].put(buffers[shard])
+            buffers[shard] = []
+   return()
+
+# Function to give new devices in the catalog a slot and tell the workers.  Called when the
+# device list has been loaded.
+def update_catalog(devices):
+   if table is None:
+      return()
+   new_slots = [{} for q in queues]
+   for d in devices:
+      device_id = d.id
+      slot = slot_of.get(device_id)
+      if slot is None:
+         if len(slot_devices) >= table.capacity:
+            print_nl("%s Device table full (ingest_max_devices=%s), %s not tracked" % (timestamp(),table.capacity,d.key))
+            continue
+         slot = len(slot_devices)
+         slot_of[device_id] = slot
+         slot_devices.append((device_id, d.key))
+         last_records.append((0, 0, 0))
+         new_slots[zlib.crc32(device_id.encode('utf-8')) % len(queues)][device_id] = slot
+      else:
+         slot_devices[slot] = (device_id, d.key)
+   slot_by_name.clear()
+   for slot, (device_id, name) in enumerate(slot_devices):
+      slot_by_name[name] = slot
+   for shard, slots in enumerate(new_slots):
+      if len(slots) > 0:
+         queues[shard].put(slots)
+   return()
+
+# Function to convert battery and signal as stored in the table to the status dictionary values
+def table_values(battery, signal):
+   return('-' if battery == history.battery_unknown else str(battery),
+          '??' if signal == history.signal_unknown else str(signal))
+
+#=============================================================================================
+# Latest state of a device straight from the table (store.live_source), so the display,
+# alerts and metrics don't wait for sync()
+#=============================================================================================
+def live_status(device_name):
+   slot = slot_by_name.get(device_name)
+   current = table
+   if slot is None or current is None:
+      return(None)
+   latest = current.latest(slot)
+   if latest is None:
+      return(None)
+   touch_time, entry = latest
+   if entry is None:
+      return(None, None, None, touch_time)
+   t, battery, signal, kind, hub = entry
+   if kind == kind_report:
+      battery, signal = table_values(battery, signal)
+   else:
+      battery, signal = '-', '??'
+   return(battery, signal, t, max(t, touch_time))
+
+#=============================================================================================
+# Apply changed records to the status dictionary and add the worker counters to the metrics
+#
+# The updates added to all records since the last scan are passed to the store as one batch
+# (store.apply_updates), so each device's entry is worked out once per scan however many
+# reports it sent.
+#=============================================================================================
+def sync():
+   updates = []
+   for slot in range(len(slot_devices)):
+      previous = last_records[slot]
+      if table.sequence(slot) == previous[0]:
+         continue
+      record = table.read(slot, previous[1])
+      if record is None:
+         continue
+      seq, update_count, touch_count, touch_time, entries = record
+      last_records[slot] = (seq, update_count, touch_count)
+      device_id, name = slot_devices[slot]
+
+      # Updates pushed out of the queue before this scan are lost
+      if update_count - previous[1] > queue_depth:
+         metrics.inc('yolink_messages_overrun_total', update_count - previous[1] - queue_depth)
+      if touch_count != previous[2]:
+         entries.append((touch_time, update_count, 0, 0, 0, b''))
+         entries.sort()
+
+      hub = None
+      for t, n, kind, battery, signal, hub_id in entries:
+         if kind == kind_report:
+            battery, signal = table_values(battery, signal)
+            updates.append((name, device_id, history.kind_report, battery, signal, t))
+            hub = hub_id
+         elif kind == kind_contact:
+            updates.append((name, device_id, history.kind_contact, '-', '??', t))
+         else:
+            updates.append((name, device_id, None, '-', '??', t))
+      if hub is not None:
+         signal_stats.set_hub(name, hub.rstrip(b'\0').decode('ascii', 'replace') or None)
+
+   reports = store.apply_updates(updates) if len(updates) > 0 else 0
+
+   totals = [0]*len(counter_names)
+   for worker in range(len(queues)):
+      for i, value in enumerate(table.read_counters(worker)):
+         totals[i] += value
+   for i, name in enumerate(counter_names):
+      if totals[i] > counted[i]:
+         if name == 'unknown':
+            api.dictionary_reload_required = True
+            print("\n\n*** New Device Reported.  Device List Reload Required")
+         elif name == 'messages':
+            metrics.inc('yolink_messages_total', totals[i]-counted[i])
+         else:
+            metrics.inc('yolink_messages_%s_total' % name, totals[i]-counted[i])
+         counted[i] = totals[i]
+   return(reports)
+
+# Function to send waiting payloads, apply the table changes and redraw the table if there
+# were new reports
+def update():
+   flush()
+   if sync() > 0:
+      print("\033c\n%s *** Device reports received\n" % timestamp())
+      display_table()
+   return()
+
+# Thread which calls update() every sync_interval seconds
+def run_sync():
+   while True:
+      time.sleep(sync_interval)
+      try:
+         update()
+      except Exception as e:
+         print_nl("%s Ingest table update failed: %s" % (timestamp(),e))
+
+#=============================================================================================
+# Start and stop the workers
+#=============================================================================================
+def start(worker_count, capacity, start_thread=True):
+   global memory, table, workers, queues, buffers, sync_thread
+   import atexit
+   import multiprocessing
+   from multiprocessing import shared_memory
+
+   # Worker processes are started fresh (not forked) since other threads are running
+   context = multiprocessing.get_context('spawn')
+   if decoder.decode_function is None:
+      decoder.select(config.json_decoder)
+   memory = shared_memory.SharedMemory(create=True, size=table_size(capacity, worker_count))
+   memory.buf[:] = bytes(memory.size)
+   table = DeviceTable(memory.buf, capacity)
+   queues = [context.Queue() for i in range(worker_count)]
+   buffers = [[] for i in range(worker_count)]
+   workers = []
+   for index in range(worker_count):
+      worker = context.Process(target=worker_main, name='ingest-%s' % index, daemon=True,
+                               args=(index, queues[index], memory.name, capacity, {},
+                                     mqtt_ingest.event_table, mqtt_ingest.type_table, decoder.decoder_name))
+      worker.start()
+      workers.append(worker)
+   if len(atexit_registered) == 0:
+      atexit.register(stop)
+      atexit_registered.append(True)
+
+   mqtt_ingest.message_router = submit
+   store.live_source = live_status
+   if start_thread:
+      sync_thread = threading.Thread(target=run_sync, name='ingest-sync', daemon=True)
+      sync_thread.start()
+   return()
+
+def stop():
+   global memory, table, workers, queues
+   mqtt_ingest.message_router = None
+   store.live_source = None
+   for q in queues:
+      q.put(None)
+   for worker in workers:
+      worker.join(2)
+      if worker.is_alive():
+         worker.terminate()
+   workers = []
+   queues = []
+   if memory is not None:
+      table = None
+      memory.close()
+      memory.unlink()
+      memory = None
+   return()
+
+#=============================================================================================
+# Replay benchmark
+#=============================================================================================
+
+# Function to generate test payloads for a number of devices.  About one message in twenty
+# is a duplicate of the one before.
+def generate_payloads(count, devices):
+   payloads = []
+   now = int(time.time()*1000)
+   events = ['DoorSensor.Report', 'THSensor.Report', 'MotionSensor.Alert', 'LeakSensor.Report', 'Hub.Report']
+   sent = 0
+   for i in range(count):
+      if i % 20 == 19:
+         payloads.append(payloads[-1])
+         continue
+      device = sent % devices
+      sent += 1
+      payloads.append(json.dumps({'event':events[device % len(events)], 'time':now+i, 'msgid':str(now+i),
+                                  'deviceId':'d%015d' % device,
+                                  'data':{'state':'normal', 'battery':4, 'online':True,
+                                          'loraInfo':{'signal':-60 - device % 40, 'gatewayId':'hub%013d' % (device % 4)}}}).encode('utf-8'))
+   return(payloads)
+
+# Seconds between scans of the table during a replay
+replay_interval = 0.005
+
+# Function to clear the status dictionary, statistics and message checks between runs
+def reset_state():
+   store.dev_status_dictionary.clear()
+   stats.device_stats.clear()
+   signal_stats.device_buckets.clear()
+   signal_stats.device_hub.clear()
+   recent.rings.clear()
+   mqtt_ingest.seen_msgids.clear()
+   mqtt_ingest.event_watermark.clear()
+   mqtt_ingest.last_processed.clear()
+   return()
+
+# Function to time the messages handled in the main thread by mqtt_ingest, up to the status
+# dictionary, statistics and history (the table redraw is left out)
+def replay_in_process(payloads, devices):
+   from yl_health.benchmark import Message
+   reset_state()
+   api.catalog = devices
+   mqtt_ingest.catalog_ready.set()
+   messages = [Message(payload) for payload in payloads]
+   redraw = mqtt_ingest.display_table
+   mqtt_ingest.display_table = lambda: None
+   try:
+      started = time.perf_counter()
+      for message in messages:
+         mqtt_ingest.handle_message(message)
+      elapsed = time.perf_counter() - started
+   finally:
+      mqtt_ingest.display_table = redraw
+   return(elapsed)
+
+# Function to time the messages handled by the workers, from submit() until sync() has
+# applied the last of them to the status dictionary.  The payloads are submitted by a thread,
+# as by the MQTT client, while the main thread scans the table as run_sync() does, but every
+# replay_interval seconds.  At replay rates the workers can get further ahead of the scans
+# than the queue of each record holds, and the updates lost would not be applied (nor
+# timed), so the thread holds back while more than half a queue per device has been handled
+# since the last scan: the rate is the one sustained without losing updates.  Returns
+# (seconds, updates lost to overruns).
+def replay(payloads, worker_count, devices):
+   global slot_of, slot_by_name, slot_devices, last_records, counted
+   slot_of = {}
+   slot_by_name = {}
+   slot_devices = []
+   last_records = []
+   counted = [0]*len(counter_names)
+   reset_state()
+   overruns = metrics.counters.get('yolink_messages_overrun_total', 0)
+   start(worker_count, len(devices), start_thread=False)
+   update_catalog(devices)
+
+   # Messages handled by the workers at the last scan
+   scanned = [0]
+   window = max(batch_size, len(devices)*queue_depth//2)
+   def feed():
+      for first in range(0, len(payloads), batch_size):
+         while first - scanned[0] > window:
+            time.sleep(0.001)
+         for payload in payloads[first:first+batch_size]:
+            submit(payload)
+      flush()
+   feeder = threading.Thread(target=feed, name='replay-feed', daemon=True)
+   started = time.perf_counter()
+   feeder.start()
+   while True:
+      flush()
+      done = sum(table.read_counters(w)[0] for w in range(worker_count))
+      sync()
+      scanned[0] = done
+      if done >= len(payloads):
+         break
+      time.sleep(replay_interval)
+   elapsed = time.perf_counter() - started
+   feeder.join()
+   stop()
+   return(elapsed, metrics.counters.get('yolink_messages_overrun_total', 0) - overruns)
+
+if __name__ == '__main__':
+   import os
+   import argparse
+   import tempfile
+   import contextlib
+   from yl_health import benchmark
+   from yl_health.catalog import Catalog
+   parser = argparse.ArgumentParser(description='Replay MQTT payloads through the multi-process ingest')
+   parser.add_argument('--messages', type=int, default=200000, help='number of messages (default 200000)')
+   parser.add_argument('--workers', type=int, default=4, help='largest number of workers (default 4)')
+   parser.add_argument('--devices', type=int, default=2000, help='number of generated devices (default 2000)')
+   parser.add_argument('--file', help='file of payloads, one JSON message per line')
+   parser.add_argument('--decoder', default='auto', help='JSON decoder used by the workers (default auto)')
+   args = parser.parse_args()
+
+   if args.file:
+      lines = [line.strip().encode('utf-8') for line in open(args.file) if line.strip()]
+      payloads = (lines * (args.messages//max(1,len(lines)) + 1))[:args.messages]
+   else:
+      payloads = generate_payloads(args.messages, args.devices)
+   device_list = {}
+   for payload in payloads:
+      device_id = payload_device_id(payload).decode('utf-8')
+      device_list[device_id] = {'deviceId':device_id, 'name':device_id, 'type':'THSensor'}
+   devices = Catalog()
+   devices.apply(list(device_list.values()))
+
+   # Run in a temporary folder with the benchmark configuration (built-in event table, no
+   # sampling), so the files of a running monitor are not touched
+   start_dir = os.getcwd()
+   with tempfile.TemporaryDirectory(prefix='yl_replay_') as work_dir:
+      os.chdir(work_dir)
+      try:
+         fid = open(config.config_file, 'w')
+         fid.write(benchmark.config_text)
+         fid.close()
+         config.read_config_variables()
+         config.extra_events = config.excluded_events = config.heartbeat_events = config.sampled_events = []
+         mqtt_ingest.build_event_table()
+         # The writer thread may still be writing after the folder is changed back
+         history.history_dir = os.path.join(work_dir, history.history_dir)
+         history.start_writer()
+
+         # One process, handling each message in the main thread, with each decoder
+         print("%d messages, %d devices" % (len(payloads), len(devices)))
+         rates = {}
+         for name in decoder.available_decoders():
+            decoder.select(name)
+            with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+               elapsed = replay_in_process(payloads, devices)
+            rates[name] = len(payloads)/elapsed
+            print("   in process   %9.0f messages/s   %s" % (rates[name], name))
+         decoder.select(args.decoder)
+         print("   workers use the %s decoder, rates include applying the updates (sync)" % decoder.decoder_name)
+
+         worker_count = 1
+         while worker_count <= args.workers:
+            with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+               elapsed, overruns = replay(payloads, worker_count, devices)
+            rate = len(payloads)/elapsed
+            print("   %2d workers   %9.0f messages/s   %.2fx   %d overruns" % (worker_count, rate, rate/rates[decoder.decoder_name], overruns))
+            worker_count *= 2
+         history.write_pending()
+      finally:
+         os.chdir(start_dir)
@@ -0,0 +1,333 @@
+#=============================================================================================
+# Rolling signal strength statistics
+#
+# For each device, signal readings are kept in one bucket per hour for the last seven days.
+# A bucket holds a count of readings by signal value (readings are whole dBm, so this is
+# small) and the sums needed for a least squares trend line.  Adding a reading is constant
+# time, and the statistics for any window (1h, 24h, 7d) are made by merging the buckets in
+# the window:
+#
+#    p5 / p50 / p95   - percentiles of signal strength
+#    minimum          - weakest reading
+#    slope            - trend in dBm per day (negative when the link is getting worse)
+#    dropout          - fraction of the reports expected at the device's usual reporting
+#                       interval (see stats.py) which were not received
+#
+# The hub (gateway) each device last reported through is also kept, so that the weakest
+# links can be ranked per hub.  batch_signal_report() computes the same statistics from the
+# history files with NumPy, for ranking the whole fleet.
+#=============================================================================================
+import json
+import time
+import threading
+
+from yl_health import stats
+
+# File used to save the buckets between runs
+signal_file = "yolink_health_signal.json"
+
+# Windows reported, in seconds
+windows = {'1h':3600, '24h':86400, '7d':7*86400}
+bucket_seconds = 3600
+keep_seconds = 7*86400
+
+# Smallest variance of reading times (days squared) for which a trend is reported
+min_spread = (5/1440.0)**2
+
+# Buckets by device name: {hour number: [counts by signal, n, st, ss, stt, sts]}, where the
+# sums are of time in days since the start of the bucket's hour and of signal strength
+device_buckets = {}
+
+# Hub (gateway ID) each device last reported through
+device_hub = {}
+
+signal_lock = threading.Lock()
+
+#=============================================================================================
+# Add a reading
+#=============================================================================================
+def observe(device_name, t, signal):
+   try:
+      signal = int(signal)
+   except:
+      return()
+
+   hour = int(t//bucket_seconds)
+   x = (t - hour*bucket_seconds)/86400.0
+   with signal_lock:
+      buckets = device_buckets.get(device_name)
+      if buckets is None:
+         buckets = {}
+         device_buckets[device_name] = buckets
+      bucket = buckets.get(hour)
+      if bucket is None:
+         bucket = [{}, 0, 0.0, 0.0, 0.0, 0.0]
+         buckets[hour] = bucket
+         # Drop buckets which have left the longest window
+         oldest = hour - keep_seconds//bucket_seconds
+         for h in [h for h in buckets if h <= oldest]:
+            del buckets[h]
+      counts = bucket[0]
+      counts[signal] = counts.get(signal, 0) + 1
+      bucket[1] += 1
+      bucket[2] += x
+      bucket[3] += signal
+      bucket[4] += x*x
+      bucket[5] += x*signal
+   return()
+
+# Function to record the hub a device reported through
+def set_hub(device_name, hub_id):
+   if hub_id:
+      device_hub[device_name] = hub_id
+   return()
+
+# Function to move the summaries of a renamed device to its new name
+def rename(old_name, new_name):
+   with signal_lock:
+      if old_name in device_buckets:
+         device_buckets[new_name] = device_buckets.pop(old_name)
+      if old_name in device_hub:
+         device_hub[new_name] = device_hub.pop(old_name)
+   return()
+
+#=============================================================================================
+# Window statistics
+#=============================================================================================
+
+# Function to return a percentile (0-100) from a dictionary of counts by value
+def count_percentile(counts, total, p):
+   target = p/100.0*(total-1)
+   seen = 0
+   for value in sorted(counts):
+      seen += counts[value]
+      if seen > target:
+         return(value)
+   return(max(counts))
+
+# Function to return the statistics for a device over a window, or None if there are no
+# readings in the window.  now defaults to the current time.
+def window_stats(device_name, window, now=None):
+   if now is None:
+      now = time.time()
+   window_seconds = windows[window]
+   first_hour = int((now-window_seconds)//bucket_seconds) + 1
+
+   counts = {}
+   n = 0
+   st = ss = stt = sts = 0.0
+   earliest_hour = None
+   with signal_lock:
+      buckets = device_buckets.get(device_name, {})
+      for hour, bucket in buckets.items():
+         if hour < first_hour:
+            continue
+         if earliest_hour is None or hour < earliest_hour:
+            earliest_hour = hour
+         for value, c in bucket[0].items():
+            counts[value] = counts.get(value, 0) + c
+         # Shift the bucket's time sums to days since the start of the window
+         offset = (hour-first_hour)*bucket_seconds/86400.0
+         bn = bucket[1]
+         n += bn
+         st += bucket[2] + offset*bn
+         ss += bucket[3]
+         stt += bucket[4] + 2*offset*bucket[2] + offset*offset*bn
+         sts += bucket[5] + offset*bucket[3]
+
+   if n == 0:
+      return(None)
+
+   # No trend unless the readings are spread over at least a few minutes
+   denominator = n*stt - st*st
+   if n >= 3 and denominator > n*n*min_spread:
+      slope = (n*sts - st*ss)/denominator
+   else:
+      slope = 0.0
+
+   # Dropout rate from the device's usual time between reports, over the part of the window
+   # for which there are readings
+   dropout = 0.0
+   device_stats = stats.device_stats.get(device_name)
+   if device_stats is not None and device_stats.gaps() >= stats.min_samples:
+      usual_gap = device_stats.percentile(50)
+      covered = min(window_seconds, now - earliest_hour*bucket_seconds)
+      if usual_gap > 0 and covered > usual_gap:
+         expected = covered/usual_gap
+         dropout = max(0.0, 1.0 - n/expected)
+
+   return({'count':n,
+           'p5':count_percentile(counts, n, 5),
+           'p50':count_percentile(counts, n, 50),
+           'p95':count_percentile(counts, n, 95),
+           'minimum':min(counts),
+           'slope':slope,
+           'dropout':dropout})
+
+# Function to return the weakest reading over the last seven days, or None.  Called for every
+# report, so only the lowest value of each bucket is looked at.
+def rolling_minimum(device_name):
+   first_hour = int((time.time()-windows['7d'])//bucket_seconds) + 1
+   minimum = None
+   with signal_lock:
+      for hour, bucket in device_buckets.get(device_name, {}).items():
+         if hour >= first_hour and len(bucket[0]) > 0:
+            lowest = min(bucket[0])
+            if minimum is None or lowest < minimum:
+               minimum = lowest
+   return(minimum)
+
+#=============================================================================================
+# Save and load
+#=============================================================================================
+def save_signal_stats():
+   saved = {'hubs':device_hub, 'buckets':{}}
+   with signal_lock:
+      for name, buckets in device_buckets.items():
+         saved['buckets'][name] = [[hour, [[v,c] for v, c in b[0].items()]] + b[1:] for hour, b in buckets.items()]
+   fid = open(signal_file,'w')
+   json.dump(saved, fid)
+   fid.close()
+   return()
+
+def load_signal_stats():
+   global device_buckets, device_hub
+   try:
+      fid = open(signal_file,'r')
+      saved = json.load(fid)
+      fid.close()
+   except:
+      saved = {}
+
+   device_hub = saved.get('hubs', {})
+   device_buckets = {}
+   oldest = int(time.time()//bucket_seconds) - keep_seconds//bucket_seconds
+   for name, buckets in saved.get('buckets', {}).items():
+      device_buckets[name] = {}
+      for entry in buckets:
+         hour = entry[0]
+         if hour > oldest:
+            device_buckets[name][hour] = [dict((v,c) for v, c in entry[1])] + entry[2:]
+   return()
+
+#=============================================================================================
+# Batch statistics from the history files
+#
+# Returns {device ID: {'count','p5','p50','p95','minimum','slope','dropout'}} for the given
+# window in days.  All devices are processed together: samples from every file are placed
+# in one array sorted by device and signal, and percentiles are picked out by index.
+#=============================================================================================
+def batch_signal_report(history_folder, window_days, now=None):
+   import os
+   import numpy as np
+
+   if now is None:
+      now = time.time()
+   cutoff = now - window_days*86400
+   dtype = np.dtype([('t','<f8'),('signal','<i2'),('battery','i1'),('kind','u1')])
+
+   ids = []
+   index = []
+   times = []
+   signals = []
+   gaps = []
+   covered = []
+   for name in sorted(os.listdir(history_folder)):
+      if name.endswith('.dat') == False:
+         continue
+      records = np.fromfile(os.path.join(history_folder,name), dtype=dtype)
+      reports = records[records['kind'] == 1]
+      keep = (reports['signal'] != -32768) & (reports['t'] >= cutoff)
+      count = np.count_nonzero(keep)
+      if count == 0:
+         continue
+      index.append(np.full(count, len(ids), dtype=np.int64))
+      times.append((reports['t'][keep]-cutoff)/86400.0)
+      signals.append(reports['signal'][keep].astype(np.float64))
+      kept = reports['t'][keep]
+      if len(kept) > 1:
+         gaps.append(float(np.median(np.diff(kept))))
+      else:
+         gaps.append(0.0)
+      covered.append(now - kept[0])
+      ids.append(name[:-4])
+
+   if len(ids) == 0:
+      return({})
+
+   idx = np.concatenate(index)
+   t = np.concatenate(times)
+   s = np.concatenate(signals)
+   m = len(ids)
+
+   n = np.bincount(idx, minlength=m).astype(np.float64)
+   st = np.bincount(idx, weights=t, minlength=m)
+   ss = np.bincount(idx, weights=s, minlength=m)
+   stt = np.bincount(idx, weights=t*t, minlength=m)
+   sts = np.bincount(idx, weights=t*s, minlength=m)
+   denominator = n*stt - st*st
+   valid = (n >= 3) & (denominator > n*n*min_spread)
+   slope = np.zeros(m)
+   slope[valid] = (n[valid]*sts[valid] - st[valid]*ss[valid])/denominator[valid]
+
+   # Percentiles: sort by device then signal, and index into each device's run of samples
+   order = np.lexsort((s, idx))
+   sorted_s = s[order]
+   start = np.concatenate(([0], np.cumsum(n)[:-1])).astype(np.int64)
+   percentiles = {}
+   for p in (5, 50, 95):
+      offset = np.floor(p/100.0*(n-1)).astype(np.int64)
+      percentiles[p] = sorted_s[start+offset]
+   minimum = sorted_s[start]
+
+   # Dropout over the part of the window since the first reading
+   usual_gap = np.array(gaps)
+   expected = np.where(usual_gap > 0, np.array(covered)/np.where(usual_gap > 0, usual_gap, 1), 0)
+   dropout = np.where(expected > 0, np.maximum(0.0, 1.0 - n/np.where(expected > 0, expected, 1)), 0.0)
+
+   results = {}
+   for i in range(m):
+      results[ids[i]] = {'count':int(n[i]), 'p5':int(percentiles[5][i]), 'p50':int(percentiles[50][i]),
+                         'p95':int(percentiles[95][i]), 'minimum':int(minimum[i]),
+                         'slope':float(slope[i]), 'dropout':float(dropout[i])}
+   return(results)
+
+# Function to rank the weakest links behind each hub.  report is the result of
+# batch_signal_report(), names maps device ID to name and hubs maps device name to hub.
+# Returns {hub: [(p5, device name, statistics), ...]} with the weakest link first.
+def worst_links_by_hub(report, names, hubs, top=10):
+   ranking = {}
+   for device_id, result in report.items():
+      name = names.get(device_id, device_id)
+      hub = hubs.get(name, 'unknown')
+      ranking.setdefault(hub, []).append((result['p5'], name, result))
+   for hub in ranking:
+      ranking[hub].sort(key=lambda entry: (entry[0], entry[1]))
+      ranking[hub] = ranking[hub][:top]
+   return(ranking)
+
+#=============================================================================================
+# Print the weakest links per hub from the history files
+#
+# Usage:  python -m yl_health.signal_stats [days] [top]
+#=============================================================================================
+if __name__ == '__main__':
+   import sys
+   from yl_health import history
+
+   days = 7
+   top = 10
+   if len(sys.argv) > 1: days = float(sys.argv[1])
+   if len(sys.argv) > 2: top = int(sys.argv[2])
+
+   load_signal_stats()
+   names = {}
+   for device_id, entry in history.load_device_index().items():
+      names[device_id] = entry.get('key', entry['name'])
+
+   report = batch_signal_report(history.history_dir, days)
+   for hub, links in sorted(worst_links_by_hub(report, names, device_hub, top).items()):
+      print("\nHub %s - weakest links over %s days" % (hub, days))
+      print("   %s %5s %5s %5s %5s %12s %8s" % ('Device'.ljust(30), 'p5', 'p50', 'p95', 'Min', 'dBm/day', 'Dropout'))
+      for p5, name, result in links:
+         print("   %s %5s %5s %5s %5s %12.2f %7.0f%%" % (name[:30].ljust(30), result['p5'], result['p50'], result['p95'], result['minimum'], result['slope'], result['dropout']*100))
@@ -0,0 +1,498 @@
+#=============================================================================================
+# Hot standby
+#
+# Two copies of the monitor (e.g. on two Raspberry Pis) can share a folder, "standby_dir"
+# (e.g. an NFS or SMB mount), so that one takes over if the other hangs or stops.  The
+# folder holds:
+#
+#    lease.json    the lease: owner, term, expiry time and the date of the last daily check
+#    lease.lock    locked while the lease is read and written
+#    journal.log   every update accepted by the active copy and every hub going dark or
+#                  coming back, one JSON line each, and
+#    journal.1     the previous journal, once journal.log reaches journal_max_bytes
+#
+# The copy holding the lease is active and runs as usual.  A thread renews the lease every
+# third of "lease_seconds", as long as the main loop is still running.  The other copy is
+# the standby: it keeps its device catalog and access token current (threads runtime), and
+# applies the journal to its status table and history as it is written.  Within a second of
+# the lease expiring it takes the lease, connects to MQTT with its state already current
+# (so the startup backfill is skipped) and starts sending alerts.
+#
+# The daily status check is only run by a copy which records it in the lease for the day,
+# and hubs already reported dark stay dark on the new active copy (see topology.start), so a
+# takeover doesn't repeat alerts.  A copy which finds that its lease has
+# been taken (e.g. after hanging for longer than lease_seconds) stops at once and restarts
+# itself as the standby.
+#
+# The two copies' clocks must agree (e.g. both use NTP).
+#
+# To try a failover with two local processes:  python -m yl_health.standby --drill
+#=============================================================================================
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import contextlib
+
+from yl_health import config
+from yl_health import store
+from yl_health import stats
+from yl_health import history
+from yl_health import topology
+from yl_health.common import post, timestamp, print_bs, print_nl, unpack_unix_time, get_decade
+
+# Journal size at which it is started again
+journal_max_bytes = 4*1024*1024
+
+# The lease is only renewed while the main loop has called heartbeat() within this many
+# seconds (startup, with its backfill, may take a while)
+loop_stall_seconds = 300
+
+# Name of this copy, and the term of the lease it holds (0 while standby)
+instance = ''
+term = 0
+
+# Journal being written by the active copy, lines waiting to be written to it by the lease
+# thread, and the lock held while they are added
+journal_fid = None
+journal_lines = []
+journal_lock = threading.Lock()
+
+# Monotonic time of the last heartbeat from the main loop, and the renewing thread
+last_beat = 0
+renew_thread = None
+
+def enabled():
+   return(config.standby_dir != '')
+
+def standby_path(name):
+   return(os.path.join(config.standby_dir, name))
+
+# Function to return the name of this copy
+def instance_name():
+   if config.instance_name:
+      return(config.instance_name)
+   return('%s:%s' % (socket.gethostname(), os.getpid()))
+
+#=============================================================================================
+# Lease
+#=============================================================================================
+
+# Lock held while the lease is read and written.  Without fcntl (not a Unix system) the
+# atomic rename of the lease file is relied on.
+@contextlib.contextmanager
+def lease_lock():
+   fid = open(standby_path('lease.lock'), 'a')
+   try:
+      try:
+         import fcntl
+         fcntl.flock(fid.fileno(), fcntl.LOCK_EX)
+      except ImportError:
+         pass
+      yield
+   finally:
+      fid.close()
+
+def read_lease():
+   try:
+      fid = open(standby_path('lease.json'), 'r')
+      record = json.load(fid)
+      fid.close()
+   except:
+      record = {}
+   return(record)
+
+def write_lease(record):
+   temporary = standby_path('lease.json.%s' % os.getpid())
+   fid = open(temporary, 'w')
+   json.dump(record, fid)
+   fid.flush()
+   os.fsync(fid.fileno())
+   fid.close()
+   os.replace(temporary, standby_path('lease.json'))
+   return()
+
+# Function to take the lease if it is free or has expired.  Returns the new term, or 0.
+def try_acquire(now=None):
+   if now is None:
+      now = time.time()
+   with lease_lock():
+      record = read_lease()
+      if record.get('owner') not in (None, instance) and record.get('expires', 0) >= now:
+         return(0)
+      record['owner'] = instance
+      record['term'] = record.get('term', 0) + 1
+      record['expires'] = now + config.lease_seconds
+      write_lease(record)
+   return(record['term'])
+
+# Function to extend the lease.  Returns False if it is no longer held by this copy.
+def renew(now=None):
+   if now is None:
+      now = time.time()
+   with lease_lock():
+      record = read_lease()
+      if record.get('owner') != instance or record.get('term') != term:
+         return(False)
+      record['expires'] = now + config.lease_seconds
+      write_lease(record)
+   return(True)
+
+# Function to claim today's daily status check.  Returns False if it has already been run
+# today by either copy, or this copy doesn't hold the lease.
+def claim_daily_check():
+   if enabled() == False:
+      return(True)
+   today = time.strftime('%Y-%m-%d')
+   with lease_lock():
+      record = read_lease()
+      if record.get('owner') != instance or record.get('term') != term:
+         return(False)
+      if record.get('daily_check') == today:
+         print_nl("%s Daily check already run today" % timestamp())
+         return(False)
+      record['daily_check'] = today
+      write_lease(record)
+   return(True)
+
+#=============================================================================================
+# Active copy: journal and lease renewal
+#=============================================================================================
+
+# Function to add an accepted update to the journal (a store.update_listeners entry)
+def record_update(device_name, device_id, battery, signal, kind, t):
+   line = json.dumps([device_name, device_id, str(battery), str(signal), kind, round(t,3)]) + '\n'
+   with journal_lock:
+      journal_lines.append(line)
+   return()
+
+# Function to add a hub going dark (since the given time) or coming back (since=None) to the
+# journal (a topology.hub_listeners entry)
+def record_hub(hub_id, since):
+   line = json.dumps({'hub':hub_id, 'dark_since':since}) + '\n'
+   with journal_lock:
+      journal_lines.append(line)
+   return()
+
+# Function to write the journal to the file, starting a new one when it is full
+def flush_journal():
+   global journal_fid, journal_lines
+   with journal_lock:
+      lines = journal_lines
+      journal_lines = []
+   if len(lines) > 0:
+      try:
+         journal_fid.write(''.join(lines))
+         journal_fid.flush()
+      except OSError:
+         # Kept for the next attempt
+         with journal_lock:
+            journal_lines = lines + journal_lines
+         raise
+      if journal_fid.tell() > journal_max_bytes:
+         journal_fid.close()
+         os.replace(standby_path('journal.log'), standby_path('journal.1'))
+         journal_fid = open(standby_path('journal.log'), 'a', encoding='utf-8')
+   return()
+
+# Function called by the main loop to show that it is still running
+def heartbeat():
+   global last_beat
+   last_beat = time.monotonic()
+   return()
+
+# Thread writing the journal once a second and renewing the lease
+def renew_lease():
+   next_renewal = 0
+   while True:
+      time.sleep(1)
+      try:
+         flush_journal()
+         if time.monotonic() < next_renewal:
+            continue
+         if time.monotonic() - last_beat > loop_stall_seconds:
+            print_nl("%s Main loop not running, lease not renewed" % timestamp())
+            continue
+         if renew() == False:
+            lost_lease()
+         next_renewal = time.monotonic() + config.lease_seconds/3
+      except OSError as e:
+         print_nl("%s Unable to renew lease: %s" % (timestamp(),e))
+   return()
+
+# Function to stop at once when another copy has taken the lease, and start again as the
+# standby
+def lost_lease():
+   record = read_lease()
+   print_nl("%s Lease taken by %s, restarting as standby" % (timestamp(),record.get('owner')))
+   post("Lease taken by %s, restarting as standby" % record.get('owner'))
+   sys.stdout.flush()
+   os.execv(sys.executable, [sys.executable] + sys.argv)
+   return()
+
+# Function to start the journal and lease renewal once this copy holds the lease
+def start_active():
+   global journal_fid, renew_thread
+   journal_fid = open(standby_path('journal.log'), 'a', encoding='utf-8')
+   store.update_listeners.append(record_update)
+   topology.hub_listeners.append(record_hub)
+   heartbeat()
+   renew_thread = threading.Thread(target=renew_lease, name='lease', daemon=True)
+   renew_thread.start()
+   return()
+
+#=============================================================================================
+# Standby copy: journal replication
+#=============================================================================================
+class JournalReader:
+   def __init__(self):
+      self.inode = None
+      self.offset = 0
+      self.applied = 0
+
+   # Function to apply the journal entries written since the last call
+   def poll(self):
+      try:
+         inode = os.stat(standby_path('journal.log')).st_ino
+      except OSError:
+         return(0)
+      count = 0
+      if inode != self.inode:
+         # Started again: finish the previous journal if it is the one being read
+         if self.inode is not None:
+            count += self.read_file('journal.1', self.inode)
+         self.inode = inode
+         self.offset = 0
+      count += self.read_file('journal.log', inode)
+      self.applied += count
+      return(count)
+
+   # Function to apply the complete lines of a journal file from the current offset
+   def read_file(self, name, inode):
+      try:
+         fid = open(standby_path(name), 'rb')
+      except OSError:
+         return(0)
+      try:
+         if os.fstat(fid.fileno()).st_ino != inode:
+            return(0)
+         fid.seek(self.offset)
+         data = fid.read()
+      finally:
+         fid.close()
+      end = data.rfind(b'\n') + 1
+      count = 0
+      for line in data[:end].splitlines():
+         if apply_entry(line):
+            count += 1
+      self.offset += end
+      return(count)
+
+   # Function to apply the previous journal and the current one from the start
+   def catch_up(self):
+      try:
+         self.inode = os.stat(standby_path('journal.1')).st_ino
+         self.offset = 0
+         self.applied += self.read_file('journal.1', self.inode)
+      except OSError:
+         pass
+      self.inode = None
+      return(self.poll())
+
+# Function to apply one journal entry to the status table.  Returns False if it can't be read.
+def apply_entry(line):
+   try:
+      entry = json.loads(line)
+      if type(entry) is dict:
+         topology.restore_dark(entry['hub'], entry['dark_since'])
+         return(True)
+      device_name, device_id, battery, signal, kind, t = entry
+   except (ValueError, KeyError, TypeError):
+      return(False)
+   # Entries no newer than the last update of the device (e.g. replayed after a restart) are
+   # skipped, so they aren't counted twice
+   last_time = stats.get_stats(device_name).last_time
+   if last_time is not None and t <= last_time:
+      return(True)
+   if kind == history.kind_contact:
+      store.record_contact(device_name, device_id, t)
+   else:
+      store.update_device_status(device_name, battery, signal, unpack_unix_time(t*1000), device_id, kind, t)
+   return(True)
+
+#=============================================================================================
+# Wait until this copy holds the lease.  Returns at once if the lease is free.  With warm=True
+# the access token and device catalog are kept current while waiting.
+#=============================================================================================
+def wait_for_lease(warm=True):
+   global instance, term
+
+   os.makedirs(config.standby_dir, exist_ok=True)
+   instance = instance_name()
+   term = try_acquire()
+   if term > 0:
+      post("Holding lease as %s (term %s)" % (instance,term))
+      return(False)
+
+   record = read_lease()
+   print_nl("%s Standby: lease held by %s" % (timestamp(),record.get('owner')))
+   post("Standby: lease held by %s" % record.get('owner'))
+
+   reader = JournalReader()
+   reader.catch_up()
+   print_nl("%s Standby: %s journal entries applied" % (timestamp(),reader.applied))
+
+   next_refresh = 0
+   current_decade = get_decade()
+   while term == 0:
+      if warm and time.monotonic() >= next_refresh:
+         next_refresh = time.monotonic() + warm_catalog()
+
+      reader.poll()
+
+      # Keep the local table current in case both copies are restarted
+      if current_decade != get_decade():
+         if store.file_dirty:
+            store.write_table()
+         current_decade = get_decade()
+
+      if read_lease().get('expires', 0) < time.time():
+         term = try_acquire()
+      if term == 0:
+         print_bs("%s Standby, %s updates replicated" % (timestamp(),reader.applied))
+         time.sleep(1)
+
+   reader.poll()
+   record = read_lease()
+   print_nl("\n%s Lease expired, taking over as %s (term %s)" % (timestamp(),instance,term))
+   post("Lease expired, taking over as %s (term %s)" % (instance,term))
+
+   # The status table is current from the journal, so the startup backfill isn't needed
+   config.startup_backfill = False
+   return(True)
+
+# Function to refresh the access token and device catalog.  Returns the seconds until the next
+# refresh.
+def warm_catalog():
+   from yl_health import api
+   from yl_health import startup
+   try:
+      api.YL_refresh_credentials()
+      startup.load_device_catalog()
+   except Exception as e:
+      print_nl("%s Standby: unable to load device list: %s" % (timestamp(),e))
+      return(60)
+   return(max(60, (api.YL_token_valid_minutes-5)*60))
+
+#=============================================================================================
+# Failover drill: two local copies share a temporary folder.  The first takes the lease and
+# reports updates; it is then killed, and the time taken by the second to take over and the
+# state it replicated are reported.
+#=============================================================================================
+drill_devices = 20
+drill_hub_devices = ['Hub Device 1', 'Hub Device 2']
+
+def drill_instance(name, folder):
+   config.standby_dir = folder
+   config.instance_name = name
+   config.lease_seconds = 3
+   config.verbose = config.logging = config.history_enabled = False
+   config.learned_staleness = False
+   config.max_age_minutes = 60
+   config.recent_samples = 8
+   config.hub_outage_percent = 80
+   config.hub_outage_min_devices = 1
+   store.load_table()
+   # Two devices report through a hub which has stopped
+   from yl_health import signal_stats
+   for device_name in drill_hub_devices:
+      signal_stats.device_hub[device_name] = 'Drill Hub'
+
+   wait_for_lease(warm=False)
+   start_active()
+   if 'Drill Hub' not in topology.dark_since:
+      for device_name in drill_hub_devices:
+         store.update_device_status(device_name, '4', '-70', unpack_unix_time((time.time()-7200)*1000))
+   # Hub alerts are counted rather than sent.  The hub is found dark an hour on.
+   from yl_health import alerts
+   hub_alerts = []
+   alerts.send_status_email = lambda subject, message: hub_alerts.append(subject)
+   topology.start()
+   topology.check_deadlines(time.time() + 3601)
+   print("ACTIVE %s %.3f %s" % (name, time.time(), json.dumps(dict((d, r[1]) for d, r in store.dev_status_dictionary.items()))), flush=True)
+   print("DAILY %s %s" % (name, claim_daily_check()), flush=True)
+   print("HUBS %s %s %s" % (name, len(hub_alerts), ', '.join(topology.dark_since) or 'none'), flush=True)
+   i = 0
+   while True:
+      store.update_device_status('Device %02d' % (i % drill_devices), '4', str(-40 - i % 50))
+      heartbeat()
+      i += 1
+      time.sleep(0.01)
+
+def drill():
+   import signal
+   import tempfile
+   import subprocess
+
+   folder = tempfile.mkdtemp(prefix='yl_standby_')
+   package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+   env = dict(os.environ, PYTHONPATH=package_dir)
+
+   def start(name):
+      work = os.path.join(folder, name)
+      os.makedirs(work)
+      return(subprocess.Popen([sys.executable, '-m', 'yl_health.standby', '--drill-instance', name, os.path.join(folder, 'shared')],
+                              cwd=work, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True))
+
+   def wait_for(process, prefix):
+      while True:
+         line = process.stdout.readline()
+         if line == '':
+            return(None)
+         if line.startswith(prefix):
+            return(line.split(' ', 3))
+
+   first = start('first')
+   wait_for(first, 'ACTIVE')
+   print("first:  active,", ' '.join(wait_for(first, 'DAILY')[1:]).strip(), "daily check")
+   hubs = wait_for(first, 'HUBS')
+   print("first:  %s dark, %s hub alerts sent" % (hubs[3].strip(), hubs[2]))
+   second = start('second')
+   time.sleep(5)
+   first.send_signal(signal.SIGKILL)
+   killed = time.time()
+   first.wait()
+   print("first:  killed")
+
+   # Last update of each device in the journal written by the first copy
+   expected = {}
+   for name in ('journal.1', 'journal.log'):
+      try:
+         for line in open(os.path.join(folder, 'shared', name), 'rb'):
+            entry = json.loads(line)
+            if type(entry) is list:
+               expected[entry[0]] = int(entry[3])
+      except (OSError, ValueError):
+         pass
+
+   active = wait_for(second, 'ACTIVE')
+   replicated = json.loads(active[3])
+   matching = sum(1 for d in expected if str(replicated.get(d)) == str(expected[d]))
+   print("second: active %.1f seconds after the first was killed (lease %s seconds)" % (float(active[2]) - killed, 3))
+   print("second: %s of %s devices replicated with their last signal" % (matching, len(expected)))
+   print("second:", ' '.join(wait_for(second, 'DAILY')[1:]).strip(), "daily check")
+   hubs = wait_for(second, 'HUBS')
+   print("second: %s dark, %s hub alerts sent" % (hubs[3].strip(), hubs[2]))
+   second.send_signal(signal.SIGKILL)
+   second.wait()
+   return(0 if matching == len(expected) and hubs[2] == '0' else 1)
+
+if __name__ == '__main__':
+   if len(sys.argv) == 4 and sys.argv[1] == '--drill-instance':
+      drill_instance(sys.argv[2], sys.argv[3])
+   elif len(sys.argv) == 2 and sys.argv[1] == '--drill':
+      sys.exit(drill())
+   else:
+      print("Usage: python -m yl_health.standby --drill")
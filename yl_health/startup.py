@@ -0,0 +1,130 @@
+#=============================================================================================
+# Session startup pipeline
+#
+# Each session (program start, and every recycle before the access token expires) needs
+# an access token, the home ID, an MQTT connection and the device list.  The token and
+# home ID must come first.  The MQTT connection and the device list fetch are independent
+# and are run at the same time; messages received before the device list is loaded are
+# held by mqtt_ingest and processed once it is.
+#
+# On the first session the current state of every supported device is then fetched with
+# concurrent, rate limited getState requests so that the table is complete within seconds
+# instead of waiting for each device's next periodic report.
+#=============================================================================================
+import os
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from yl_health import config
+from yl_health import common
+from yl_health import api
+from yl_health import store
+from yl_health import history
+from yl_health import mqtt_ingest
+from yl_health import shared_ingest
+from yl_health.common import post, timestamp, print_nl
+
+# Function to fetch the device list and update the device catalog
+def load_device_catalog():
+   api.YL_get_device_list()
+   shared_ingest.update_catalog(api.catalog)
+   return()
+
+#=============================================================================================
+# Start a session
+#=============================================================================================
+def YL_start_session():
+   start = datetime.datetime.now()
+
+   mqtt_ingest.hold_messages()
+   try:
+      api.YL_refresh_credentials()
+   except Exception as e:
+      from yl_health.display import pcolor, LIGHT_RED, NEGATIVE
+      print_nl("%s %s" % (timestamp(),e))
+      pcolor(LIGHT_RED+NEGATIVE,'\nUnable to obtain Access Token.  Check the credentials in the configuration file "%s".' % config.config_file)
+      print("\nProgram stopped.\n")
+      os._exit(5)
+
+   with ThreadPoolExecutor(max_workers=2) as executor:
+      mqtt_future = executor.submit(mqtt_ingest.YL_establish_MQTT_connection)
+      catalog_future = executor.submit(load_device_catalog)
+
+      # The device list is needed before held messages can be processed
+      catalog_future.result()
+      mqtt_ingest.release_pending_messages()
+      mqtt_future.result()
+
+   if config.verbose: print_nl("%s Session started in %.1f seconds" % (timestamp(),(datetime.datetime.now()-start).total_seconds()))
+
+   if common.first_time and config.startup_backfill:
+      backfill_device_states()
+   return()
+
+#=============================================================================================
+# Backfill current state of all devices
+#=============================================================================================
+
+# Function to return the set of device types to be fetched.  Hubs are left out because the
+# main loop polls them as soon as it starts.
+def supported_device_types():
+   types = set()
+   for event in mqtt_ingest.recognized_events:
+      types.add(event.split('.')[0])
+   return(types)
+
+# Function to convert the "reportAt" time of a getState response to the table time format.
+# Returns None if the time is missing or cannot be read.
+def report_time(report_at):
+   try:
+      dt = datetime.datetime.fromisoformat(report_at.replace('Z','+00:00'))
+      dt = dt.astimezone().replace(tzinfo=None)
+      return(dt.strftime('%Y-%m-%d %I:%M:%S %p'))
+   except:
+      return(None)
+
+# Function to apply a getState response to the status dictionary.  Returns True if the
+# dictionary was updated.
+def apply_device_state(device, response):
+   try:
+      if response['desc'] != 'Success':
+         return(False)
+      data = response['data']
+   except:
+      return(False)
+
+   battery, signal = api.state_battery_signal(response)
+
+   # Devices known to be off line keep their last update time
+   if data.get('online', True) == False:
+      return(False)
+
+   update_time = report_time(data.get('reportAt'))
+   if update_time is None:
+      update_time = timestamp()
+
+   return(store.update_device_status(device.key,battery,signal,update_time,device.id,history.kind_state))
+
+def backfill_device_states():
+   if common.first_time: post("Fetching current state of all devices")
+   start = datetime.datetime.now()
+
+   types = supported_device_types()
+   devices = [d for d in api.catalog if d.type in types]
+
+   updated = 0
+   with ThreadPoolExecutor(max_workers=max(1,config.api_workers)) as executor:
+      futures = {}
+      for d in devices:
+         futures[executor.submit(api.YL_get_device_state, d)] = d
+      for future in as_completed(futures):
+         try:
+            if apply_device_state(futures[future], future.result()):
+               updated += 1
+         except Exception as e:
+            print_nl("%s Unable to get state of %s: %s" % (timestamp(),futures[future].key,e))
+
+   elapsed = (datetime.datetime.now()-start).total_seconds()
+   print_nl("%s Current state loaded for %s of %s devices in %.1f seconds" % (timestamp(),updated,len(devices),elapsed))
+   if common.first_time: post("Current state loaded for %s of %s devices" % (updated,len(devices)))
+   return()
@@ -0,0 +1,207 @@
+#=============================================================================================
+# Per-device report timing statistics
+#
+# One DeviceStats object is kept for each device.  Each report updates, in constant time
+# and memory:
+#    count              - number of reports seen
+#    mean / m2          - running mean and sum of squares of the time between reports (Welford)
+#    ewma / ewma_var    - exponentially weighted mean and variance of the time between reports
+#    max_gap            - longest time between reports
+#    recent             - the last recent_size gaps, used to estimate percentiles
+# All times are in seconds.
+#
+# stale_minutes() turns these into a staleness threshold for the device.  Until enough
+# reports have been seen the configured max_age_minutes is used.  After that the threshold
+# is "staleness_factor" times the 95th percentile of recent gaps, but never less than
+# "staleness_min_minutes".  A sensor that reports every few minutes is flagged quickly and
+# a device that normally reports every few hours does not raise false alarms.
+#=============================================================================================
+import math
+import time
+import json
+import datetime
+from array import array
+
+from yl_health import config
+
+# File used to save statistics between runs
+stats_file = "yolink_health_stats.json"
+
+# Number of recent gaps kept for percentiles, and number of gaps needed before the learned
+# threshold is used
+recent_size = 64
+min_samples = 10
+
+# Weight of the newest gap in the exponentially weighted mean and variance
+ewma_alpha = 0.1
+
+class DeviceStats:
+   def __init__(self, last_time=None):
+      self.count = 0
+      self.last_time = last_time
+      self.mean = 0.0
+      self.m2 = 0.0
+      self.ewma = 0.0
+      self.ewma_var = 0.0
+      self.max_gap = 0.0
+      self.recent = array('f', [0.0]*recent_size)
+      self.recent_count = 0
+      self.threshold_cache = None
+
+   # Record a report at time t (seconds since the epoch).  Returns the gap since the previous
+   # report, or None for the first report.  Reports older than the last one are ignored.
+   def observe(self, t):
+      if self.last_time is None:
+         self.last_time = t
+         self.count = 1
+         return(None)
+      gap = t - self.last_time
+      if gap < 0:
+         return(None)
+      self.last_time = t
+      self.count += 1
+
+      # Welford running mean and variance
+      n = self.count - 1
+      delta = gap - self.mean
+      self.mean += delta/n
+      self.m2 += delta*(gap-self.mean)
+
+      # Exponentially weighted mean and variance
+      if n == 1:
+         self.ewma = gap
+      else:
+         diff = gap - self.ewma
+         self.ewma += ewma_alpha*diff
+         self.ewma_var = (1-ewma_alpha)*(self.ewma_var + ewma_alpha*diff*diff)
+
+      if gap > self.max_gap:
+         self.max_gap = gap
+
+      self.recent[self.recent_count % recent_size] = gap
+      self.recent_count += 1
+      self.threshold_cache = None
+      return(gap)
+
+   # Number of gaps recorded
+   def gaps(self):
+      return(max(0, self.count-1))
+
+   def variance(self):
+      if self.gaps() < 2:
+         return(0.0)
+      return(self.m2/(self.gaps()-1))
+
+   # Percentile (0-100) of the recent gaps, in seconds
+   def percentile(self, p):
+      n = min(self.recent_count, recent_size)
+      if n == 0:
+         return(0.0)
+      values = sorted(self.recent[:n])
+      k = (n-1)*p/100.0
+      lower = int(math.floor(k))
+      upper = min(n-1, lower+1)
+      return(values[lower] + (values[upper]-values[lower])*(k-lower))
+
+   # Minutes since the last report
+   def age_minutes(self, now=None):
+      return(minutes_since(self.last_time, now))
+
+   # Longest time between reports in minutes, including the time since the last report
+   def longest_minutes(self, now=None):
+      return(max(int(self.max_gap/60), self.age_minutes(now)))
+
+   # Number of minutes without a report after which the device is considered stale
+   def stale_minutes(self):
+      if config.learned_staleness == False or self.gaps() < min_samples:
+         return(config.max_age_minutes)
+      if self.threshold_cache is None:
+         learned = config.staleness_factor*self.percentile(95)/60
+         self.threshold_cache = int(max(config.staleness_min_minutes, learned))
+      return(self.threshold_cache)
+
+   def to_dict(self):
+      n = min(self.recent_count, recent_size)
+      return({'count':self.count, 'last_time':self.last_time, 'mean':self.mean, 'm2':self.m2,
+              'ewma':self.ewma, 'ewma_var':self.ewma_var, 'max_gap':self.max_gap,
+              'recent':[round(g,1) for g in self.recent_order()[:n]]})
+
+   # Recent gaps, oldest first
+   def recent_order(self):
+      n = min(self.recent_count, recent_size)
+      start = self.recent_count % recent_size if self.recent_count > recent_size else 0
+      return([self.recent[(start+i) % recent_size] for i in range(n)])
+
+   @classmethod
+   def from_dict(cls, d):
+      s = cls(d.get('last_time'))
+      s.count = d.get('count', 0)
+      s.mean = d.get('mean', 0.0)
+      s.m2 = d.get('m2', 0.0)
+      s.ewma = d.get('ewma', 0.0)
+      s.ewma_var = d.get('ewma_var', 0.0)
+      s.max_gap = d.get('max_gap', 0.0)
+      for gap in d.get('recent', [])[-recent_size:]:
+         s.recent[s.recent_count % recent_size] = gap
+         s.recent_count += 1
+      return(s)
+
+# Function to return the whole minutes since a time (seconds since the epoch), or 0 if it
+# is None
+def minutes_since(t, now=None):
+   if t is None:
+      return(0)
+   if now is None:
+      now = time.time()
+   return(int((now-t)/60))
+
+#=============================================================================================
+# Statistics for all devices, keyed by device name
+#=============================================================================================
+device_stats = {}
+
+# Function to convert a table time stamp to seconds since the epoch
+def table_time_to_epoch(update_time):
+   return(datetime.datetime.strptime(update_time,'%Y-%m-%d %I:%M:%S %p').timestamp())
+
+# Function to return the statistics for a device, creating them if necessary
+def get_stats(device_name):
+   s = device_stats.get(device_name)
+   if s is None:
+      s = DeviceStats()
+      device_stats[device_name] = s
+   return(s)
+
+# Function to load saved statistics.  Devices in the status table without saved statistics
+# start from their last update time and longest update from the table.
+def load_stats(dev_status_dictionary):
+   global device_stats
+   device_stats = {}
+   try:
+      fid = open(stats_file,'r')
+      saved = json.load(fid)
+      fid.close()
+   except:
+      saved = {}
+
+   for name, record in dev_status_dictionary.items():
+      if name in saved:
+         device_stats[name] = DeviceStats.from_dict(saved[name])
+      else:
+         try:
+            s = DeviceStats(table_time_to_epoch(record[3]))
+            s.count = 1
+            s.max_gap = int(record[4])*60
+         except:
+            s = DeviceStats()
+         device_stats[name] = s
+   return()
+
+def save_stats():
+   saved = {}
+   for name, s in list(device_stats.items()):
+      saved[name] = s.to_dict()
+   fid = open(stats_file,'w')
+   json.dump(saved, fid)
+   fid.close()
+   return()
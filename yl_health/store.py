@@ -0,0 +1,408 @@
+#=============================================================================================
+# Device status store
+#
+# dev_status_dictionary holds one entry per device, keyed by device name:
+#    [battery, current signal, minimum signal, last update time, longest update (minutes)]
+# Minimum signal is the weakest reading of the last seven days (see signal_stats.py).
+# The dictionary is saved to "yolink_health_table.txt" by write_table() and reloaded at
+# startup by load_table().
+#=============================================================================================
+import time
+import os.path
+import threading
+
+from yl_health import config
+from yl_health import stats
+from yl_health import history
+from yl_health import recent
+from yl_health import signal_stats
+from yl_health.common import timestamp, print_nl, unpack_unix_time
+
+# Name of file used to store current device list with health statistics
+health_table = "yolink_health_table.txt"
+
+# Length of key to be used in device dictionary
+key_size=30
+
+# Device status dictionary and flag indicating that it has changed since it was last written
+dev_status_dictionary={}
+file_dirty=False
+
+# Lock held while an entry is updated.  Entries are updated from the MQTT thread and from
+# the threads that fetch device state from the YoLink API.
+status_lock = threading.Lock()
+
+# Functions called with no arguments after an entry has changed (e.g. the dashboard)
+change_listeners = []
+
+# Functions called with (old name, new name) after a device has been renamed (see rename_device)
+rename_listeners = []
+
+# Functions called with the device name after a device has been heard from (e.g. topology.py)
+contact_listeners = []
+
+# Functions called with (device name, device ID, battery, signal, kind, time) after an
+# update has been accepted (e.g. influx.py)
+update_listeners = []
+
+# Function returning the latest state of a device from a source which may be ahead of the
+# dictionary, or None: (battery, signal, time of that report, time last heard from), times in
+# seconds since the epoch and battery and signal as in the dictionary (None when no report is
+# known).  Set while the multi-process ingest is running, so that the display, alerts and
+# metrics read the shared device table directly (see shared_ingest.py).
+live_source = None
+
+# Function to tell listeners that an entry has changed
+def notify_change():
+   for listener in change_listeners:
+      listener()
+   return()
+
+# Function to tell listeners that a device has been heard from
+def notify_contact(device_name):
+   for listener in contact_listeners:
+      listener(device_name)
+   return()
+
+# Function to tell listeners about an accepted update
+def notify_update(device_name, device_id, battery, signal, kind, t):
+   for listener in update_listeners:
+      listener(device_name, device_id, battery, signal, kind, t)
+   return()
+
+#=============================================================================================
+#
+# Read current "yolink_health_table.txt" file and used it to build device status dictionary
+#
+#=============================================================================================
+def load_table():
+   global dev_status_dictionary
+   dev_status_dictionary={}
+   if os.path.isfile(health_table) == False:
+      fid=open(health_table,'w')
+      fid.close()
+   fid=open(health_table,'r')
+   file=fid.readlines()
+   for record in file:
+      if len(record.rstrip()) > 0:
+         entry=record[2:key_size+2]
+         entry=entry.rstrip()
+         key=entry[:-1]
+         ptr=record.find('Battery:')
+         battery_status=record[ptr+9:ptr+9+1]
+         ptr=record.find('Current Signal:')
+         current_signal_status=record[ptr+15:ptr+15+4].lstrip()
+         ptr=record.find('Min Signal:')
+         minimum_signal_status=record[ptr+11:ptr+11+4].lstrip()
+         ptr=record.find('Last Update')
+         update_time=record[ptr+13:ptr+34+1].lstrip()
+         ptr=record.find('Longest Update:')
+         longest_update=record[ptr+16:len(record)-6]
+
+         if config.verbose: print("|%s| Battery:|%s|    Signal:|%s|    Min Signal:|%s|    Last Update: |%s|  Longest: |%s|" % (key,battery_status,current_signal_status,minimum_signal_status,update_time,longest_update))
+
+         if battery_status == '-':
+            battery_display = battery_status
+         else:
+            battery_display = int(battery_status)
+
+         if current_signal_status=='??':
+            current_signal_display = current_signal_status
+         else:
+            current_signal_display=int(current_signal_status)
+
+         if minimum_signal_status=='??':
+            minimum_signal_display = minimum_signal_status
+         else:
+            minimum_signal_display=int(minimum_signal_status)
+
+
+         dev_status_dictionary[key]=[battery_display,current_signal_display,minimum_signal_display,update_time,longest_update]
+   fid.close()
+
+   stats.load_stats(dev_status_dictionary)
+   signal_stats.load_signal_stats()
+   recent.load_recent()
+   return()
+
+
+def write_table():
+   global file_dirty
+
+   fid = open(health_table,"w")
+
+   for d in sorted(dev_status_dictionary):
+      key=d+":"
+      status=dev_status_dictionary[d]
+      if status[0] == '-':
+         battery_status = ' -'
+      else:
+         battery_status=str(status[0]).rjust(2,' ')
+      current_signal_status=str(status[1]).rjust(4,' ')
+      minimum_signal_status=str(status[2]).rjust(4,' ')
+      update_time=status[3]
+      longest_update=status[4]
+      fid.write("  %s Battery:%s   Current Signal:%s   Min Signal:%s   Last Update: %s   Longest Update: %s Mins\n" % (key.ljust(key_size," "),battery_status,current_signal_status,minimum_signal_status,update_time,str(round(int(longest_update),1))))
+      if config.verbose: print_nl("  %s Battery:%s   Signal:%s   Min Signal:%s   Last Update: %s   Longest Update: %s" % (key.ljust(key_size," "),battery_status,current_signal_status,minimum_signal_status,update_time,longest_update))
+
+   fid.close()
+   stats.save_stats()
+   signal_stats.save_signal_stats()
+   recent.save_recent()
+   file_dirty = False
+   return()
+
+#=============================================================================================
+# Update the status dictionary entry for a device with a new battery level and signal
+# strength.  Battery is a string ('-' if not reported) and signal is a string ('??' if not
+# reported).  update_time defaults to the current time; when it is given and the existing
+# entry is more recent, the entry is left unchanged and False is returned.  When the device
+# ID is given, accepted updates are also added to the device history.  update_epoch, when
+# given, is update_time in seconds since the epoch with its fraction of a second.
+#=============================================================================================
+def update_device_status(device_name, battery, signal, update_time=None, device_id=None, kind=history.kind_report, update_epoch=None):
+   global file_dirty
+
+   if update_time is None:
+      update_time = timestamp()
+      update_epoch = time.time()
+   elif update_epoch is None:
+      update_epoch = stats.table_time_to_epoch(update_time)
+
+   with status_lock:
+      device_stats = stats.get_stats(device_name)
+      if device_stats.last_time is not None and update_epoch < device_stats.last_time:
+         return(False)
+      gap = device_stats.observe(update_epoch)
+      signal_stats.observe(device_name, update_epoch, signal)
+
+      if device_name in dev_status_dictionary:
+         record=dev_status_dictionary[device_name]
+         prev_minimum=record[2]
+         longest_update=record[4]
+
+         if gap is not None and int(gap/60) > int(longest_update):
+            longest_update = str(int(gap/60))
+
+         # Minimum signal is the weakest reading of the last seven days
+         rolling = signal_stats.rolling_minimum(device_name)
+         if signal != '??':
+            if rolling is not None:
+               minimum_signal=str(rolling)
+            elif prev_minimum != '??':
+               minimum_signal=str(min(int(signal),int(prev_minimum)))
+            else:
+               minimum_signal=signal
+         else:
+            minimum_signal = '??'
+
+         if config.verbose: print("Previous: %s  Current: %s  New: %s" % (prev_minimum,signal,minimum_signal))
+
+      else:
+         # Device name not in dictionary
+         minimum_signal=signal
+         if config.verbose: print("NEW: Current: %s  New: %s" % (signal,minimum_signal))
+         longest_update='0'
+
+      dev_status_dictionary[device_name]=[battery,signal,minimum_signal,update_time,longest_update]
+      file_dirty = True
+      recent.append(device_name,update_epoch,battery,signal,kind)
+
+      if device_id is not None:
+         history.append(device_id,battery,signal,kind,update_epoch)
+   notify_change()
+   notify_contact(device_name)
+   notify_update(device_name,device_id,battery,signal,kind,update_epoch)
+   return(True)
+
+#=============================================================================================
+# Update only the last update time of a device, for messages which are sampled out (see
+# "sampled_events").  Battery, signal and history are left alone.
+#=============================================================================================
+def touch_device(device_name):
+   global file_dirty
+
+   now = time.time()
+   with status_lock:
+      record = dev_status_dictionary.get(device_name)
+      if record is None:
+         return(False)
+      gap = stats.get_stats(device_name).observe(now)
+      if gap is not None and int(gap/60) > int(record[4]):
+         record[4] = str(int(gap/60))
+      record[3] = timestamp()
+      file_dirty = True
+      recent.append(device_name,now,'-','??',history.kind_contact)
+   notify_change()
+   notify_contact(device_name)
+   return(True)
+
+#=============================================================================================
+# Apply a batch of updates, oldest first, each (device name, device ID, kind, battery,
+# signal, time in seconds since the epoch).  Kind is history.kind_report or
+# history.kind_contact, as for update_device_status() and record_contact(), or None for a
+# sampled-out event which only changes the last update time, as touch_device() does.
+#
+# Every update is added to the statistics, recent samples and history, and passed to the
+# update listeners, but each device's entry, minimum signal and last update time are worked
+# out once for the batch, and the change and contact listeners are called once.  Returns the
+# number of reports accepted.
+#=============================================================================================
+def apply_updates(updates):
+   global file_dirty
+
+   # Entry being built for each device: [battery, signal, minimum signal, time, longest
+   # update in minutes, lowest signal reported in the batch or None]
+   entries = {}
+   accepted = []
+   reports = 0
+   with status_lock:
+      for device_name, device_id, kind, battery, signal, t in updates:
+         device_stats = stats.get_stats(device_name)
+         if kind == history.kind_report and device_stats.last_time is not None and t < device_stats.last_time:
+            continue
+         entry = entries.get(device_name)
+         if entry is None:
+            record = dev_status_dictionary.get(device_name)
+            if record is not None:
+               entry = [record[0], record[1], record[2], t, int(record[4]), None]
+            elif kind is None:
+               continue
+            else:
+               entry = ['-', '??', '??', t, 0, None]
+            entries[device_name] = entry
+
+         gap = device_stats.observe(t)
+         if gap is not None and int(gap/60) > entry[4]:
+            entry[4] = int(gap/60)
+         entry[3] = t
+         if kind is None:
+            recent.append(device_name,t,'-','??',history.kind_contact)
+            continue
+
+         if kind == history.kind_report:
+            reports += 1
+            signal_stats.observe(device_name, t, signal)
+            entry[0] = battery
+            entry[1] = signal
+            if signal == '??':
+               entry[2] = '??'
+               entry[5] = None
+            else:
+               lowest = int(signal) if entry[5] is None else min(entry[5], int(signal))
+               entry[5] = lowest
+               entry[2] = lowest if entry[2] == '??' else min(lowest, int(entry[2]))
+         else:
+            entry[0] = '-'
+            entry[1] = '??'
+         recent.append(device_name,t,battery,signal,kind)
+         if device_id is not None:
+            history.append(device_id,battery,signal,kind,t)
+         accepted.append((device_name,device_id,battery,signal,kind,t))
+
+      # Minimum signal is the weakest reading of the last seven days
+      for device_name, entry in entries.items():
+         minimum = entry[2]
+         if entry[5] is not None:
+            rolling = signal_stats.rolling_minimum(device_name)
+            if rolling is not None:
+               minimum = rolling
+         dev_status_dictionary[device_name] = [entry[0], entry[1], str(minimum), unpack_unix_time(entry[3]*1000), str(entry[4])]
+      if len(entries) > 0:
+         file_dirty = True
+
+   if len(entries) > 0:
+      notify_change()
+   for device_name in entries:
+      notify_contact(device_name)
+   if len(update_listeners) > 0:
+      for update in accepted:
+         notify_update(*update)
+   return(reports)
+
+#=============================================================================================
+# Current status of all devices, for the display, alerts and metrics.  Returns a list of
+# (device name, entry, time of the last update in seconds since the epoch or None), sorted by
+# name.  Each entry is a copy, with the battery, signal and last update taken from
+# live_source where it is ahead of the dictionary.
+#=============================================================================================
+def current_status():
+   with status_lock:
+      devices = [(name, list(record), stats.get_stats(name).last_time) for name, record in dev_status_dictionary.items()]
+   devices.sort(key=lambda device: device[0])
+
+   source = live_source
+   result = []
+   for name, record, last_time in devices:
+      live = None if source is None else source(name)
+      if live is not None:
+         battery, signal, report_time, heard_time = live
+         if battery is not None and (last_time is None or report_time > last_time):
+            record[0] = battery
+            record[1] = signal
+            if signal != '??' and (record[2] == '??' or int(signal) < int(record[2])):
+               record[2] = signal
+         if last_time is None or heard_time > last_time:
+            record[3] = unpack_unix_time(heard_time*1000)
+            last_time = heard_time
+      result.append((name, record, last_time))
+   return(result)
+
+#=============================================================================================
+# Move the entry, report statistics and signal summaries of a device to a new name, when the
+# device has been renamed in the YoLink app.  Nothing is moved if there is already an entry
+# under the new name.
+#=============================================================================================
+def rename_device(old_name, new_name):
+   global file_dirty
+
+   with status_lock:
+      if old_name not in dev_status_dictionary or new_name in dev_status_dictionary:
+         return(False)
+      dev_status_dictionary[new_name] = dev_status_dictionary.pop(old_name)
+      if old_name in stats.device_stats:
+         stats.device_stats[new_name] = stats.device_stats.pop(old_name)
+      signal_stats.rename(old_name, new_name)
+      recent.rename(old_name, new_name)
+      file_dirty = True
+   for listener in rename_listeners:
+      listener(old_name, new_name)
+   notify_change()
+   return(True)
+
+#=============================================================================================
+# Record contact with a device that didn't report battery or signal (hub polls and events
+# which only show that the device is on line).  Battery and current signal are set to
+# unknown; minimum signal and longest update are kept.  The contact time defaults to now.
+#=============================================================================================
+def record_contact(device_name, device_id=None, contact_time=None):
+   global file_dirty
+
+   now = time.time()
+   update_time = timestamp()
+   if contact_time is not None:
+      now = contact_time
+      update_time = unpack_unix_time(contact_time*1000)
+   with status_lock:
+      gap = stats.get_stats(device_name).observe(now)
+
+      record = dev_status_dictionary.get(device_name)
+      if record is None:
+         minimum_signal = '??'
+         longest_update = '0'
+      else:
+         minimum_signal = record[2]
+         longest_update = record[4]
+         if gap is not None and int(gap/60) > int(longest_update):
+            longest_update = str(int(gap/60))
+
+      dev_status_dictionary[device_name]=['-','??',minimum_signal,update_time,longest_update]
+      file_dirty = True
+      recent.append(device_name,now,'-','??',history.kind_contact)
+
+      if device_id is not None:
+         history.append(device_id,'-','??',history.kind_contact,now)
+   notify_change()
+   notify_contact(device_name)
+   notify_update(device_name,device_id,'-','??',history.kind_contact,now)
+   return()
@@ -0,0 +1,294 @@
+#=============================================================================================
+# Hub topology and hub outages
+#
+# Every device reports through a hub, so when a hub goes off line all of its devices stop
+# reporting at once.  Rather than one "Not Updated" alert per device, the devices are
+# grouped by hub and one alert is sent for the hub:
+#
+#    Hub <name> and its <N> devices are dark
+#
+# The hub of each device is learned from the gatewayId of its messages (see
+# signal_stats.set_hub) or, for a device not yet heard through MQTT, is the only hub of its
+# home in the device catalog.
+#
+# Each device has a deadline: its last report plus its staleness threshold (see stats.py).
+# The deadlines are kept in a heap, so the check run once a minute only looks at devices
+# whose deadline has passed, and a report only touches the device and its hub.  A hub is
+# dark when at least "hub_outage_percent" of its devices (and at least
+# "hub_outage_min_devices") are past their deadline.  An alert is sent when a hub goes dark
+# and when its devices report again, and the daily status check lists dark hubs in place of
+# their devices.
+#
+# Hubs already dark when tracking starts (replicated from the previous active copy of a hot
+# standby pair, see standby.py) stay dark without a new alert.
+#=============================================================================================
+import time
+import heapq
+import threading
+
+from yl_health import config
+from yl_health import api
+from yl_health import store
+from yl_health import stats
+from yl_health import metrics
+from yl_health import signal_stats
+from yl_health.common import post, timestamp, print_nl
+
+# Hub ID of each device name, device names of each hub and the names of devices past their
+# deadline by hub
+hub_of = {}
+hub_devices = {}
+stale_devices = {}
+
+# Heap of (deadline, device name), with at most one entry for each device in "scheduled"
+deadlines = []
+scheduled = set()
+
+# Time each dark hub went dark, by hub ID
+dark_since = {}
+
+# Time tracking started.  Deadlines are no earlier than this plus the staleness threshold,
+# so devices have time to report after a restart.
+started = None
+
+# Functions called with (hub ID, time dark since) when a hub goes dark, and with (hub ID,
+# None) when it comes back (e.g. standby.py)
+hub_listeners = []
+
+topology_lock = threading.Lock()
+
+# Function to return the hub ID of a device, or None if it isn't known (or the device is a hub)
+def find_hub(device_name):
+   device = api.catalog.by_key.get(device_name)
+   if device is not None and device.type == 'Hub':
+      return(None)
+   hub_id = signal_stats.device_hub.get(device_name)
+   if hub_id is None and device is not None:
+      hubs = [hub for hub in api.catalog.hubs() if hub.home == device.home]
+      if len(hubs) == 1:
+         hub_id = hubs[0].id
+   return(hub_id)
+
+# Function to return the name of a hub from its ID
+def hub_name(hub_id):
+   hub = api.catalog.get(hub_id)
+   if hub is None:
+      return(hub_id)
+   return(hub.key)
+
+# Function to return the time after which a device is past its deadline
+def deadline_for(device_name):
+   device_stats = stats.get_stats(device_name)
+   last_time = device_stats.last_time
+   if last_time is None or last_time < started:
+      last_time = started
+   return(last_time + device_stats.stale_minutes()*60)
+
+# Function to move a device to a hub.  Called with topology_lock held.
+def move(device_name, hub_id):
+   old_hub = hub_of.get(device_name)
+   if old_hub is not None:
+      hub_devices[old_hub].discard(device_name)
+      stale_devices[old_hub].discard(device_name)
+   hub_of[device_name] = hub_id
+   hub_devices.setdefault(hub_id, set()).add(device_name)
+   stale_devices.setdefault(hub_id, set())
+   return(old_hub)
+
+#=============================================================================================
+# Check whether a hub has gone dark or come back.  Called with topology_lock held.  Returns
+# (event, hub ID, stale devices, devices, time dark since) for a change, otherwise None.
+#=============================================================================================
+def check_hub(hub_id, now=None):
+   if now is None:
+      now = time.time()
+   total = len(hub_devices.get(hub_id, ()))
+   stale = len(stale_devices.get(hub_id, ()))
+   dark = total >= max(1,config.hub_outage_min_devices) and stale*100 >= config.hub_outage_percent*total
+   if dark and hub_id not in dark_since:
+      dark_since[hub_id] = now
+      return(('dark', hub_id, stale, total, now))
+   if dark == False and hub_id in dark_since:
+      return(('back', hub_id, stale, total, dark_since.pop(hub_id)))
+   return(None)
+
+#=============================================================================================
+# Record that a device has been heard from.  Called for every accepted update (see
+# store.contact_listeners).
+#=============================================================================================
+def heard_from(device_name):
+   if started is None:
+      return()
+   hub_id = find_hub(device_name)
+   if hub_id is None:
+      return()
+
+   events = []
+   with topology_lock:
+      if hub_of.get(device_name) != hub_id:
+         old_hub = move(device_name, hub_id)
+         if old_hub is not None:
+            events.append(check_hub(old_hub))
+      if device_name not in scheduled:
+         heapq.heappush(deadlines, (deadline_for(device_name), device_name))
+         scheduled.add(device_name)
+      stale_devices[hub_id].discard(device_name)
+      events.append(check_hub(hub_id))
+   report(events)
+   return()
+
+#=============================================================================================
+# Mark devices past their deadline as stale.  Called once a minute from the main loop.
+#=============================================================================================
+def check_deadlines(now=None):
+   if started is None:
+      return()
+   if now is None:
+      now = time.time()
+
+   changed = set()
+   with topology_lock:
+      while len(deadlines) > 0 and deadlines[0][0] <= now:
+         device_name = heapq.heappop(deadlines)[1]
+         scheduled.discard(device_name)
+         hub_id = hub_of.get(device_name)
+         if hub_id is None:
+            continue
+         # The deadline moves on each time the device reports
+         deadline = deadline_for(device_name)
+         if deadline > now:
+            heapq.heappush(deadlines, (deadline, device_name))
+            scheduled.add(device_name)
+            continue
+         stale_devices[hub_id].add(device_name)
+         changed.add(hub_id)
+      events = [check_hub(hub_id, now) for hub_id in changed]
+   report(events)
+   return()
+
+# Function to report hubs which have gone dark or come back
+def report(events):
+   from yl_health.alerts import send_status_email
+
+   for event in events:
+      if event is None:
+         continue
+      change, hub_id, stale, total, since = event
+      for listener in hub_listeners:
+         listener(hub_id, since if change == 'dark' else None)
+      name = hub_name(hub_id)
+      if change == 'dark':
+         message = "%s Hub %s and its %s devices are dark (%s of %s devices not reporting)%s" % (timestamp(),name,stale,stale,total,hub_note(name))
+         subject = "Yolink Hub Outage"
+      else:
+         message = "%s Hub %s devices reporting again after %s hours (%s of %s devices not reporting)" % (timestamp(),name,round((time.time()-since)/3600,1),stale,total)
+         subject = "Yolink Hub Restored"
+      print_nl(message)
+      post(message)
+      send_status_email(subject, message)
+   return()
+
+# Function to return text with the last contact time of a hub, for alert messages
+def hub_note(name):
+   record = store.dev_status_dictionary.get(name)
+   if record is None:
+      return('')
+   return(" - hub last heard from at %s" % record[3])
+
+#=============================================================================================
+# Queries for the daily status check
+#=============================================================================================
+
+# Function to return True if a device is stale and its hub is dark
+def in_dark_hub(device_name):
+   with topology_lock:
+      hub_id = hub_of.get(device_name)
+      return(hub_id in dark_since and device_name in stale_devices[hub_id])
+
+# Function to return the alert text for each dark hub
+def dark_hub_alerts():
+   now = time.time()
+   alerts = []
+   with topology_lock:
+      dark = [(hub_id, len(stale_devices[hub_id]), len(hub_devices[hub_id]), since) for hub_id, since in dark_since.items()]
+   for hub_id, stale, total, since in sorted(dark, key=lambda d: hub_name(d[0])):
+      name = hub_name(hub_id)
+      alerts.append("%s Hub %s and its %s devices dark for %s hours (%s of %s devices not reporting)%s" %
+                    (timestamp(),name,stale,round((now-since)/3600,1),stale,total,hub_note(name)))
+   return(alerts)
+
+#=============================================================================================
+# Start tracking all devices in the status table.  Called once the device list is loaded.
+#=============================================================================================
+def start():
+   global started
+   started = time.time()
+
+   # Hubs already dark are set aside while the devices are added, so they aren't reported
+   # as back before any device has been found past its deadline
+   with topology_lock:
+      carried = dict(dark_since)
+      dark_since.clear()
+   for device_name in list(store.dev_status_dictionary):
+      heard_from(device_name)
+
+   # Devices of those hubs already past their deadline are stale at once, without the grace
+   # period after a restart.  A hub no longer dark is reported as back.
+   events = []
+   with topology_lock:
+      for hub_id, since in carried.items():
+         dark_since[hub_id] = since
+         if len(hub_devices.get(hub_id, ())) == 0:
+            continue
+         for device_name in hub_devices[hub_id]:
+            device_stats = stats.get_stats(device_name)
+            if device_stats.last_time is not None and device_stats.last_time + device_stats.stale_minutes()*60 <= started:
+               stale_devices[hub_id].add(device_name)
+         events.append(check_hub(hub_id, started))
+   report(events)
+   return()
+
+# Function to set a hub dark since the given time, or back (since=None), without an alert.
+# Called before tracking starts with the state replicated from the active copy.
+def restore_dark(hub_id, since):
+   with topology_lock:
+      if since is None:
+         dark_since.pop(hub_id, None)
+      else:
+         dark_since[hub_id] = since
+   return()
+
+# Function to move the hub of a renamed device to its new name
+def rename_device(old_name, new_name):
+   with topology_lock:
+      hub_id = hub_of.pop(old_name, None)
+      if hub_id is not None:
+         hub_of[new_name] = hub_id
+         hub_devices[hub_id].discard(old_name)
+         hub_devices[hub_id].add(new_name)
+         if old_name in stale_devices[hub_id]:
+            stale_devices[hub_id].discard(old_name)
+            stale_devices[hub_id].add(new_name)
+      if old_name in scheduled:
+         scheduled.discard(old_name)
+         scheduled.add(new_name)
+         heapq.heappush(deadlines, (deadline_for(new_name), new_name))
+   return()
+
+# Function to add the devices and stale devices of each hub to the metrics file
+def hub_metrics():
+   with topology_lock:
+      counts = [(hub_id, len(hub_devices[hub_id]), len(stale_devices[hub_id]), hub_id in dark_since) for hub_id in hub_devices]
+   for hub_id, total, stale, dark in counts:
+      labels = '{hub="%s"}' % metrics.label(hub_name(hub_id))
+      metrics.set_gauge('yolink_hub_devices'+labels, total)
+      metrics.set_gauge('yolink_hub_stale_devices'+labels, stale)
+      metrics.set_gauge('yolink_hub_dark'+labels, 1 if dark else 0)
+   return()
+
+store.contact_listeners.append(heard_from)
+store.rename_listeners.append(rename_device)
+metrics.collectors.append(hub_metrics)
+metrics.describe('yolink_hub_devices', 'Devices reporting through the hub')
+metrics.describe('yolink_hub_stale_devices', 'Devices of the hub past their staleness threshold')
+metrics.describe('yolink_hub_dark', '1 while most devices of the hub are not reporting')